@@ -0,0 +1,5 @@
+from connquality.benchmark import start_benchmark
+
+
+if __name__ == "__main__":
+    start_benchmark()
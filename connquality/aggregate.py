@@ -0,0 +1,119 @@
+"""
+Streaming aggregation into fixed time buckets
+"""
+
+import numpy
+
+
+class BucketAggregator(object):
+    """
+    Folds records into a fixed number of time buckets as they are read, so
+    memory use only depends on the number of buckets
+    """
+
+    def __init__(self, start, end, buckets):
+        """
+        :param start: Unix timestamp of the start of the first bucket
+        :param end: Unix timestamp of the end of the last bucket
+        :param buckets: Number of buckets
+        """
+
+        self.start = start
+        self.end = end
+        self.buckets = buckets
+        self.width = max(float(end - start) / buckets, 1E-6)
+
+        self.samples = numpy.zeros(buckets, dtype=numpy.int64)
+        self.count = numpy.zeros(buckets, dtype=numpy.int64)
+        self.sum = numpy.zeros(buckets)
+        self.min = numpy.full(buckets, numpy.inf)
+        self.max = numpy.full(buckets, -numpy.inf)
+        self.worst = numpy.zeros(buckets)
+
+    def add(self, timestamps, latencies, statuses):
+        """
+        Fold a chunk of records into the buckets, records outside the range
+        are ignored
+
+        :param timestamps: numpy array of unix timestamps
+        :param latencies: numpy array of latencies, NaN for failed checks
+        :param statuses: numpy array of Reader.STATUSES values
+        """
+
+        inside = (timestamps >= self.start) & (timestamps <= self.end)
+        if not inside.all():
+            timestamps = timestamps[inside]
+            latencies = latencies[inside]
+            statuses = statuses[inside]
+
+        if not len(timestamps):
+            return
+
+        buckets = ((timestamps - self.start) / self.width).astype(numpy.int64)
+        numpy.minimum(buckets, self.buckets - 1, out=buckets)
+
+        self.samples += numpy.bincount(buckets, minlength=self.buckets)
+        numpy.maximum.at(self.worst, buckets, statuses)
+
+        # Failed checks only count towards the status
+        valid = ~numpy.isnan(latencies)
+        buckets = buckets[valid]
+        latencies = numpy.asarray(latencies[valid], dtype=numpy.float64)
+
+        self.count += numpy.bincount(buckets, minlength=self.buckets)
+        self.sum += numpy.bincount(buckets, weights=latencies,
+                                   minlength=self.buckets)
+        numpy.minimum.at(self.min, buckets, latencies)
+        numpy.maximum.at(self.max, buckets, latencies)
+
+    def add_rollups(self, columns):
+        """
+        Fold rollups into the buckets, a rollup goes into the bucket its
+        middle falls in. The caller picks the rollups overlapping the range,
+        the ones sticking out of it go into the first or last bucket.
+
+        :param columns: Dict from parser.rollup_columns
+        """
+
+        if not len(columns["timestamps"]):
+            return
+
+        buckets = numpy.floor((columns["timestamps"] - self.start) /
+                              self.width).astype(numpy.int64)
+        numpy.clip(buckets, 0, self.buckets - 1, out=buckets)
+
+        counts = numpy.bincount(buckets, weights=columns["counts"],
+                                minlength=self.buckets).astype(numpy.int64)
+        self.samples += counts
+        self.count += counts
+        self.sum += numpy.bincount(buckets, weights=columns["sums"],
+                                   minlength=self.buckets)
+        numpy.maximum.at(self.worst, buckets, columns["statuses"])
+        numpy.minimum.at(self.min, buckets, columns["mins"])
+        numpy.maximum.at(self.max, buckets, columns["maxes"])
+
+    def get_columns(self):
+        """
+        Get the aggregates of the buckets that got any records
+
+        :return: Dict of column name to numpy array, with the mean latency of
+                 each bucket in latencies and its range in latency_min and
+                 latency_max, datetimes and targets are None
+        """
+
+        used = self.samples > 0
+        count = self.count[used]
+        centers = self.start + (numpy.arange(self.buckets) + 0.5) * self.width
+
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            latencies = self.sum[used] / count
+
+        return {
+            "timestamps": centers[used],
+            "datetimes": None,
+            "latencies": latencies,
+            "latency_min": numpy.where(count, self.min[used], numpy.nan),
+            "latency_max": numpy.where(count, self.max[used], numpy.nan),
+            "statuses": self.worst[used],
+            "targets": None
+        }
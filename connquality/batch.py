@@ -0,0 +1,316 @@
+"""
+Rendering many graphs in one go, every log is read once and the graphs are
+drawn in parallel worker processes
+"""
+
+import json
+import time
+import logging
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from connquality.logformat import is_binary
+from connquality.parser import map_binary, binary_columns, iter_columns, \
+    concatenate
+from connquality.rotation import find_segments
+from connquality.outages import OutageFinder, query_outages
+from connquality.downsample import MODE_LTTB
+from connquality.graph import Reader, Graph
+
+DEFAULT_DPI = 100.0
+
+DURATION_UNITS = {
+    "s": 1,
+    "m": 60,
+    "h": 60 * 60,
+    "d": 24 * 60 * 60,
+    "w": 7 * 24 * 60 * 60
+}
+
+
+def parse_duration(duration):
+    """
+    Parse a duration like "90", "30m", "24h" or "7d" into seconds
+
+    :param duration: Number of seconds, optionally with a unit suffix
+    :return: Number of seconds
+    """
+
+    duration = str(duration).strip()
+    multiplier = 1
+
+    if duration and duration[-1] in DURATION_UNITS:
+        multiplier = DURATION_UNITS[duration[-1]]
+        duration = duration[:-1]
+
+    try:
+        seconds = float(duration) * multiplier
+    except ValueError:
+        raise ValueError("Duration {0} doesn't look valid (expected e.g. "
+                         "3600, 30m, 24h or 7d)".format(duration))
+
+    if seconds <= 0:
+        raise ValueError("Duration must be positive, got {0}".format(seconds))
+
+    return seconds
+
+
+def load_manifest(filename):
+    """
+    Load the list of graphs to render. The manifest is a JSON list of jobs,
+    each with a "logfile" and an "outfile", and optionally "dpi",
+    "datapoints", "downsample", "start" and "end" (ISO 8601) or "window",
+    a duration back from the end or from now.
+
+    :param filename: Path to the manifest
+    :return: List of job dicts
+    """
+
+    with open(filename) as f:
+        jobs = json.load(f)
+
+    if not isinstance(jobs, list):
+        raise ValueError("Manifest {0} should contain a list of "
+                         "jobs".format(filename))
+
+    for job in jobs:
+        for key in ("logfile", "outfile"):
+            if key not in job:
+                raise ValueError("Job {0} has no {1}".format(job, key))
+
+    return jobs
+
+
+def get_window(job, reader, now=None):
+    """
+    Get the time range of a job
+
+    :param job: Job dict
+    :param reader: Reader for parsing ISO 8601 timestamps
+    :param now: Unix timestamp windows without an end end at
+    :return: start, end unix timestamps, either can be None
+    """
+
+    start = job.get("start")
+    end = job.get("end")
+
+    start = reader._iso8601_to_time(start) if start else None
+    end = reader._iso8601_to_time(end) if end else None
+
+    if job.get("window"):
+        if end is None:
+            end = time.time() if now is None else now
+        start = end - parse_duration(job["window"])
+
+    return start, end
+
+
+def _get_range(windows):
+    """
+    Get the time range covering all the windows
+
+    :return: start, end unix timestamps, either can be None
+    """
+
+    starts = [start for start, _ in windows]
+    ends = [end for _, end in windows]
+
+    start = None if None in starts else min(starts)
+    end = None if None in ends else max(ends)
+
+    return start, end
+
+
+def _read_log(logfile, windows, logger, processes=None):
+    """
+    Read the part of a log all the windows need
+
+    :return: Dict of column name to numpy array
+    """
+
+    start, end = _get_range(windows)
+
+    segments = find_segments(logfile, start, end)
+    if segments != [logfile]:
+        return concatenate([
+            columns
+            for segment in segments
+            for columns in iter_columns(segment, start, end, logger=logger)
+        ])
+
+    if is_binary(logfile):
+        # Memory mapped, jobs only touch their own range
+        return binary_columns(map_binary(logfile))
+
+    return Reader()._read_text(logfile, start, end, logger, processes)
+
+
+def render_job(job, reader):
+    """
+    Draw the graph of a single job, run in the worker processes
+
+    :param job: Job dict
+    :param reader: Reader with the data to draw
+    :return: outfile, error message or None
+    """
+
+    options = argparse.Namespace(
+        outfile=job["outfile"],
+        dpi=job.get("dpi", DEFAULT_DPI)
+    )
+
+    graph = Graph(options)
+    graph.logger = logging.getLogger("connquality")
+
+    try:
+        graph._draw_graph(reader)
+    except Exception:
+        return job["outfile"], traceback.format_exc()
+
+    return job["outfile"], None
+
+
+def _render(tasks, processes):
+    """
+    Render jobs in one pool of worker processes
+
+    :param tasks: List of (job, reader) tuples
+    :param processes: Number of worker processes
+    :return: List of (outfile, error message or None) tuples in job order,
+             None for the jobs lost when a worker died
+    """
+
+    results = []
+
+    with ProcessPoolExecutor(processes) as executor:
+        futures = [
+            executor.submit(render_job, job, reader) for job, reader in tasks
+        ]
+
+        for future in futures:
+            try:
+                results.append(future.result())
+            except BrokenProcessPool:
+                results.append(None)
+
+    return results
+
+
+def _render_alone(tasks, processes):
+    """
+    Render jobs every one in a worker process of its own, processes of them
+    at a time, so a job killing its worker only fails itself
+
+    :param tasks: List of (job, reader) tuples
+    :param processes: Number of jobs to render at a time
+    :return: List of (outfile, error message or None) tuples in job order
+    """
+
+    results = []
+
+    for offset in range(0, len(tasks), processes):
+        group = tasks[offset:offset + processes]
+        executors = [ProcessPoolExecutor(1) for _ in group]
+        futures = [
+            executor.submit(render_job, job, reader)
+            for executor, (job, reader) in zip(executors, group)
+        ]
+
+        for (job, _), future in zip(group, futures):
+            try:
+                results.append(future.result())
+            except BrokenProcessPool:
+                results.append((job["outfile"], "Worker process died"))
+
+        for executor in executors:
+            executor.shutdown()
+
+    return results
+
+
+def run_batch(jobs, processes=None, logger=None):
+    """
+    Render the graphs of all the jobs, reading every log only once
+
+    :param jobs: List of job dicts, see load_manifest
+    :param processes: Number of worker processes, defaults to CPU count
+    :param logger: Optional logger
+    :return: Number of failed jobs
+    """
+
+    logger = logger or logging.getLogger("connquality")
+    now = time.time()
+
+    # Jobs per log, in the order the logs first appear
+    logfiles = []
+    log_jobs = {}
+    for job in jobs:
+        if job["logfile"] not in log_jobs:
+            logfiles.append(job["logfile"])
+            log_jobs[job["logfile"]] = []
+        log_jobs[job["logfile"]].append(job)
+
+    failures = 0
+    tasks = []
+
+    for logfile in logfiles:
+        windows = [
+            get_window(job, Reader(), now) for job in log_jobs[logfile]
+        ]
+
+        logger.info("Reading {0}".format(logfile))
+
+        try:
+            columns = _read_log(logfile, windows, logger, processes)
+        except (IOError, OSError, ValueError) as err:
+            logger.error("Could not read {0}: {1}".format(logfile, err))
+            failures += len(windows)
+            continue
+
+        # Found in every entry read for the windows, before downsampling
+        finder = OutageFinder()
+        finder.add_columns(columns)
+        outages = finder.get_outages()
+
+        # The workers only get what they draw, the log stays here
+        for job, (start, end) in zip(log_jobs[logfile], windows):
+            reader = Reader()
+            reader._assign(columns, start, end, job.get("datapoints"),
+                           job.get("downsample", MODE_LTTB))
+            reader.outages = query_outages(outages, start, end)
+            tasks.append((job, reader))
+
+    if not tasks:
+        return failures
+
+    # Started once the logs are read, parsing them may use processes too
+    results = _render(tasks, processes)
+
+    # A worker was killed, e.g. crashed or ran out of memory, and the pool
+    # lost the jobs of the other workers with it. They run again in workers
+    # of their own, so only the job that killed its worker fails.
+    lost = [index for index, result in enumerate(results) if result is None]
+    if lost:
+        logger.warning("A worker process died, rendering {0} unfinished "
+                       "jobs again".format(len(lost)))
+
+        retried = _render_alone(
+            [tasks[index] for index in lost],
+            processes or multiprocessing.cpu_count()
+        )
+        for index, result in zip(lost, retried):
+            results[index] = result
+
+    for outfile, error in results:
+        if error:
+            logger.error("Failed to render {0}:\n{1}".format(
+                outfile, error
+            ))
+            failures += 1
+        else:
+            logger.info("Wrote {0}".format(outfile))
+
+    return failures
@@ -0,0 +1,673 @@
+"""
+Benchmarks of reading, downsampling and drawing logs and of running checks,
+on synthetic logs and fake sockets so the results only depend on the code
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import errno
+import random
+import socket
+import logging
+import argparse
+import platform
+import shutil
+import tempfile
+import subprocess
+import numpy
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2, no peak memory
+    tracemalloc = None
+
+from connquality.monitor import Monitor, TCPCheck, parse_options as \
+    parse_monitor_options
+from connquality.logformat import FORMATS, FORMAT_AGGREGATE, FORMAT_TARGETS, \
+    FORMAT_BINARY, BINARY_HEADER, BINARY_MAGIC, BINARY_VERSION, \
+    STATUS_CODES, STATUS_OK, STATUS_DEGRADED, STATUS_ERROR, NO_ERROR, \
+    format_timestamp, get_writer
+from connquality.parser import BINARY_DTYPE, epoch_to_local, iter_columns, \
+    concatenate
+from connquality.downsample import MODE_LTTB
+from connquality.scheduler import get_monotonic_clock
+from connquality.index import INDEX_SUFFIX
+from connquality.cache import CACHE_SUFFIX
+from connquality.outages import OUTAGES_SUFFIX
+
+# Bump when the results change so they can't be compared anymore
+BENCHMARK_VERSION = 2
+
+BENCHMARKS = ["read", "read_datapoints", "downsample", "draw", "run_checks"]
+
+DEFAULT_START = 1420919736.0
+DEFAULT_INTERVAL = 30.0
+
+# Entries generated at once, bounds the memory use of huge logs
+GENERATE_CHUNK_SIZE = 1000000
+
+# Chance of an outage or a latency spike starting at any entry
+OUTAGE_RATE = 0.001
+SPIKE_RATE = 0.01
+
+# Mean number of entries an outage lasts
+OUTAGE_LENGTH = 20
+
+TIMEOUT = 3.0
+
+TARGETS = ["google.com:80", "example.com:80", "github.com:443"]
+
+# The draw benchmark draws this many data points, like a typical graph
+DRAW_DATA_POINTS = 2000
+
+# The run_checks benchmark runs this many rounds of this many checks
+CHECK_COUNT = 10
+CHECK_ROUNDS = 1000
+CHECK_FAILURE_RATE = 0.01
+
+# Files kept next to a log, removed before every run. Only ever those of
+# the copy of the log in the work directory, a monitor may be writing to the
+# ones of the original.
+SIDECAR_SUFFIXES = [CACHE_SUFFIX, OUTAGES_SUFFIX, INDEX_SUFFIX]
+
+
+def parse_count(value):
+    """
+    Parse a count like "10000" or "1e6"
+
+    :param value: Number as a string
+    :return: int
+    """
+
+    try:
+        count = int(float(value))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "{0} doesn't look like a number".format(value)
+        )
+
+    if count <= 0:
+        raise argparse.ArgumentTypeError("Count must be positive")
+
+    return count
+
+
+class LogGenerator(object):
+    """
+    Generates realistic logs: lognormal latencies with occasional spikes, and
+    outages of ERROR or DEGRADED lasting a geometrically distributed number of
+    entries
+    """
+
+    def __init__(self, seed=0, start=DEFAULT_START,
+                 interval=DEFAULT_INTERVAL, outage_rate=OUTAGE_RATE,
+                 spike_rate=SPIKE_RATE, outage_length=OUTAGE_LENGTH):
+        self.random = numpy.random.RandomState(seed)
+        self.start = start
+        self.interval = interval
+        self.outage_rate = outage_rate
+        self.spike_rate = spike_rate
+        self.outage_length = outage_length
+
+        self.entries = 0
+
+        # Status code and entries left of an outage continuing to the next
+        # chunk
+        self.outage_status = None
+        self.outage_left = 0
+
+    def _get_statuses(self, count):
+        statuses = numpy.zeros(count, dtype=numpy.uint8)
+        statuses[:] = STATUS_CODES[STATUS_OK]
+
+        if self.outage_left:
+            statuses[:self.outage_left] = self.outage_status
+            self.outage_left = max(self.outage_left - count, 0)
+
+        starts = numpy.nonzero(
+            self.random.random_sample(count) < self.outage_rate
+        )[0]
+        lengths = self.random.geometric(1.0 / self.outage_length,
+                                        len(starts))
+        errors = self.random.random_sample(len(starts)) < 0.5
+
+        for start, length, error in zip(starts, lengths, errors):
+            status = STATUS_CODES[STATUS_ERROR if error else STATUS_DEGRADED]
+            statuses[start:start + length] = status
+
+            if start + length > count:
+                self.outage_status = status
+                self.outage_left = start + length - count
+
+        return statuses
+
+    def generate(self, count):
+        """
+        Generate the next entries
+
+        :param count: Number of entries
+        :return: timestamps, latencies, binary status codes
+        """
+
+        timestamps = self.start + self.interval * (
+            self.entries + numpy.arange(count, dtype=numpy.float64)
+        )
+        timestamps += self.random.uniform(0, 0.05, count)
+        self.entries += count
+
+        latencies = self.random.lognormal(numpy.log(0.03), 0.25, count)
+
+        spikes = self.random.random_sample(count) < self.spike_rate
+        latencies[spikes] *= self.random.uniform(5, 50, spikes.sum())
+
+        statuses = self._get_statuses(count)
+        latencies[statuses == STATUS_CODES[STATUS_DEGRADED]] *= 2
+        latencies[statuses == STATUS_CODES[STATUS_ERROR]] = TIMEOUT
+
+        return timestamps, latencies.round(6), statuses
+
+
+def _format_lines(timestamps, latencies, statuses, targets=None):
+    """
+    Format text log lines
+
+    :param targets: Optional numpy array of targets for per-target lines
+    :return: Bytes
+    """
+
+    status_names = numpy.empty(max(STATUS_CODES.values()) + 1,
+                               dtype=object)
+    for status, code in STATUS_CODES.items():
+        status_names[code] = status
+
+    times = numpy.datetime_as_string(epoch_to_local(timestamps), unit="us")
+    names = status_names[statuses]
+
+    if targets is None:
+        fields = [times, latencies.astype(str), names]
+    else:
+        failed = statuses != STATUS_CODES[STATUS_OK]
+        latencies = numpy.where(failed, numpy.nan, latencies)
+        names = numpy.where(failed, "TIMEOUT", NO_ERROR)
+        fields = [times, targets, latencies.astype(str), names]
+
+    lines = "".join([
+        "\t".join(line) + "\n" for line in zip(*[
+            field.tolist() for field in fields
+        ])
+    ])
+
+    return lines.encode()
+
+
+def generate_log(filename, lines, log_format=FORMAT_AGGREGATE, seed=0,
+                 **kwargs):
+    """
+    Write a synthetic log
+
+    :param filename: Path to write to, replaced if it exists
+    :param lines: Number of lines, or records for binary logs
+    :param log_format: One of logformat.FORMATS
+    :param seed: Random seed, the same seed gives the same log
+    :param kwargs: Passed on to LogGenerator
+    :return: Number of bytes written
+    """
+
+    generator = LogGenerator(seed, **kwargs)
+    per_entry = len(TARGETS) if log_format == FORMAT_TARGETS else 1
+    entries = -(-lines // per_entry)
+
+    with open(filename, 'wb') as f:
+        if log_format == FORMAT_BINARY:
+            f.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION,
+                                       BINARY_HEADER.size,
+                                       BINARY_DTYPE.itemsize))
+
+        written = 0
+        while written < entries:
+            count = min(GENERATE_CHUNK_SIZE, entries - written)
+            timestamps, latencies, statuses = generator.generate(count)
+            written += count
+
+            if log_format == FORMAT_BINARY:
+                records = numpy.zeros(count, dtype=BINARY_DTYPE)
+                records["timestamp"] = timestamps
+                records["latency"] = latencies
+                records["status"] = statuses
+                f.write(records.tobytes())
+            elif log_format == FORMAT_TARGETS:
+                # Every target gets a line per entry, only the first one is
+                # affected by the outages
+                repeated = numpy.repeat(timestamps, per_entry)
+                target_statuses = numpy.zeros(count * per_entry,
+                                              dtype=numpy.uint8)
+                target_statuses[::per_entry] = statuses
+                f.write(_format_lines(
+                    repeated, numpy.repeat(latencies, per_entry),
+                    target_statuses, numpy.tile(TARGETS, count)
+                ))
+            else:
+                f.write(_format_lines(timestamps, latencies, statuses))
+
+        return f.tell()
+
+
+class FakeSocket(object):
+    """
+    Stands in for a socket, nothing is sent anywhere
+    """
+
+    def close(self):
+        pass
+
+
+class FakeTCPCheck(TCPCheck):
+    """
+    TCPCheck on a fake socket layer, connects immediately and fails at the
+    given rate. Only works with the serial engine, the async engine needs
+    real sockets.
+    """
+
+    def __init__(self, destination, failure_rate=0.0, seed=0, logger=None):
+        super(FakeTCPCheck, self).__init__(destination, logger)
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+
+    def _resolve(self):
+        return "127.0.0.1", self.port
+
+    def _get_socket(self):
+        return FakeSocket()
+
+    def _connect(self, soc):
+        if self.random.random() < self.failure_rate:
+            raise socket.error(errno.ECONNREFUSED, "Connection refused")
+
+
+def measure(function, setup=None, repeat=1, memory=True):
+    """
+    Time a function, the best of repeat runs, and find its peak memory use in
+    one more run as tracing memory slows it down
+
+    :param function: Function to measure, returns the number of items it
+                     handled
+    :param setup: Optional function to call before every run, not timed
+    :param repeat: Number of timed runs
+    :param memory: Also measure the peak memory use
+    :return: Dict of items, seconds, throughput (items per second) and
+             peak_memory (bytes, None if not measured)
+    """
+
+    clock = get_monotonic_clock()
+    best = None
+    items = None
+
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+
+        start = clock()
+        items = function()
+        elapsed = clock() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    peak_memory = None
+    if memory and tracemalloc:
+        if setup:
+            setup()
+        gc.collect()
+
+        tracemalloc.start()
+        try:
+            function()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {
+        "items": items,
+        "seconds": best,
+        "throughput": items / best if best > 0 else None,
+        "peak_memory": peak_memory
+    }
+
+
+def _remove_sidecars(filename):
+    for suffix in SIDECAR_SUFFIXES:
+        if os.path.exists(filename + suffix):
+            os.unlink(filename + suffix)
+
+
+def _get_benchmark(name, filename, workdir):
+    """
+    Get the functions of a benchmark
+
+    :return: function, setup function or None
+    """
+
+    # Imported here as graphing loads the plotting libraries
+    from connquality.graph import Reader, Graph
+
+    def setup_read():
+        _remove_sidecars(filename)
+
+    if name == "read":
+        def read():
+            reader = Reader()
+            reader.read(filename)
+            return reader.entries
+
+        return read, setup_read
+
+    if name == "read_datapoints":
+        def read_datapoints():
+            reader = Reader()
+            reader.read(filename, data_points=DRAW_DATA_POINTS)
+            return reader.entries
+
+        return read_datapoints, setup_read
+
+    if name == "downsample":
+        columns = concatenate(list(iter_columns(filename)))
+
+        def downsample_columns():
+            reader = Reader()
+            reader._assign(dict(columns), data_points=DRAW_DATA_POINTS,
+                           mode=MODE_LTTB)
+            return reader.entries
+
+        return downsample_columns, None
+
+    if name == "draw":
+        reader = Reader()
+        reader.read(filename, data_points=DRAW_DATA_POINTS)
+
+        options = argparse.Namespace(
+            outfile=os.path.join(workdir, "graph.png"), dpi=100.0
+        )
+
+        def draw():
+            graph = Graph(options)
+            graph.logger = logging.getLogger("connquality.benchmark")
+            graph._draw_graph(reader)
+            return len(reader.latencies)
+
+        return draw, None
+
+    if name == "run_checks":
+        logfile = os.path.join(workdir, "checks.log")
+
+        def setup_checks():
+            _remove_sidecars(logfile)
+            if os.path.exists(logfile):
+                os.unlink(logfile)
+
+        def run_checks():
+            monitor = Monitor(parse_monitor_options([
+                "--tcp=benchmark:1", "--engine=serial", "--format",
+                FORMAT_TARGETS, "--logfile", logfile
+            ]))
+            monitor.checks = [
+                FakeTCPCheck("target{0}:80".format(number),
+                             CHECK_FAILURE_RATE, number)
+                for number in range(CHECK_COUNT)
+            ]
+            monitor.writer = get_writer(FORMAT_TARGETS, logfile)
+
+            try:
+                for _ in range(CHECK_ROUNDS):
+                    monitor._run_checks(monitor.checks)
+            finally:
+                monitor.writer.close()
+
+            return CHECK_COUNT * CHECK_ROUNDS
+
+        return run_checks, setup_checks
+
+    raise ValueError("Unknown benchmark {0}".format(name))
+
+
+def _get_commit():
+    """
+    Get the git commit being benchmarked, None outside a git checkout
+    """
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], cwd=directory, stderr=devnull
+            )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return output.decode().strip()
+
+
+def run_benchmarks(filename, names=None, repeat=3, memory=True,
+                   workdir=None, logger=None):
+    """
+    Run benchmarks on a log, copied to the work directory first unless it's
+    already there
+
+    :param filename: Path to the log, e.g. from generate_log
+    :param names: Benchmarks to run, defaults to all of BENCHMARKS
+    :param repeat: Number of timed runs of each benchmark
+    :param memory: Also measure the peak memory use
+    :param workdir: Directory for the files the benchmarks write, a
+                    temporary directory by default
+    :return: Dict of the results and the environment they were measured in
+    """
+
+    temporary = workdir is None
+    if temporary:
+        workdir = tempfile.mkdtemp(prefix="connquality-benchmark-")
+
+    # Keeps the name, compressed logs are recognized by it
+    logfile = os.path.join(workdir, os.path.basename(filename))
+    copied = os.path.abspath(filename) != os.path.abspath(logfile)
+
+    results = []
+    try:
+        if copied:
+            shutil.copyfile(filename, logfile)
+
+        for name in names or BENCHMARKS:
+            if logger:
+                logger.info("Running {0}".format(name))
+
+            function, setup = _get_benchmark(name, logfile, workdir)
+            result = measure(function, setup, repeat, memory)
+            result["name"] = name
+            results.append(result)
+
+            if logger:
+                logger.info(format_result(result))
+    finally:
+        if temporary:
+            shutil.rmtree(workdir)
+        else:
+            _remove_sidecars(logfile)
+            if copied and os.path.exists(logfile):
+                os.unlink(logfile)
+
+    return {
+        "version": BENCHMARK_VERSION,
+        "created": format_timestamp(time.time()),
+        "commit": _get_commit(),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "platform": platform.platform()
+        },
+        "log": {
+            "size": os.path.getsize(filename)
+        },
+        "results": results
+    }
+
+
+def format_result(result):
+    """
+    Format the result of a benchmark for humans
+
+    :param result: Dict from measure with a name
+    :return: String
+    """
+
+    text = "{0:<16} {1:>10.4f} s {2:>14,.0f} items/s".format(
+        result["name"], result["seconds"], result["throughput"] or 0
+    )
+
+    if result["peak_memory"] is not None:
+        text += " {0:>10.1f} MiB peak".format(
+            result["peak_memory"] / 1024.0 / 1024.0
+        )
+
+    return text
+
+
+def compare_results(previous, current):
+    """
+    Compare the results of two runs
+
+    :param previous: Dict from run_benchmarks
+    :param current: Dict from run_benchmarks
+    :return: List of (name, previous seconds, current seconds, change in
+             percent) for the benchmarks in both, positive is slower
+    """
+
+    if previous.get("version") != current.get("version"):
+        raise ValueError("Results of benchmark version {0} and {1} can't be "
+                         "compared".format(previous.get("version"),
+                                           current.get("version")))
+
+    before = dict(
+        (result["name"], result["seconds"]) for result in previous["results"]
+    )
+
+    changes = []
+    for result in current["results"]:
+        if result["name"] not in before:
+            continue
+
+        old = before[result["name"]]
+        change = 100.0 * (result["seconds"] - old) / old if old else 0.0
+        changes.append((result["name"], old, result["seconds"], change))
+
+    return changes
+
+
+def parse_options(args):
+    """
+    Parse commandline arguments into options for the benchmarks
+
+    :param args:
+    :return:
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", default=100000, type=parse_count,
+                        help="Number of lines in the synthetic log, e.g. 1e4 "
+                             "to 1e8")
+    parser.add_argument("--format", default=FORMAT_AGGREGATE,
+                        choices=FORMATS,
+                        help="Format of the synthetic log")
+    parser.add_argument("--logfile", default=None,
+                        help="Benchmark an existing log instead of a "
+                             "synthetic one")
+    parser.add_argument("--benchmark", dest="benchmarks", action="append",
+                        choices=BENCHMARKS,
+                        help="Only run this benchmark, can be given many "
+                             "times")
+    parser.add_argument("--repeat", default=3, type=int,
+                        help="Take the best time of this many runs")
+    parser.add_argument("--no-memory", dest="memory", default=True,
+                        action="store_false",
+                        help="Don't measure the peak memory use, which takes "
+                             "another run of every benchmark")
+    parser.add_argument("--output", default=None,
+                        help="Write the results to this JSON file")
+    parser.add_argument("--compare", default=None,
+                        help="Compare to the results in this JSON file")
+    parser.add_argument("--max-slowdown", default=None, type=float,
+                        help="Exit with an error when a benchmark is this "
+                             "many percent slower than in --compare")
+    parser.add_argument("--seed", default=0, type=int,
+                        help="Random seed of the synthetic log")
+
+    return parser.parse_args(args)
+
+
+def start_benchmark():
+    """
+    Start the benchmark application
+    """
+
+    options = parse_options(sys.argv[1:])
+
+    logger = logging.getLogger("connquality")
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler()
+    handler.setFormatter(
+        logging.Formatter('%(asctime)s [%(levelname)8s] %(message)s')
+    )
+    logger.addHandler(handler)
+
+    workdir = tempfile.mkdtemp(prefix="connquality-benchmark-")
+
+    try:
+        # Benchmarked through a copy, the sidecars of the log are left alone
+        filename = options.logfile
+        log = {}
+
+        if filename is None:
+            filename = os.path.join(workdir, "connection.log")
+            logger.info("Generating {0} lines of {1} log".format(
+                options.lines, options.format
+            ))
+
+            clock = get_monotonic_clock()
+            start = clock()
+            generate_log(filename, options.lines, options.format,
+                         options.seed)
+            logger.info("Generated in {0:.1f}s".format(clock() - start))
+
+            log = {"lines": options.lines, "format": options.format,
+                   "seed": options.seed}
+
+        results = run_benchmarks(filename, options.benchmarks,
+                                 options.repeat, options.memory, workdir,
+                                 logger)
+        results["log"].update(log)
+    finally:
+        shutil.rmtree(workdir)
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as f:
+            previous = json.load(f)
+
+        slower = []
+        for name, old, new, change in compare_results(previous, results):
+            print("{0:<16} {1:>10.4f} s -> {2:>10.4f} s {3:>+8.1f} %".format(
+                name, old, new, change
+            ))
+
+            if options.max_slowdown is not None and \
+                    change > options.max_slowdown:
+                slower.append(name)
+
+        if slower:
+            sys.exit("Slower than allowed: {0}".format(", ".join(slower)))
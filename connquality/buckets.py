@@ -0,0 +1,58 @@
+"""
+Logarithmic latency buckets shared by the statistics histograms and the
+quantile sketches. Bucket i holds the latencies from LATENCY_MIN *
+LATENCY_GAMMA ** i up to the next bucket, so the middle of a bucket is within
+1% of any latency in it.
+"""
+
+import math
+
+LATENCY_MIN = 0.0001
+LATENCY_GAMMA = 1.02
+LATENCY_BUCKETS = 1000
+
+_LOG_GAMMA = math.log(LATENCY_GAMMA)
+
+
+def get_bucket(latency):
+    """
+    Find the bucket of a latency
+
+    :param latency: Latency in seconds
+    :return: Bucket index
+    """
+
+    bucket = int(math.log(max(latency, LATENCY_MIN) / LATENCY_MIN) /
+                 _LOG_GAMMA)
+
+    return min(bucket, LATENCY_BUCKETS - 1)
+
+
+def get_bucket_latency(bucket):
+    """
+    Get the latency in the middle of a bucket
+
+    :param bucket: Bucket index
+    :return: Latency in seconds
+    """
+
+    return LATENCY_MIN * LATENCY_GAMMA ** (bucket + 0.5)
+
+
+def find_rank(buckets, counts, rank):
+    """
+    Find the bucket the value of a rank falls in
+
+    :param buckets: Sorted bucket indexes
+    :param counts: Number of values in each of buckets
+    :param rank: Rank from 0 to the total count
+    :return: Bucket index, the last bucket if the rank is past the end
+    """
+
+    total = 0
+    for bucket, count in zip(buckets, counts):
+        total += count
+        if total >= rank:
+            return bucket
+
+    return buckets[-1]
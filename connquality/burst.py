@@ -0,0 +1,134 @@
+"""
+Bursts of probes per target per interval, a single check can't tell jitter
+or intermittent loss apart from a steady connection
+"""
+
+import array
+
+# Extra log columns of a burst, in order
+BURST_COLUMNS = ["min", "median", "p95", "max", "jitter", "loss"]
+
+# RFC 3550 smooths the jitter estimate by 1/16 of every new difference
+JITTER_GAIN = 1 / 16.0
+
+
+def percentile(ordered, count, percent):
+    """
+    Get a percentile of sorted values, interpolating linearly between the
+    closest ranks like numpy.percentile does
+
+    :param ordered: Sorted sequence of values
+    :param count: Number of values to use from the start of ordered
+    :param percent: Percentile, 0 to 100
+    :return: Value, None if count is 0
+    """
+
+    if not count:
+        return None
+
+    position = (count - 1) * percent / 100.0
+    lower = int(position)
+    upper = min(lower + 1, count - 1)
+    fraction = position - lower
+
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * fraction
+
+
+class Burst(object):
+    """
+    The probes of a target in the current burst, kept in a buffer allocated
+    once for the burst size and summarized in one go when the burst is done.
+    The jitter estimate carries on from burst to burst, like RFC 3550's
+    running interarrival jitter.
+    """
+
+    def __init__(self, size):
+        """
+        :param size: Number of probes per burst
+        """
+
+        self.size = size
+        self.latencies = array.array('d', [0.0] * size)
+
+        # Successful probes and all probes in the current burst
+        self.count = 0
+        self.probes = 0
+
+        # Error of the last failed probe
+        self.error = None
+
+        self.jitter = 0.0
+        self.previous = None
+
+    def reset(self):
+        """
+        Start a new burst
+        """
+
+        self.count = 0
+        self.probes = 0
+        self.error = None
+
+    def add(self, latency, error=None):
+        """
+        Add the result of a probe
+
+        :param latency: Latency in seconds or None if failed
+        :param error: One of Check.ERROR_* if failed
+        """
+
+        self.probes += 1
+
+        if latency is None:
+            self.error = error
+            return
+
+        self.latencies[self.count] = latency
+        self.count += 1
+
+    def summarize(self):
+        """
+        Summarize the burst
+
+        :return: Dict of BURST_COLUMNS, the latencies being None if every
+                 probe failed and loss the ratio of failed probes
+        """
+
+        count = self.count
+
+        for index in range(count):
+            latency = self.latencies[index]
+            if self.previous is not None:
+                difference = abs(latency - self.previous)
+                self.jitter += (difference - self.jitter) * JITTER_GAIN
+            self.previous = latency
+
+        ordered = sorted(self.latencies[:count])
+
+        def rounded(value):
+            return None if value is None else round(value, 6)
+
+        return {
+            "min": rounded(ordered[0]) if count else None,
+            "median": rounded(percentile(ordered, count, 50)),
+            "p95": rounded(percentile(ordered, count, 95)),
+            "max": rounded(ordered[-1]) if count else None,
+            "jitter": round(self.jitter, 6),
+            "loss": round(
+                1.0 - count / float(self.probes), 6
+            ) if self.probes else 0.0
+        }
+
+
+def get_columns(summary):
+    """
+    Get the extra log columns of a burst summary
+
+    :param summary: Dict from Burst.summarize
+    :return: List of (name, value) tuples, nan for missing latencies
+    """
+
+    return [
+        (name, float("nan") if summary[name] is None else summary[name])
+        for name in BURST_COLUMNS
+    ]
@@ -0,0 +1,207 @@
+"""
+Persistent cache of parsed text logs, so regenerating graphs from a growing
+log only parses the lines appended since the previous run. The sidecar
+helpers are shared with the outage index, which is kept up to date the same
+way.
+"""
+
+import os
+import io
+import zipfile
+import hashlib
+import numpy
+
+from connquality.parser import parse_file, concatenate, empty_columns, \
+    find_complete_end
+from connquality.index import replace_file
+
+CACHE_SUFFIX = ".cache.npz"
+
+# Bump when the stored columns change
+CACHE_VERSION = 1
+
+# How much of the start of the log identifies it
+HEAD_SIZE = 4096
+
+COLUMNS = ["timestamps", "datetimes", "latencies", "statuses"]
+
+
+def get_cache_filename(filename):
+    """
+    Get the cache path for a log
+
+    :param filename: Path to the log
+    :return: Path to the cache
+    """
+
+    return filename + CACHE_SUFFIX
+
+
+def get_signature(f, length):
+    """
+    Hash the first length bytes of a log
+
+    :param f: The log opened in binary mode
+    :param length: Number of bytes to hash
+    :return: Hex digest
+    """
+
+    f.seek(0)
+    return hashlib.sha1(f.read(length)).hexdigest()
+
+
+def get_log_state(f, stat, offset):
+    """
+    Identify a log and how far it has been read, for saving in a sidecar
+
+    :param f: The log opened in binary mode
+    :param stat: os.stat result of the log
+    :param offset: Number of bytes of the log read
+    :return: Dict of array name to numpy array
+    """
+
+    head_length = min(offset, HEAD_SIZE)
+
+    return {
+        "offset": numpy.array(offset, dtype=numpy.int64),
+        "device": numpy.array(stat.st_dev, dtype=numpy.uint64),
+        "inode": numpy.array(stat.st_ino, dtype=numpy.uint64),
+        "head_length": numpy.array(head_length, dtype=numpy.int64),
+        "signature": numpy.array(get_signature(f, head_length))
+    }
+
+
+def is_valid(saved, stat, f):
+    """
+    Check that a sidecar was made from the beginning of this same log, i.e.
+    it hasn't been truncated, rotated or replaced since
+
+    :param saved: Dict of array name to numpy array from load_sidecar
+    :param stat: os.stat result of the log
+    :param f: The log opened in binary mode
+    :return: bool
+    """
+
+    if int(saved["device"]) != stat.st_dev:
+        return False
+
+    if int(saved["inode"]) != stat.st_ino:
+        return False
+
+    if int(saved["offset"]) > stat.st_size:
+        return False
+
+    signature = get_signature(f, int(saved["head_length"]))
+    return signature == str(saved["signature"])
+
+
+def load_sidecar(path, version):
+    """
+    Load the arrays of a sidecar
+
+    :param path: Path to the sidecar
+    :param version: Version the sidecar must have been saved with
+    :return: Dict of array name to numpy array, None if there's no usable
+             sidecar
+    """
+
+    try:
+        with numpy.load(path) as data:
+            if int(data["version"]) != version:
+                return None
+            return dict((name, data[name]) for name in data.files)
+    except (IOError, OSError, ValueError, KeyError, zipfile.BadZipfile):
+        return None
+
+
+def save_sidecar(path, arrays, version, state):
+    """
+    Write a sidecar, replacing the previous one
+
+    :param path: Path to the sidecar
+    :param arrays: Dict of array name to numpy array
+    :param version: Version of the stored arrays
+    :param state: Dict from get_log_state
+    """
+
+    arrays = dict(arrays, version=numpy.array(version), **state)
+    temp_filename = path + ".tmp"
+
+    # Through a file object, as numpy.savez would add another .npz
+    with io.open(temp_filename, 'wb') as f:
+        numpy.savez(f, **arrays)
+
+    replace_file(temp_filename, path)
+
+
+def load_cache(filename):
+    """
+    Load the cached columns of a log
+
+    :param filename: Path to the log
+    :return: Dict of column name to numpy array and the metadata, None if
+             there's no usable cache
+    """
+
+    return load_sidecar(get_cache_filename(filename), CACHE_VERSION)
+
+
+def save_cache(filename, columns, state):
+    """
+    Write the cache for a log, replacing the previous one
+
+    :param filename: Path to the log
+    :param columns: Dict of column name to numpy array of the parsed lines
+    :param state: Dict from get_log_state
+    """
+
+    arrays = dict((name, columns[name]) for name in COLUMNS)
+    if columns["targets"] is not None:
+        arrays["targets"] = columns["targets"]
+
+    save_sidecar(get_cache_filename(filename), arrays, CACHE_VERSION, state)
+
+
+def read_cached(filename, logger=None):
+    """
+    Parse a text log, reusing the columns cached by the previous call and
+    only parsing the lines appended since
+
+    :param filename: Path to the log
+    :return: Dict of column name to numpy array
+    """
+
+    cached = load_cache(filename)
+
+    with open(filename, 'rb') as f:
+        stat = os.fstat(f.fileno())
+
+        if cached is not None and not is_valid(cached, stat, f):
+            if logger:
+                logger.info("Log has been replaced, dropping cache")
+            cached = None
+
+        if cached is None:
+            columns = empty_columns()
+            offset = 0
+        else:
+            columns = dict((name, cached[name]) for name in COLUMNS)
+            columns["targets"] = cached.get("targets")
+            offset = int(cached["offset"])
+
+        end = find_complete_end(f, offset, stat.st_size)
+        if end == offset:
+            return columns
+
+        f.seek(offset)
+        columns = concatenate([columns, parse_file(f, limit=end - offset)])
+
+        state = get_log_state(f, stat, end)
+
+    try:
+        save_cache(filename, columns, state)
+    except (IOError, OSError) as err:
+        if logger:
+            logger.warn("Could not save cache: {0}".format(err))
+
+    return columns
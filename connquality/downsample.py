@@ -0,0 +1,205 @@
+"""
+Reducing the number of data points to graph
+
+numpy is imported by the functions so that the graph command line can use
+the modes without it.
+"""
+
+MODE_LTTB = "lttb"
+MODE_ENVELOPE = "envelope"
+MODE_AVERAGE = "average"
+
+MODES = [MODE_LTTB, MODE_ENVELOPE, MODE_AVERAGE]
+
+
+def filter_average(items, target_length, average=True):
+    """
+    Vectorized equivalent of Reader._filter, every value is the average of
+    the values since the previously picked one
+
+    :param items: numpy array
+    :param target_length: Number of values to reduce to
+    :param average: Average values, or just pick them
+    :return: numpy array
+    """
+
+    import numpy
+
+    count = len(items)
+    if count < target_length:
+        return items
+
+    # Accumulate the step like Reader._filter does to pick the same indexes
+    xth = float(count) / float(target_length)
+    steps = numpy.empty(target_length + 1)
+    steps[0] = 0.0
+    steps[1:] = xth
+
+    selected = numpy.ceil(numpy.cumsum(steps)).astype(numpy.int64)
+    selected = selected[selected < count]
+
+    if not average:
+        return items[selected]
+
+    starts = numpy.empty_like(selected)
+    starts[0] = 0
+    starts[1:] = selected[:-1] + 1
+
+    sums = numpy.add.reduceat(
+        numpy.asarray(items[:selected[-1] + 1], dtype=numpy.float64),
+        starts
+    )
+    return sums / (selected - starts + 1)
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets, picks the points that keep the shape of
+    the line, spikes included
+
+    :param x: numpy array of x values, e.g. timestamps
+    :param y: numpy array of y values, e.g. latencies
+    :param threshold: Number of points to pick
+    :return: Indexes of the picked points, bucket start indexes
+    """
+
+    import numpy
+
+    count = len(x)
+
+    if threshold >= count or threshold < 3:
+        indexes = numpy.arange(count)
+        return indexes, indexes
+
+    # Failed checks have no latency, don't let them poison the areas
+    y = numpy.nan_to_num(numpy.asarray(y, dtype=numpy.float64))
+    x = numpy.asarray(x, dtype=numpy.float64)
+
+    # First and last points get their own buckets, the rest are split evenly
+    every = float(count - 2) / (threshold - 2)
+    starts = numpy.empty(threshold, dtype=numpy.int64)
+    starts[0] = 0
+    starts[1:-1] = (numpy.arange(threshold - 2) * every).astype(numpy.int64)
+    starts[1:-1] += 1
+    starts[-1] = count - 1
+
+    sizes = numpy.diff(numpy.append(starts, count))
+    mean_x = numpy.add.reduceat(x, starts) / sizes
+    mean_y = numpy.add.reduceat(y, starts) / sizes
+
+    indexes = numpy.empty(threshold, dtype=numpy.int64)
+    indexes[0] = 0
+    indexes[-1] = count - 1
+
+    previous = 0
+    for bucket in range(1, threshold - 1):
+        first = starts[bucket]
+        last = starts[bucket + 1]
+
+        # Triangle of the previous pick, each candidate and the next average
+        next_x = mean_x[bucket + 1]
+        next_y = mean_y[bucket + 1]
+        areas = numpy.abs(
+            (x[previous] - next_x) * (y[first:last] - y[previous]) -
+            (x[previous] - x[first:last]) * (next_y - y[previous])
+        )
+
+        previous = first + numpy.argmax(areas)
+        indexes[bucket] = previous
+
+    return indexes, starts
+
+
+def get_bucket_starts(count, buckets):
+    """
+    Split count items evenly into buckets
+
+    :return: numpy array of bucket start indexes
+    """
+
+    import numpy
+
+    starts = numpy.linspace(0, count, buckets + 1)[:-1].astype(numpy.int64)
+    return numpy.unique(starts)
+
+
+def _bucket_mean(values, starts):
+    """
+    Mean of every bucket, ignoring NaN values
+    """
+
+    import numpy
+
+    values = numpy.asarray(values, dtype=numpy.float64)
+    valid = ~numpy.isnan(values)
+
+    sums = numpy.add.reduceat(numpy.where(valid, values, 0.0), starts)
+    counts = numpy.add.reduceat(valid.astype(numpy.int64), starts)
+
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+def downsample(columns, data_points, mode=MODE_LTTB):
+    """
+    Reduce all the columns together to around data_points values
+
+    In lttb mode the points keeping the shape of the latency line are picked,
+    in envelope mode every bucket gets its mean latency plus latency_min and
+    latency_max columns. Either way the status of a bucket is the worst one
+    in it. The average mode averages everything like Reader._filter always
+    did.
+
+    :param columns: Dict of column name to numpy array, timestamps,
+                    datetimes, latencies, statuses and targets, datetimes and
+                    targets may be None
+    :param data_points: Number of values to reduce to
+    :param mode: One of MODES
+    :return: Dict of column name to numpy array
+    """
+
+    import numpy
+
+    count = len(columns["timestamps"])
+    result = dict(columns)
+
+    if not count:
+        return result
+
+    if mode == MODE_AVERAGE:
+        for name in ["timestamps", "latencies", "statuses"]:
+            result[name] = filter_average(columns[name], data_points)
+
+        for name in ["datetimes", "targets"]:
+            if columns[name] is not None:
+                result[name] = filter_average(columns[name], data_points,
+                                              average=False)
+
+        return result
+
+    if count <= data_points:
+        return result
+
+    if mode == MODE_LTTB:
+        picked, starts = lttb(columns["timestamps"], columns["latencies"],
+                              data_points)
+        result["latencies"] = columns["latencies"][picked]
+    elif mode == MODE_ENVELOPE:
+        starts = get_bucket_starts(count, data_points)
+        picked = starts
+
+        latencies = numpy.asarray(columns["latencies"], dtype=numpy.float64)
+        result["latencies"] = _bucket_mean(latencies, starts)
+        result["latency_min"] = numpy.fmin.reduceat(latencies, starts)
+        result["latency_max"] = numpy.fmax.reduceat(latencies, starts)
+    else:
+        raise ValueError("Unknown downsampling mode {0}".format(mode))
+
+    result["timestamps"] = columns["timestamps"][picked]
+    result["statuses"] = numpy.maximum.reduceat(columns["statuses"], starts)
+
+    for name in ["datetimes", "targets"]:
+        if columns[name] is not None:
+            result[name] = columns[name][picked]
+
+    return result
@@ -0,0 +1,253 @@
+"""
+Concurrent check engine
+"""
+
+import copy
+import asyncio
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+from connquality.monitor import Check, TCPCheck, get_error_class
+from connquality.timing import CheckResult, format_phases, RESOLVE, SOCKET, \
+    CONNECT, CLOSE
+
+
+class CheckAdapter(object):
+    """
+    Runs a blocking Check in a thread so that any existing Check
+    implementation can take part in a concurrent iteration. A thread can't
+    be stopped when the check times out, so every run works on a copy of
+    the check that only replaces the check once the run finishes in time.
+    """
+
+    def __init__(self, check):
+        self.check = check
+
+        # Work of the last run handed to a thread, still going on after a
+        # timeout until the thread gets to the end of it
+        self.pending = None
+
+    def is_busy(self):
+        """
+        Check if the thread of a run that timed out is still going
+        """
+
+        return self.pending is not None and not self.pending.done()
+
+    def _in_thread(self, loop, executor, function):
+        """
+        Run a function on the executor
+
+        :return: Awaitable of the result
+        """
+
+        self.pending = executor.submit(function)
+        return asyncio.wrap_future(self.pending, loop=loop)
+
+    async def run(self, loop, executor):
+        """
+        Run the check
+
+        :param loop: The event loop to run on
+        :param executor: Executor to run blocking work on
+        :returns: Latency in seconds or None if failed
+        """
+
+        check = self.check
+        run = copy.copy(check)
+        run.result = CheckResult(check.result.clock)
+
+        latency = await self._in_thread(loop, executor, run.check)
+
+        vars(check).update(vars(run))
+        return latency
+
+
+class TCPCheckAdapter(CheckAdapter):
+    """
+    Native non-blocking connect for TCPCheck, uses the check's socket hooks.
+    Lookups that would block run on the executor.
+    """
+
+    async def run(self, loop, executor):
+        check = self.check
+
+        if check.logger:
+            check.logger.debug("Checking connection to {0}".format(
+                check.destination
+            ))
+
+        result = check.result
+        result.begin()
+        check.dns_time = None
+
+        soc = None
+        try:
+            resolver = check.resolver
+            if resolver is not None and resolver.is_cached(check.address,
+                                                           check.port):
+                check.sockaddr = check._resolve()
+            else:
+                check.sockaddr = await self._in_thread(loop, executor,
+                                                       check._resolve)
+            result.mark(RESOLVE)
+            check.dns_time = result.get_seconds(RESOLVE)
+
+            soc = check._get_socket()
+            soc.setblocking(False)
+            result.mark(SOCKET)
+
+            await loop.sock_connect(soc, check.sockaddr)
+            result.mark(CONNECT)
+
+            check._close_socket(soc)
+            soc = None
+            result.mark(CLOSE)
+
+            check.error = None
+
+            if check.logger:
+                check.logger.debug("Connection to {0} established: {1}".format(
+                    check.destination, format_phases(result)
+                ))
+
+            return result.latency
+        except socket.error as err:
+            check.error = result.error = get_error_class(err)
+
+            if check.logger:
+                check.logger.warn("Caught socket error when connecting to "
+                                  "{0}".format(check.destination))
+                check.logger.warn(err)
+
+            return None
+        finally:
+            if soc is not None:
+                check._close_socket(soc)
+
+
+# TCPCheck methods the native adapter does the work of, checks overriding
+# any of them run their own check() on the executor
+NATIVE_METHODS = ("check", "_get_socket", "_connect")
+
+
+def _is_native(check):
+    """
+    Check if the native adapter does what the check's own check() would
+    """
+
+    if not isinstance(check, TCPCheck):
+        return False
+
+    for name in NATIVE_METHODS:
+        # Overridden on the instance, e.g. mocked in tests
+        if name in vars(check):
+            return False
+
+        owner = next(klass for klass in type(check).__mro__
+                     if name in vars(klass))
+        if owner is not TCPCheck:
+            return False
+
+    return True
+
+
+def get_adapter(check):
+    """
+    Pick the best adapter for the given check
+
+    :param check: A Check instance
+    :return: CheckAdapter instance
+    """
+
+    if _is_native(check):
+        return TCPCheckAdapter(check)
+
+    return CheckAdapter(check)
+
+
+class AsyncEngine(object):
+    """
+    Starts all the checks of an iteration at the same time, so one iteration
+    costs roughly the slowest check instead of the sum of all of them
+    """
+
+    def __init__(self, timeout, logger=None):
+        self.timeout = timeout
+        self.logger = logger
+        self.loop = asyncio.new_event_loop()
+        self.adapters = {}
+
+        # A thread for every check, so no check waits for a free one and
+        # the wait counts against its timeout
+        self.executor = None
+        self.workers = 0
+
+    def _get_adapter(self, check):
+        adapter = self.adapters.get(id(check))
+        if adapter is None or adapter.check is not check:
+            adapter = get_adapter(check)
+            self.adapters[id(check)] = adapter
+        return adapter
+
+    async def _run_one(self, check):
+        adapter = self._get_adapter(check)
+
+        # Still stuck in the run that timed out, starting another one would
+        # only take up another thread
+        if adapter.is_busy():
+            check.error = check.result.error = Check.ERROR_TIMEOUT
+
+            if self.logger:
+                self.logger.warn("Connection to {0} still hasn't finished "
+                                 "timing out".format(check.destination))
+            return None
+
+        try:
+            return await asyncio.wait_for(
+                adapter.run(self.loop, self.executor), self.timeout
+            )
+        except asyncio.TimeoutError:
+            check.error = check.result.error = Check.ERROR_TIMEOUT
+
+            if self.logger:
+                self.logger.warn("Connection to {0} timed out after "
+                                 "{1}s".format(check.destination,
+                                               self.timeout))
+            return None
+
+    async def _run_all(self, checks):
+        return await asyncio.gather(
+            *[self._run_one(check) for check in checks]
+        )
+
+    def run(self, checks):
+        """
+        Run the given checks concurrently
+
+        :param checks: List of Check instances
+        :return: List of latencies (or None for failures) in the same order
+        """
+
+        if not checks:
+            return []
+
+        if len(checks) > self.workers:
+            # Threads stuck in timed out runs finish on the old one
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+
+            self.executor = ThreadPoolExecutor(len(checks))
+            self.workers = len(checks)
+
+        return self.loop.run_until_complete(self._run_all(checks))
+
+    def close(self):
+        """
+        Release the event loop and the threads
+        """
+
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+        self.loop.close()
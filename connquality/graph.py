@@ -2,41 +2,67 @@
 Graphing system
 """
 
+import os
 import sys
 import argparse
-import dateutil.parser
 import time
-import numpy
 import logging
 
-import matplotlib.pyplot as pyplot
-import matplotlib.dates
-from matplotlib.dates import DateFormatter
+from connquality.logformat import STATUSES, COMPRESSED_SUFFIX, is_binary
+from connquality.index import load_index, replace_file
+from connquality.rotation import find_segments
+from connquality.sketch import RESOLUTIONS, get_bands
+from connquality.rollup import get_rollup_filename
+from connquality.downsample import MODES, MODE_LTTB, MODE_ENVELOPE, \
+    downsample, filter_average
 
-from connquality.monitor import Monitor
+# Number of entries per chunk from iter_records
+RECORDS_CHUNK_SIZE = 64 * 1024
+
+# Shading of the outages on the latency axis
+OUTAGE_COLORS = {
+    STATUSES["DEGRADED"]: "orange",
+    STATUSES["ERROR"]: "red"
+}
+OUTAGE_ALPHA = 0.2
+
+# Percentile bands from the sketches
+BAND_BINS = 500
+BAND_COLOR = "gray"
+BAND_ALPHA = 0.2
 
 
 class Reader(object):
-    STATUSES = {
-        Monitor.STATUS_OK: 0,
-        Monitor.STATUS_DEGRADED: 0.5,
-        Monitor.STATUS_ERROR: 1
-    }
+    STATUSES = STATUSES
 
     def __init__(self):
         self.timestamps = None
         self.timestamp_dts = None
         self.latencies = None
         self.statuses = None
+        self.targets = None
+        self.latency_min = None
+        self.latency_max = None
         self.lines = None
         self.entries = None
+        self.outages = None
+        self.bands = None
+
+        # Parsed text log, how far it's been read and the outages found in
+        # it, for update()
+        self.columns = None
+        self.offset = 0
+        self.inode = None
+        self.outage_finder = None
 
     def _iso8601_to_time(self, timestamp):
-        ts_dt = dateutil.parser.parse(timestamp)
+        ts_dt = self._iso8601_to_datetime(timestamp)
         return time.mktime(ts_dt.timetuple()) + ts_dt.microsecond / 1E6
 
 
     def _iso8601_to_datetime(self, timestamp):
+        import dateutil.parser
+
         return dateutil.parser.parse(timestamp)
 
     def _filter(self, items, target_length):
@@ -72,62 +98,630 @@ class Reader(object):
 
         return filtered
 
-    def read(self, filename, start=None, end=None, data_points=None):
+    def _filter_array(self, items, target_length, average=True):
+        """
+        Vectorized _filter for numpy arrays
 
-        timestamps = []
-        timestamp_dts = []
-        latencies = []
-        statuses = []
+        :param average: Average numeric values like _filter, or just pick
+        """
 
-        lines = 0
-        entries = 0
+        return filter_average(items, target_length, average)
+
+    def _epoch_to_datetimes(self, timestamps):
+        """
+        Convert unix timestamps to local time datetime64 values, like the
+        text logs store them
+
+        :param timestamps: numpy array of unix timestamps
+        :return: numpy array of datetime64
+        """
+
+        from connquality.parser import epoch_to_local
+
+        return epoch_to_local(timestamps)
 
+    def _read_binary(self, filename, start=None, end=None, data_points=None,
+                     mode=MODE_LTTB, outages=False):
+        """
+        Map a binary log to memory, the columns are views to the file
+        """
+
+        import numpy
+        from connquality.parser import map_binary, binary_columns
+
+        records = map_binary(filename)
+        count = len(records)
+
+        first = 0
+        last = count
         if start:
-            start = self._iso8601_to_time(start)
+            first = numpy.searchsorted(records["timestamp"], start, "left")
         if end:
-            end = self._iso8601_to_time(start)
-
-        with open(filename) as f:
-            for line in f:
-                lines += 1
+            last = numpy.searchsorted(records["timestamp"], end, "right")
 
-                timestamp, latency, status = line[:-1].split("\t")
+        # Datetimes are only worked out for what's left after downsampling
+        columns = binary_columns(records[first:last])
 
-                parsed_timestamp = self._iso8601_to_time(timestamp)
+        self._assign(columns, data_points=data_points, mode=mode,
+                     outages=outages)
+        self.lines = count
 
-                if start and parsed_timestamp < start:
-                    continue
+    def _assign(self, columns, start=None, end=None, data_points=None,
+                mode=MODE_LTTB, outages=False):
+        """
+        Select the requested range from parsed columns, downsample them and
+        store the results
 
-                if end and parsed_timestamp > end:
-                    break
+        :param outages: Find the outages of the range too
+        """
 
-                entries += 1
+        import numpy
+        from connquality.parser import select
+        from connquality.outages import OutageFinder
 
-                timestamp_dts.append(self._iso8601_to_datetime(timestamp))
-                timestamps.append(parsed_timestamp)
-                latencies.append(float(latency))
-                statuses.append(self.__class__.STATUSES[status])
+        timestamps = columns["timestamps"]
+        lines = len(timestamps)
 
-        if data_points:
-            timestamps = self._filter(timestamps, data_points)
-            timestamp_dts = self._filter(timestamp_dts, data_points)
-            latencies = self._filter(latencies, data_points)
-            statuses = self._filter(statuses, data_points)
+        if end:
+            # Everything after the first entry past the end is skipped
+            beyond = numpy.nonzero(timestamps > end)[0]
+            if len(beyond):
+                lines = beyond[0] + 1
+                columns = select(columns, slice(0, beyond[0]))
 
-        self.timestamps = numpy.array(timestamps)
-        self.timestamp_dts = timestamp_dts
-        self.latencies = numpy.array(latencies)
-        self.statuses = numpy.array(statuses)
+        if start:
+            columns = select(columns, columns["timestamps"] >= start)
+
+        entries = len(columns["timestamps"])
+
+        # Found from every entry, downsampling would hide short outages
+        if outages:
+            finder = OutageFinder()
+            finder.add_columns(columns)
+            self.outages = finder.get_outages()
+
+        if data_points and entries:
+            if columns["targets"] is None:
+                columns = downsample(columns, data_points, mode)
+            else:
+                # Every target gets its own line, downsample them separately
+                parts = [
+                    downsample(
+                        select(columns, columns["targets"] == target),
+                        data_points, mode
+                    )
+                    for target in numpy.unique(columns["targets"])
+                ]
+                columns = dict(
+                    (name, numpy.concatenate([part[name] for part in parts]))
+                    for name in parts[0]
+                )
+
+        if columns["datetimes"] is None:
+            columns["datetimes"] = self._epoch_to_datetimes(
+                columns["timestamps"]
+            )
+
+        self.timestamps = columns["timestamps"]
+        self.timestamp_dts = columns["datetimes"]
+        self.latencies = columns["latencies"]
+        self.statuses = columns["statuses"]
+        self.targets = columns["targets"]
+        self.latency_min = columns.get("latency_min")
+        self.latency_max = columns.get("latency_max")
 
         self.lines = lines
         self.entries = entries
 
+    def _get_time_span(self, segments):
+        """
+        Get the timestamps of the first and last entries in a list of log
+        segments, skipping empty segments
+
+        :return: first unix timestamp, last unix timestamp, either can be None
+        """
+
+        from connquality.parser import get_time_span
+
+        first = None
+        for segment in segments:
+            first = get_time_span(segment)[0]
+            if first is not None:
+                break
+
+        last = None
+        for segment in reversed(segments):
+            last = get_time_span(segment)[1]
+            if last is not None:
+                break
+
+        return first, last
+
+    def _iter_segments(self, segments, start, end, logger):
+        """
+        Read log segments in chunks, one after another
+        """
+
+        from connquality.parser import iter_columns
+
+        for segment in segments:
+            for columns in iter_columns(segment, start, end, logger=logger):
+                yield columns
+
+    def _read_streaming(self, segments, start, end, data_points, logger,
+                        outages=False):
+        """
+        Aggregate the log into data_points time buckets while reading it, so
+        memory use doesn't depend on the size of the log
+
+        :param outages: Find the outages while reading too
+        """
+
+        import numpy
+        from connquality.parser import select, empty_columns
+        from connquality.aggregate import BucketAggregator
+        from connquality.outages import OutageFinder
+
+        range_start = start
+        range_end = end
+        if start is None or end is None:
+            first, last = self._get_time_span(segments)
+            range_start = start or first
+            range_end = end or last
+
+        aggregators = {}
+        entries = 0
+        finder = OutageFinder() if outages else None
+
+        if range_start is not None and range_end is not None:
+            for columns in self._iter_segments(segments, start, end, logger):
+                entries += len(columns["timestamps"])
+                if finder:
+                    finder.add_columns(columns)
+
+                targets = columns["targets"]
+                if targets is None:
+                    groups = [(None, columns)]
+                else:
+                    groups = [
+                        (target, select(columns, targets == target))
+                        for target in numpy.unique(targets)
+                    ]
+
+                for target, part in groups:
+                    if target not in aggregators:
+                        aggregators[target] = BucketAggregator(
+                            range_start, range_end, data_points
+                        )
+
+                    aggregators[target].add(part["timestamps"],
+                                            part["latencies"],
+                                            part["statuses"])
+
+        parts = []
+        for target in sorted(aggregators, key=lambda key: key or ""):
+            part = aggregators[target].get_columns()
+            if target is not None:
+                part["targets"] = numpy.full(len(part["timestamps"]), target)
+            parts.append(part)
+
+        if not parts:
+            columns = empty_columns()
+        elif len(parts) == 1:
+            columns = parts[0]
+        else:
+            columns = dict(
+                (name, numpy.concatenate([part[name] for part in parts])
+                 if parts[0][name] is not None else None)
+                for name in parts[0]
+            )
+
+        self._assign(columns)
+        self.lines = entries
+        self.entries = entries
+
+        if finder:
+            self.outages = finder.get_outages()
+
+    def _read_rollups(self, filename, start, end, data_points, logger):
+        """
+        Read the rollups the monitor keeps with --rollups instead of the log,
+        from the coarsest resolution that still has data_points buckets in
+        the time range. Finer rollups fill in after the last complete bucket
+        of the coarser ones, e.g. the day going on right now.
+
+        :return: True if the rollups were read, False if there are none or
+                 they don't cover the time range up to the end of the log
+        """
+
+        import numpy
+        from connquality.parser import map_rollups, rollup_columns
+        from connquality.aggregate import BucketAggregator
+
+        log_first, log_last = self._get_time_span(find_segments(filename))
+        range_start = start or log_first
+        range_end = end or log_last
+
+        if log_last is None or range_end <= range_start:
+            return False
+
+        chosen = None
+        for index, (_, seconds) in enumerate(RESOLUTIONS):
+            if (range_end - range_start) / seconds >= data_points:
+                chosen = index
+
+        if chosen is None:
+            return False
+
+        aggregator = BucketAggregator(range_start, range_end, data_points)
+        covered = range_start
+        rows = 0
+
+        for resolution, seconds in reversed(RESOLUTIONS[:chosen + 1]):
+            path = get_rollup_filename(filename, resolution)
+            if not os.path.exists(path):
+                return False
+
+            records = map_rollups(path)
+            starts = records["start"]
+
+            # Rollups started after the range did
+            if covered == range_start and (not len(records) or
+                                           starts[0] > range_start):
+                return False
+
+            first = numpy.searchsorted(
+                starts, numpy.floor(covered / seconds) * seconds, "left"
+            )
+            last = numpy.searchsorted(starts, range_end, "right")
+
+            # The last bucket is partial, either still going on or written
+            # out by the monitor stopping and then continued in a record of
+            # the same start after a restart. A bucket is only complete once
+            # a later one has started, the finer rollups fill in the rest.
+            if resolution != RESOLUTIONS[0][0]:
+                last = min(last, numpy.searchsorted(starts, starts[-1],
+                                                    "left"))
+            if first >= last:
+                continue
+
+            aggregator.add_rollups(rollup_columns(records[first:last],
+                                                  seconds))
+            covered = starts[last - 1] + seconds
+            rows += last - first
+
+            if logger:
+                logger.debug("Read {0} {1} rollups".format(last - first,
+                                                            resolution))
+
+        # The rollups stop where the monitor stopped keeping them, e.g. after
+        # a restart without --rollups, while the log goes on. Only the bucket
+        # still going on is missing from rollups that are up to date.
+        if covered + RESOLUTIONS[0][1] < min(range_end, log_last):
+            if logger:
+                logger.info("The rollups end before the log does, reading "
+                            "the log")
+            return False
+
+        columns = aggregator.get_columns()
+        self._assign(columns)
+        self.lines = rows
+        self.entries = int(aggregator.samples.sum())
+
+        return True
+
+    def read(self, filename, start=None, end=None, data_points=None,
+             logger=None, mode=MODE_LTTB, streaming=False, cache=False,
+             jobs=None, rollups=True, outages=True):
+        """
+        Read a log file in any of the supported formats, time ranges of text
+        logs are found through the sidecar index
+
+        :param filename: Path to the log, rotated segments of it are read too
+        :param start: Optional ISO 8601 timestamp to start from
+        :param end: Optional ISO 8601 timestamp to end at
+        :param data_points: Optional number of data points to reduce to
+        :param mode: How to reduce to data_points, one of downsample.MODES
+        :param streaming: Aggregate into data_points buckets while reading
+                          instead of reading everything first
+        :param cache: Keep the parsed text log in a cache next to it and only
+                      parse what has been appended since the last read
+        :param jobs: Parse text logs with this many processes
+        :param rollups: Read the rollups kept by the monitor instead of the
+                        log when there are enough of them for data_points
+        :param outages: Find the outages to shade in the entries read, not
+                        when the rollups are read as that would mean reading
+                        the log after all
+        """
+
+        from connquality.cache import read_cached
+
+        start = self._iso8601_to_time(start) if start else None
+        end = self._iso8601_to_time(end) if end else None
+
+        # Rotated segments overlapping the range, oldest first
+        segments = find_segments(filename, start, end)
+
+        self.outages = None
+        if rollups and data_points and self._read_rollups(
+                filename, start, end, data_points, logger):
+            if logger:
+                logger.info("Read the rollups instead of the log, outages "
+                            "are not shaded, --no-rollups reads the log")
+                if mode != MODE_ENVELOPE:
+                    logger.info("The rollups have the average, min and max "
+                                "of every bucket like --downsample={0}, "
+                                "not --downsample={1}".format(MODE_ENVELOPE,
+                                                              mode))
+        elif streaming:
+            if not data_points:
+                raise ValueError("Streaming reads need data_points")
+
+            self._read_streaming(segments, start, end, data_points, logger,
+                                 outages)
+        elif segments != [filename]:
+            self._read_segments(segments, start, end, data_points, mode,
+                                logger, cache, outages)
+        elif is_binary(filename):
+            self._read_binary(filename, start, end, data_points, mode,
+                              outages)
+        elif cache:
+            columns = read_cached(filename, logger)
+            self._assign(columns, start, end, data_points, mode, outages)
+        else:
+            columns = self._read_text(filename, start, end, logger, jobs)
+            self._assign(columns, start, end, data_points, mode, outages)
+
+    def read_bands(self, filename, percentiles, data_points=None):
+        """
+        Read percentile bands over the time span of the entries from the
+        quantile sketches the monitor keeps with --sketches
+
+        :param filename: Path to the log
+        :param percentiles: List of percentiles from 0 to 100
+        :param data_points: Optional number of times to get the percentiles
+                            at
+        """
+
+        import numpy
+        from connquality.parser import epoch_to_local
+
+        if not self.entries:
+            self.bands = None
+            return
+
+        times, values = get_bands(
+            filename, float(self.timestamps.min()),
+            float(self.timestamps.max()), data_points or BAND_BINS,
+            percentiles
+        )
+
+        self.bands = {
+            "datetimes": epoch_to_local(numpy.array(times)),
+            "percentiles": percentiles,
+            "latencies": numpy.array(values, dtype=float)
+        }
+
+    def _read_segments(self, segments, start, end, data_points, mode,
+                       logger, cache, outages=False):
+        """
+        Read the rotated segments of a log as one series
+        """
+
+        from connquality.parser import iter_columns, concatenate
+        from connquality.cache import read_cached
+
+        parts = []
+        for segment in segments:
+            if cache and segment == segments[-1] and \
+                    not is_binary(segment) and \
+                    not segment.endswith(COMPRESSED_SUFFIX):
+                parts.append(read_cached(segment, logger))
+            else:
+                parts.extend(iter_columns(segment, start, end,
+                                          logger=logger))
+
+        self._assign(concatenate(parts), start, end, data_points, mode,
+                     outages)
+
+    def _read_text(self, filename, start=None, end=None, logger=None,
+                   jobs=None):
+        """
+        Parse the part of a text log that can contain the given time range,
+        found through the sidecar index
+
+        :param start: Optional unix timestamp to start from
+        :param end: Optional unix timestamp to end at
+        :param jobs: Parse with this many processes if more than one
+        :return: Dict of column name to numpy array
+        """
+
+        from connquality.parser import parse_file, find_complete_end, \
+            parse_parallel
+
+        start_offset = 0
+        end_offset = None
+        if start or end:
+            index = load_index(filename, logger)
+            start_offset, end_offset = index.find_range(start, end)
+
+        with open(filename, 'rb') as f:
+            # A partially written last line is left for later
+            if end_offset is None:
+                end_offset = find_complete_end(f, start_offset,
+                                               os.fstat(f.fileno()).st_size)
+
+            if jobs and jobs > 1:
+                return parse_parallel(filename, start_offset, end_offset,
+                                      jobs)
+
+            f.seek(start_offset)
+            return parse_file(f, limit=end_offset - start_offset)
+
+    def update(self, filename, start=None, end=None, data_points=None,
+               logger=None, mode=MODE_LTTB, outages=True):
+        """
+        Read what has been appended to the log since the previous update, the
+        first update reads all of it. A truncated or rotated log is read again
+        from the start.
+
+        :param filename: Path to the log
+        :param start: Optional ISO 8601 timestamp to start from
+        :param end: Optional ISO 8601 timestamp to end at
+        :param data_points: Optional number of data points to reduce to
+        :param mode: How to reduce to data_points, one of downsample.MODES
+        :param outages: Find the outages to shade
+        :return: True if there were new entries
+        """
+
+        from connquality.parser import parse_file, select, empty_columns, \
+            concatenate, find_complete_end
+        from connquality.outages import OutageFinder, query_outages
+
+        start = self._iso8601_to_time(start) if start else None
+        end = self._iso8601_to_time(end) if end else None
+
+        if is_binary(filename):
+            # Mapping the file again is cheap, just check for new records
+            lines = self.lines
+            self._read_binary(filename, start, end, data_points, mode,
+                              outages)
+            return self.lines != lines
+
+        with open(filename, 'rb') as f:
+            stat = os.fstat(f.fileno())
+
+            if self.columns is None or stat.st_ino != self.inode or \
+                    stat.st_size < self.offset:
+                if logger and self.columns is not None:
+                    logger.info("Log has been replaced, reading it again")
+
+                self.columns = empty_columns()
+                self.offset = 0
+                self.inode = stat.st_ino
+                self.outage_finder = OutageFinder()
+
+            end_offset = find_complete_end(f, self.offset, stat.st_size)
+            if end_offset == self.offset and self.entries is not None:
+                return False
+
+            f.seek(self.offset)
+            columns = parse_file(f, limit=end_offset - self.offset)
+            self.columns = concatenate([self.columns, columns])
+            self.offset = end_offset
+
+        # Runs going on continue into the new entries, only they are read
+        self.outage_finder.add_columns(columns)
+
+        # Entries before the start will never be needed again
+        if start:
+            self.columns = select(self.columns,
+                                  self.columns["timestamps"] >= start)
+
+        self._assign(self.columns, start, end, data_points, mode)
+        self.outages = None
+        if outages:
+            self.outages = query_outages(self.outage_finder.get_outages(),
+                                         start, end)
+        return True
+
+
+def _to_time(timestamp):
+    """
+    Convert an ISO 8601 timestamp to a unix timestamp, unix timestamps and
+    None are returned as is
+    """
+
+    if timestamp is None or isinstance(timestamp, (int, float)):
+        return timestamp
+
+    return Reader()._iso8601_to_time(timestamp)
+
+
+def _with_datetimes(columns):
+
+    from connquality.parser import epoch_to_local
+
+    if columns["datetimes"] is None:
+        columns["datetimes"] = epoch_to_local(columns["timestamps"])
+    return columns
+
+
+def iter_records(filename, start=None, end=None, chunk_size=RECORDS_CHUNK_SIZE,
+                 logger=None):
+    """
+    Read the entries of a log lazily in chunks of a fixed number of entries,
+    so memory use stays the same no matter how much of the log is read. Logs
+    of any format are supported, rotated segments of the log included.
+
+    E.g. to go through the failed checks:
+
+        for chunk in iter_records("connection.log", "2015-01-10T00:00:00"):
+            failed = chunk["statuses"] == STATUSES["ERROR"]
+            for timestamp in chunk["datetimes"][failed]:
+                ...
+
+    :param filename: Path to the log
+    :param start: Optional ISO 8601 or unix timestamp to start from
+    :param end: Optional ISO 8601 or unix timestamp to end at
+    :param chunk_size: Number of entries per chunk, the last chunk can have
+                       less
+    :return: Generator of dicts of column name to numpy array: timestamps,
+             datetimes, latencies, statuses and targets, which is None for
+             chunks without per-target entries
+    """
+
+    from connquality.parser import select, iter_columns, concatenate
+
+    start = _to_time(start)
+    end = _to_time(end)
+
+    pending = []
+    count = 0
+
+    for segment in find_segments(filename, start, end):
+        for columns in iter_columns(segment, start, end, logger=logger):
+            pending.append(columns)
+            count += len(columns["timestamps"])
+
+            if count < chunk_size:
+                continue
+
+            joined = concatenate(pending)
+
+            position = 0
+            while count - position >= chunk_size:
+                yield _with_datetimes(
+                    select(joined, slice(position, position + chunk_size))
+                )
+                position += chunk_size
+
+            pending = [select(joined, slice(position, None))]
+            count -= position
+
+    if count:
+        yield _with_datetimes(concatenate(pending))
+
 
 class Graph(object):
     def __init__(self, options):
         self.options = options
         self.logger = None
 
+        self.figure = None
+        self.latency_axis = None
+        self.status_axis = None
+
+        # Target (None for aggregate logs) to latency line, status line and
+        # min/max band
+        self.artists = {}
+
+        # Outage shading, one collection per status
+        self.outage_collections = []
+
+        # Percentile lines and the band between the lowest and highest
+        self.band_artists = []
+
     def _initialize(self):
         """
         Initialize all the things
@@ -145,32 +739,201 @@ class Graph(object):
 
         self.logger.addHandler(handler)
 
+    def _get_lines(self, reader):
+        """
+        Split the reader data into the lines to draw, one per target for
+        per-target logs
+
+        :return: Generator of target or None, dates, latencies, statuses,
+                 latency_min, latency_max
+        """
+
+        import numpy
+        import matplotlib.dates
+
+        # Convert datetimes to matplotlib compatible data
+        times = matplotlib.dates.date2num(reader.timestamp_dts)
+
+        if reader.targets is None:
+            selections = [(None, slice(None))]
+        else:
+            selections = [
+                (target, reader.targets == target)
+                for target in numpy.unique(reader.targets)
+            ]
+
+        for target, selected in selections:
+            if reader.latency_min is None:
+                latency_min = latency_max = None
+            else:
+                latency_min = reader.latency_min[selected]
+                latency_max = reader.latency_max[selected]
+
+            yield (target, times[selected], reader.latencies[selected],
+                   reader.statuses[selected], latency_min, latency_max)
+
+    def _draw_lines(self, reader):
+        """
+        Draw the lines of every target, lines that were drawn before only get
+        their data replaced
+        """
+
+        latency_axis = self.latency_axis
+        status_axis = self.status_axis
+        seen = set()
+        added = False
+
+        for target, times, latencies, statuses, latency_min, latency_max \
+                in self._get_lines(reader):
+            seen.add(target)
+
+            if target in self.artists:
+                latency_line, status_line, band = self.artists[target]
+                latency_line.set_data(times, latencies)
+                status_line.set_data(times, statuses)
+
+                if band is not None:
+                    band.remove()
+            elif target is None:
+                latency_line, = latency_axis.plot_date(times, latencies, '-')
+                status_line, = status_axis.plot_date(times, statuses, 'r-')
+            else:
+                latency_line, = latency_axis.plot_date(
+                    times, latencies, '-', label=target
+                )
+                status_line, = status_axis.plot_date(
+                    times, statuses, '-', color=latency_line.get_color()
+                )
+                added = True
+
+            band = None
+            if latency_min is not None:
+                band = latency_axis.fill_between(
+                    times, latency_min, latency_max,
+                    color=latency_line.get_color(), alpha=0.3, linewidth=0
+                )
+
+            self.artists[target] = (latency_line, status_line, band)
+
+        # Targets with nothing left in the time range
+        for target, (latency_line, status_line, band) in self.artists.items():
+            if target not in seen:
+                latency_line.set_data([], [])
+                status_line.set_data([], [])
+
+        if added:
+            latency_axis.legend(loc="upper left", fontsize="small")
+
+    def _draw_outages(self, reader):
+        """
+        Shade the outages over the whole height of the latency axis, replacing
+        the shading drawn before
+        """
+
+        import numpy
+        from connquality.parser import epoch_to_local
+        import matplotlib.dates
+        from matplotlib.collections import PolyCollection
+
+        for collection in self.outage_collections:
+            collection.remove()
+        self.outage_collections = []
+
+        outages = reader.outages
+        if outages is None or not len(outages["starts"]):
+            return
+
+        axis = self.latency_axis
+        starts = matplotlib.dates.date2num(epoch_to_local(outages["starts"]))
+        ends = matplotlib.dates.date2num(epoch_to_local(outages["ends"]))
+
+        for status, color in sorted(OUTAGE_COLORS.items()):
+            selected = outages["statuses"] == status
+            if not selected.any():
+                continue
+
+            left = starts[selected]
+            right = ends[selected]
+            bottom = numpy.zeros(len(left))
+            top = numpy.ones(len(left))
+
+            # X in data coordinates, Y from the bottom to the top of the axis
+            rectangles = numpy.stack([
+                numpy.column_stack([left, bottom]),
+                numpy.column_stack([left, top]),
+                numpy.column_stack([right, top]),
+                numpy.column_stack([right, bottom])
+            ], axis=1)
+
+            collection = PolyCollection(
+                rectangles, facecolors=color, alpha=OUTAGE_ALPHA,
+                linewidths=0, transform=axis.get_xaxis_transform()
+            )
+            axis.add_collection(collection, autolim=False)
+            self.outage_collections.append(collection)
+
+    def _draw_bands(self, reader):
+        """
+        Draw the percentile bands from the sketches, replacing the bands
+        drawn before
+        """
+
+        import matplotlib.dates
+
+        for artist in self.band_artists:
+            artist.remove()
+        self.band_artists = []
+
+        bands = reader.bands
+        if bands is None:
+            return
+
+        axis = self.latency_axis
+        times = matplotlib.dates.date2num(bands["datetimes"])
+        latencies = bands["latencies"]
+
+        self.band_artists.append(axis.fill_between(
+            times, latencies[:, 0], latencies[:, -1], color=BAND_COLOR,
+            alpha=BAND_ALPHA, linewidth=0
+        ))
+
+        for index, percentile in enumerate(bands["percentiles"]):
+            line, = axis.plot(times, latencies[:, index], '--',
+                              color=BAND_COLOR, linewidth=0.8,
+                              label="p{0:g}".format(percentile))
+            self.band_artists.append(line)
+
+        axis.legend(loc="upper left", fontsize="small")
+
     def _draw_graph(self, reader):
+        # Plotting libraries are only loaded when there's something to draw,
+        # so --help and option errors stay quick
+        from matplotlib.dates import DateFormatter
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
         self.logger.debug("Generating a graph")
 
         # Calculate figure size in inches to get correct output resolution
         dpi = float(self.options.dpi)
 
-        pyplot.figure(dpi=dpi)
-        fig, (latency_axis, status_axis) = pyplot.subplots(
-            2, sharex=True, sharey=False
-        )
+        # No pyplot, so there's no global state shared between graphs
+        fig = Figure(dpi=dpi)
+        FigureCanvasAgg(fig)
+        latency_axis = fig.add_subplot(2, 1, 1)
+        status_axis = fig.add_subplot(2, 1, 2, sharex=latency_axis)
 
-        # Convert datetimes to matplotlib compatible data
-        times = matplotlib.dates.date2num(reader.timestamp_dts)
+        self.figure = fig
+        self.latency_axis = latency_axis
+        self.status_axis = status_axis
+        self.artists = {}
+        self.outage_collections = []
+        self.band_artists = []
 
         # Draw the plots
-        latency_axis.plot_date(
-            times,
-            reader.latencies,
-            '-'
-        )
-
-        status_axis.plot_date(
-            times,
-            reader.statuses,
-            'r-'
-        )
+        self._draw_lines(reader)
+        self._draw_outages(reader)
+        self._draw_bands(reader)
 
         # Set connection status labels
         labels = [
@@ -178,7 +941,7 @@ class Graph(object):
             for label in Reader.STATUSES.keys()
         ]
 
-        status_axis.get_yaxis().set_ticks(Reader.STATUSES.values())
+        status_axis.get_yaxis().set_ticks(list(Reader.STATUSES.values()))
         status_axis.get_yaxis().set_ticklabels(labels)
 
         # Format X axis dates
@@ -189,20 +952,101 @@ class Graph(object):
 
         # Final adjustments
         latency_axis.grid(True)
-        pyplot.subplots_adjust(
+        fig.subplots_adjust(
             hspace=0.15, left=0.15, right=0.95, top=0.90, bottom=0.4
         )
 
-        # Save to file
-        self.logger.debug("Writing {0}".format(
-            self.options.outfile
+        self._save_graph()
+
+    def _update_graph(self, reader):
+        """
+        Update the lines of the already drawn graph and save it again
+        """
+
+        self.logger.debug("Updating the graph")
+
+        self._draw_lines(reader)
+        self._draw_outages(reader)
+        self._draw_bands(reader)
+
+        for axis in (self.latency_axis, self.status_axis):
+            axis.relim()
+            axis.autoscale_view()
+
+        self._save_graph()
+
+    def _save_graph(self):
+        """
+        Save the graph through a temporary file, so the outfile is always
+        complete for whoever is reading it
+        """
+
+        outfile = self.options.outfile
+        self.logger.debug("Writing {0}".format(outfile))
+
+        directory, name = os.path.split(outfile)
+        temp_filename = os.path.join(directory, "." + name + ".tmp")
+        file_format = os.path.splitext(name)[1][1:] or "png"
+
+        self.figure.savefig(temp_filename, dpi=float(self.options.dpi),
+                            format=file_format)
+
+        replace_file(temp_filename, outfile)
+
+    def _watch(self, reader):
+        """
+        Keep the graph up to date with the log until interrupted
+        """
+
+        self.logger.info("Updating {0} every {1} seconds".format(
+            self.options.outfile, self.options.watch
+        ))
+
+        try:
+            while True:
+                time.sleep(self.options.watch)
+
+                if reader.update(self.options.logfile, self.options.start,
+                                 self.options.end, self.options.datapoints,
+                                 self.logger, self.options.downsample,
+                                 self.options.outages):
+                    self._read_bands(reader)
+                    self._update_graph(reader)
+        except KeyboardInterrupt:
+            pass
+
+    def _read_bands(self, reader):
+        """
+        Read the --percentiles bands, if any
+        """
+
+        if self.options.percentiles:
+            reader.read_bands(self.options.logfile, self.options.percentiles,
+                              self.options.datapoints)
+
+    def _run_batch(self):
+        """
+        Render all the graphs in the --batch manifest
+
+        :return: Number of failed graphs
+        """
+
+        # Imported here as batch builds on this module
+        from connquality.batch import load_manifest, run_batch
+
+        jobs = load_manifest(self.options.batch)
+        self.logger.info("Rendering {0} graphs from {1}".format(
+            len(jobs), self.options.batch
         ))
 
-        pyplot.savefig(self.options.outfile, dpi=dpi)
+        return run_batch(jobs, self.options.jobs, self.logger)
 
     def run(self):
         self._initialize()
 
+        if self.options.batch:
+            return self._run_batch()
+
         self.logger.info("Reading {0}".format(self.options.logfile))
 
         if self.options.start:
@@ -221,15 +1065,50 @@ class Graph(object):
             ))
 
         reader = Reader()
-        reader.read(self.options.logfile, self.options.start, self.options.end,
-                    self.options.datapoints)
+        if self.options.watch:
+            reader.update(self.options.logfile, self.options.start,
+                          self.options.end, self.options.datapoints,
+                          self.logger, self.options.downsample,
+                          self.options.outages)
+        else:
+            reader.read(self.options.logfile, self.options.start,
+                        self.options.end, self.options.datapoints,
+                        self.logger, self.options.downsample,
+                        self.options.stream, self.options.cache,
+                        self.options.jobs, self.options.rollups,
+                        self.options.outages)
 
         self.logger.debug("Read {0} entries on {1} lines".format(
             reader.entries, reader.lines
         ))
 
+        self._read_bands(reader)
         self._draw_graph(reader)
 
+        if self.options.watch:
+            self._watch(reader)
+
+
+def parse_percentiles(value):
+    """
+    Parse a comma separated list of percentiles
+
+    :param value: String like "50,95,99"
+    :return: Sorted list of floats
+    """
+
+    try:
+        percentiles = sorted(float(part) for part in value.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "{0} isn't a list of percentiles".format(value)
+        )
+
+    if not all(0 <= percentile <= 100 for percentile in percentiles):
+        raise argparse.ArgumentTypeError("Percentiles are from 0 to 100")
+
+    return percentiles
+
 
 def parse_options(args):
     """
@@ -245,14 +1124,58 @@ def parse_options(args):
                         help="Where to store the generated graph")
     parser.add_argument("--dpi", default=100.0,
                         help="Target DPI for graph")
-    parser.add_argument("--datapoints", default=None,
+    parser.add_argument("--datapoints", default=None, type=int,
                         help="Limit number of datapoints to show")
+    parser.add_argument("--downsample", default=MODE_LTTB, choices=MODES,
+                        help="How to reduce to --datapoints: pick the points "
+                             "keeping the shape of the line (lttb), draw the "
+                             "min/max range and mean of every bucket "
+                             "(envelope) or average them (average)")
+    parser.add_argument("--stream", default=False, action="store_true",
+                        help="Aggregate into --datapoints time buckets while "
+                             "reading, memory use stays the same no matter "
+                             "how big the log is")
+    parser.add_argument("--cache", default=False, action="store_true",
+                        help="Cache the parsed log next to it, so the next "
+                             "run only parses newly logged entries")
+    parser.add_argument("--no-rollups", dest="rollups", default=True,
+                        action="store_false",
+                        help="Read the log even when the rollups kept by "
+                             "monitor.py --rollups have enough data points")
+    parser.add_argument("--no-outages", dest="outages", default=True,
+                        action="store_false",
+                        help="Don't shade the outages, finding them reads "
+                             "every entry of the time range")
+    parser.add_argument("--watch", default=None, type=float,
+                        metavar="SECONDS",
+                        help="Keep running and update the graph with new "
+                             "entries every this many seconds")
+    parser.add_argument("--batch", default=None, metavar="MANIFEST",
+                        help="Render all the graphs listed in a JSON "
+                             "manifest, reading every log only once")
+    parser.add_argument("--jobs", default=None, type=int,
+                        help="Parse text logs with this many processes, "
+                             "also the number of processes for --batch, "
+                             "which defaults to the number of CPUs")
+    parser.add_argument("--percentiles", default=None,
+                        type=parse_percentiles,
+                        help="Draw bands of these latency percentiles, e.g. "
+                             "50,95,99, from the sketches kept by monitor.py "
+                             "--sketches")
     parser.add_argument("--start", default=None,
                         help="Only include entries starting from this datetime")
     parser.add_argument("--end", default=None,
                         help="Only include entries until this datetime")
 
-    return parser.parse_args(args)
+    options = parser.parse_args(args)
+
+    if options.stream and not options.datapoints:
+        parser.error("--stream requires --datapoints")
+
+    if options.watch and (options.stream or options.cache):
+        parser.error("--watch can't be combined with --stream or --cache")
+
+    return options
 
 
 def start_grapher():
@@ -262,4 +1185,6 @@ def start_grapher():
 
     options = parse_options(sys.argv[1:])
     graph = Graph(options)
-    graph.run()
+
+    if graph.run():
+        sys.exit(1)
@@ -0,0 +1,257 @@
+"""
+Sparse sidecar time index for the text logs
+"""
+
+import os
+import time
+import bisect
+import struct
+
+# Index a line every this many lines
+INDEX_INTERVAL = 1024
+
+INDEX_SUFFIX = ".idx"
+
+# Unix timestamp and byte offset of the start of the indexed line
+INDEX_ENTRY = struct.Struct("<dQ")
+
+# Replaces a file atomically, readers never see it missing. Python 2 has no
+# os.replace, its os.rename replaces on POSIX.
+replace_file = getattr(os, "replace", os.rename)
+
+
+def get_index_filename(filename):
+    """
+    Get the sidecar index path for a log
+
+    :param filename: Path to the log
+    :return: Path to the index
+    """
+
+    return filename + INDEX_SUFFIX
+
+
+def parse_timestamp(line):
+    """
+    Parse the timestamp from the start of a text log line
+
+    :param line: Bytes of the line
+    :return: Unix timestamp
+    """
+
+    timestamp = line.split(b"\t", 1)[0].decode()
+
+    if "." in timestamp:
+        timestamp, fraction = timestamp.split(".")
+        fraction = float("0." + fraction)
+    else:
+        fraction = 0.0
+
+    parsed = time.strptime(timestamp, "%Y-%m-%dT%H:%M:%S")
+    return time.mktime(parsed) + fraction
+
+
+def read_entries(index_filename):
+    """
+    Read all the entries of an index file, a partially written last entry
+    is ignored
+
+    :param index_filename: Path to the index
+    :return: List of timestamps, list of offsets
+    """
+
+    with open(index_filename, 'rb') as f:
+        data = f.read()
+
+    data = data[:len(data) - len(data) % INDEX_ENTRY.size]
+
+    timestamps = []
+    offsets = []
+    for index in range(0, len(data), INDEX_ENTRY.size):
+        timestamp, offset = INDEX_ENTRY.unpack_from(data, index)
+        timestamps.append(timestamp)
+        offsets.append(offset)
+
+    return timestamps, offsets
+
+
+class IndexWriter(object):
+    """
+    Keeps the index up to date while the monitor appends to the log
+    """
+
+    def __init__(self, filename, interval=INDEX_INTERVAL):
+        self.filename = get_index_filename(filename)
+        self.interval = interval
+
+        # Index the first line written after a restart
+        self.lines = interval
+
+        self._check(filename)
+        self.file = open(self.filename, 'ab')
+
+    def _check(self, filename):
+        """
+        Throw away an index that points past the end of the log
+        """
+
+        if not os.path.exists(self.filename):
+            return
+
+        try:
+            _, offsets = read_entries(self.filename)
+            size = os.path.getsize(filename)
+        except (IOError, OSError):
+            return
+
+        if offsets and offsets[-1] >= size:
+            os.unlink(self.filename)
+
+    def add(self, timestamp, offset):
+        """
+        Register a line appended to the log
+
+        :param timestamp: Unix timestamp of the line
+        :param offset: Byte offset where the line starts
+        """
+
+        if self.lines >= self.interval:
+            self.file.write(INDEX_ENTRY.pack(timestamp, offset))
+            self.file.flush()
+            self.lines = 0
+
+        self.lines += 1
+
+    def close(self):
+        self.file.close()
+
+
+class Index(object):
+    """
+    Maps timestamps to byte offsets in a log, so time ranges can be read
+    without scanning the whole file
+    """
+
+    def __init__(self, timestamps, offsets):
+        self.timestamps = timestamps
+        self.offsets = offsets
+
+    def find_range(self, start=None, end=None):
+        """
+        Find the part of the log that can contain entries in the given range
+
+        :param start: Optional unix timestamp to start from
+        :param end: Optional unix timestamp to end at
+        :return: start offset, end offset (None for end of file)
+        """
+
+        start_offset = 0
+        end_offset = None
+
+        if start is not None:
+            position = bisect.bisect_left(self.timestamps, start) - 1
+            if position >= 0:
+                start_offset = self.offsets[position]
+
+        if end is not None:
+            position = bisect.bisect_right(self.timestamps, end)
+            if position < len(self.offsets):
+                end_offset = self.offsets[position]
+
+        return start_offset, end_offset
+
+
+def build_index(filename, interval=INDEX_INTERVAL):
+    """
+    Scan a log and index every interval-th line
+
+    :param filename: Path to the log
+    :return: Index instance
+    """
+
+    timestamps = []
+    offsets = []
+    offset = 0
+
+    with open(filename, 'rb') as f:
+        for number, line in enumerate(f):
+            if number % interval == 0:
+                try:
+                    timestamps.append(parse_timestamp(line))
+                    offsets.append(offset)
+                except ValueError:
+                    # Partially written last line
+                    pass
+
+            offset += len(line)
+
+    return Index(timestamps, offsets)
+
+
+def _is_valid(filename, index):
+    """
+    Check that the index still describes the log, i.e. the log hasn't been
+    truncated or replaced since
+    """
+
+    if not index.offsets:
+        return False
+
+    size = os.path.getsize(filename)
+
+    with open(filename, 'rb') as f:
+        for position in (0, -1):
+            if index.offsets[position] >= size:
+                return False
+
+            f.seek(index.offsets[position])
+            try:
+                timestamp = parse_timestamp(f.readline())
+            except ValueError:
+                return False
+
+            if abs(timestamp - index.timestamps[position]) > 0.001:
+                return False
+
+    return True
+
+
+def _save_index(index, index_filename):
+    temp_filename = index_filename + ".tmp"
+
+    with open(temp_filename, 'wb') as f:
+        for timestamp, offset in zip(index.timestamps, index.offsets):
+            f.write(INDEX_ENTRY.pack(timestamp, offset))
+
+    replace_file(temp_filename, index_filename)
+
+
+def load_index(filename, logger=None):
+    """
+    Load the sidecar index of a log, rebuilding it if it's missing or no
+    longer matches the log. Lines appended after the last index entry are
+    still found, they are just not indexed.
+
+    :param filename: Path to the log
+    :return: Index instance
+    """
+
+    index_filename = get_index_filename(filename)
+
+    if os.path.exists(index_filename):
+        index = Index(*read_entries(index_filename))
+        if _is_valid(filename, index):
+            return index
+
+    if logger:
+        logger.info("Building index {0}".format(index_filename))
+
+    index = build_index(filename)
+
+    try:
+        _save_index(index, index_filename)
+    except (IOError, OSError) as err:
+        if logger:
+            logger.warn("Could not save index: {0}".format(err))
+
+    return index
@@ -0,0 +1,199 @@
+"""
+Timing of the monitor itself, to tell what the monitor costs apart from what
+the network does
+"""
+
+import os
+import time
+import logging
+import contextlib
+
+from connquality.scheduler import get_monotonic_clock
+
+# Phases of an iteration of the monitor loop
+LATENESS = "lateness"
+CHECKS = "checks"
+LOGGING = "logging"
+WRITES = "writes"
+CPU = "cpu"
+
+PHASES = [LATENESS, CHECKS, LOGGING, WRITES, CPU]
+
+# Extra log column of the write time, a line can't contain the time it took
+# to write itself so it has the time of the previous write
+LAST_WRITE = "last_write"
+
+
+def get_cpu_clock():
+    """
+    Get a clock function measuring the CPU time used by the process
+
+    :return: Function returning seconds as a float
+    """
+
+    process_time = getattr(time, "process_time", None)
+    if process_time:
+        return process_time
+
+    def cpu_clock():
+        times = os.times()
+        return times[0] + times[1]
+
+    return cpu_clock
+
+
+class TimedStreamHandler(logging.StreamHandler):
+    """
+    Stream handler keeping count of the time spent writing log messages
+    """
+
+    def __init__(self, stream=None, clock=None):
+        logging.StreamHandler.__init__(self, stream)
+        self.clock = clock or get_monotonic_clock()
+        self.elapsed = 0.0
+
+    def emit(self, record):
+        start = self.clock()
+        logging.StreamHandler.emit(self, record)
+        self.elapsed += self.clock() - start
+
+
+class IterationTimer(object):
+    """
+    Times the phases of every iteration of the monitor loop and sums them up
+    for periodic summaries
+    """
+
+    def __init__(self, clock=None, cpu_clock=None):
+        self.clock = clock or get_monotonic_clock()
+        self.cpu_clock = cpu_clock or get_cpu_clock()
+
+        # TimedStreamHandler of the logger, if any
+        self.handler = None
+
+        self.current = dict((phase, 0.0) for phase in PHASES)
+        self.cpu_start = self.cpu_clock()
+        self.logging_start = 0.0
+        self.last_write = 0.0
+
+        self.iterations = 0
+        self.totals = None
+        self.maximums = None
+        self.period_start = None
+        self.period_cpu = None
+        self.reset()
+
+    def _get_logging_time(self):
+        return self.handler.elapsed if self.handler else 0.0
+
+    def start(self, lateness):
+        """
+        Start timing an iteration
+
+        :param lateness: Seconds the iteration started behind schedule
+        """
+
+        self.current = dict((phase, 0.0) for phase in PHASES)
+        self.current[LATENESS] = lateness
+        self.cpu_start = self.cpu_clock()
+        self.logging_start = self._get_logging_time()
+
+    @contextlib.contextmanager
+    def measure(self, phase):
+        """
+        Add the time spent in the with block to a phase of the iteration
+
+        :param phase: CHECKS or WRITES
+        """
+
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.current[phase] += self.clock() - start
+
+    def _update(self):
+        self.current[LOGGING] = self._get_logging_time() - self.logging_start
+        self.current[CPU] = self.cpu_clock() - self.cpu_start
+
+    def get_columns(self):
+        """
+        Get the timings of the iteration so far for the extra log columns
+
+        :return: List of (name, seconds) tuples
+        """
+
+        self._update()
+
+        return [
+            (phase, round(self.current[phase], 6))
+            for phase in (LATENESS, CHECKS, LOGGING, CPU)
+        ] + [(LAST_WRITE, round(self.last_write, 6))]
+
+    def finish(self):
+        """
+        Finish timing the iteration and add it to the summary
+        """
+
+        self._update()
+        self.last_write = self.current[WRITES]
+        self.iterations += 1
+
+        for phase in PHASES:
+            self.totals[phase] += self.current[phase]
+            self.maximums[phase] = max(self.maximums[phase],
+                                       self.current[phase])
+
+    def get_summary(self):
+        """
+        Summarize the iterations since the previous reset
+
+        :return: Dict of the number of iterations, wall clock seconds, the
+                 share of the wall clock time the process used the CPU in
+                 percent, and the mean and max seconds of every phase
+        """
+
+        seconds = self.clock() - self.period_start
+        cpu = self.cpu_clock() - self.period_cpu
+        iterations = max(self.iterations, 1)
+
+        return {
+            "iterations": self.iterations,
+            "seconds": seconds,
+            "cpu_percent": 100.0 * cpu / seconds if seconds > 0 else 0.0,
+            "mean": dict(
+                (phase, self.totals[phase] / iterations) for phase in PHASES
+            ),
+            "max": dict(self.maximums)
+        }
+
+    def reset(self):
+        """
+        Start a new summary period
+        """
+
+        self.iterations = 0
+        self.totals = dict((phase, 0.0) for phase in PHASES)
+        self.maximums = dict((phase, 0.0) for phase in PHASES)
+        self.period_start = self.clock()
+        self.period_cpu = self.cpu_clock()
+
+
+def format_summary(summary):
+    """
+    Format a summary from IterationTimer.get_summary for the log
+
+    :param summary: Dict of the summary
+    :return: String
+    """
+
+    phases = ", ".join(
+        "{0} {1:.1f}/{2:.1f} ms".format(
+            phase, summary["mean"][phase] * 1000, summary["max"][phase] * 1000
+        )
+        for phase in PHASES
+    )
+
+    return "Monitor overhead over {0} iterations in {1:.0f}s: CPU {2:.2f} " \
+           "%, mean/max {3}".format(summary["iterations"], summary["seconds"],
+                                    summary["cpu_percent"], phases)
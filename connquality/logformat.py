@@ -0,0 +1,318 @@
+"""
+Log file formats written by the monitor
+"""
+
+import os
+import gzip
+import struct
+import datetime
+
+from connquality.index import IndexWriter
+
+FORMAT_AGGREGATE = "aggregate"
+FORMAT_TARGETS = "targets"
+FORMAT_BINARY = "binary"
+
+FORMATS = [FORMAT_AGGREGATE, FORMAT_TARGETS, FORMAT_BINARY]
+
+# What per-target rows carry in the error column when the check succeeded
+NO_ERROR = "OK"
+
+# Binary logs start with a header, followed by fixed-width records of epoch
+# timestamp, latency and status code
+BINARY_MAGIC = b"CQLOG\x00"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<6sHHH4x")
+BINARY_RECORD = struct.Struct("<dfB3x")
+
+# Rotated segments are compressed with gzip
+COMPRESSED_SUFFIX = ".gz"
+
+# Check statuses, here so reading logs doesn't need the monitor
+STATUS_OK = "OK"
+STATUS_DEGRADED = "DEGRADED"
+STATUS_ERROR = "ERROR"
+
+# Statuses to binary status codes
+STATUS_CODES = {
+    STATUS_OK: 0,
+    STATUS_DEGRADED: 1,
+    STATUS_ERROR: 2
+}
+
+# Statuses to the values the readers and the graph use for them
+STATUSES = {
+    STATUS_OK: 0,
+    STATUS_DEGRADED: 0.5,
+    STATUS_ERROR: 1
+}
+
+
+def format_timestamp(timestamp):
+    """
+    Format a unix timestamp for the text logs
+
+    :param timestamp: Unix timestamp
+    :return: ISO 8601 timestamp string in local time
+    """
+
+    timestamp_dt = datetime.datetime.fromtimestamp(timestamp)
+    return timestamp_dt.isoformat()
+
+
+def format_extra(extra):
+    """
+    Format extra columns for the end of a text log line, readers ignore
+    extra trailing fields
+
+    :param extra: List of (name, value) tuples or None
+    :return: String of tab separated name=value fields, starting with a tab
+    """
+
+    if not extra:
+        return ""
+
+    return "".join(
+        "\t{0}={1}".format(name, value) for name, value in extra
+    )
+
+
+def open_log(filename):
+    """
+    Open a log for reading, gzip compressed logs are decompressed on the fly
+
+    :param filename: Path to the log
+    :return: File object in binary mode
+    """
+
+    if filename.endswith(COMPRESSED_SUFFIX):
+        return gzip.open(filename, 'rb')
+
+    return open(filename, 'rb')
+
+
+def is_binary(filename):
+    """
+    Check if the given file is a binary log
+
+    :param filename: Path to the log
+    :return: True if the file starts with the binary log header
+    """
+
+    with open_log(filename) as f:
+        return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def read_binary_header(data):
+    """
+    Parse and validate a binary log header
+
+    :param data: At least BINARY_HEADER.size bytes from the start of the file
+    :return: header size, record size
+    """
+
+    if len(data) < BINARY_HEADER.size:
+        raise ValueError("Binary log header is truncated")
+
+    magic, version, header_size, record_size = BINARY_HEADER.unpack(
+        data[:BINARY_HEADER.size]
+    )
+
+    if magic != BINARY_MAGIC:
+        raise ValueError("Not a binary connquality log")
+
+    if version != BINARY_VERSION:
+        raise ValueError("Unsupported binary log version {0}".format(version))
+
+    return header_size, record_size
+
+
+class LogWriter(object):
+    """
+    Base class for log writers, appends to the given file
+    """
+
+    # Keep a sidecar time index for the log
+    indexed = True
+
+    # Mode the log is opened in
+    mode = 'ab'
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, self.mode)
+        self.index = None
+
+        if self.indexed:
+            self.index = IndexWriter(filename)
+
+    def write_results(self, timestamp, results, extra=None,
+                      target_extra=None):
+        """
+        Write the results of a batch of checks
+
+        :param timestamp: Unix timestamp
+        :param results: List of (destination, latency, error) tuples, latency
+                        being None and error one of Check.ERROR_* for failures
+        :param extra: Optional list of (name, value) tuples to add as extra
+                      columns, where the format has room for them
+        :param target_extra: Optional dict of destinations to lists of
+                             (name, value) tuples to add as extra columns of
+                             the destination only, before extra
+        """
+
+        pass
+
+    def write_summary(self, timestamp, latency, status, extra=None):
+        """
+        Write the summary of a round where every check has reported
+
+        :param timestamp: Unix timestamp
+        :param latency: Average latency
+        :param status: One of Monitor.STATUS_*
+        :param extra: Optional list of (name, value) tuples to add as extra
+                      columns, where the format has room for them
+        """
+
+        pass
+
+    def _write(self, data):
+        self.file.write(data)
+        self.file.flush()
+
+    def _write_lines(self, timestamp, lines):
+        """
+        Append text lines and register them in the index
+
+        :param timestamp: Unix timestamp of the lines
+        :param lines: List of strings ending in a newline
+        """
+
+        lines = [line.encode() for line in lines]
+        offset = self.file.tell()
+
+        self._write(b"".join(lines))
+
+        # Index only after the lines are on disk, the reader validates it
+        if self.index:
+            for line in lines:
+                self.index.add(timestamp, offset)
+                offset += len(line)
+
+    def close(self):
+        self.file.close()
+
+        if self.index:
+            self.index.close()
+
+
+class AggregateWriter(LogWriter):
+    """
+    One timestamp, average latency, status line per round
+    """
+
+    def write_summary(self, timestamp, latency, status, extra=None):
+        line = "\t".join([
+            format_timestamp(timestamp), str(latency), status
+        ]) + format_extra(extra) + "\n"
+        self._write_lines(timestamp, [line])
+
+
+class TargetWriter(LogWriter):
+    """
+    One timestamp, target, latency, error class line per target per check
+    """
+
+    def write_results(self, timestamp, results, extra=None,
+                      target_extra=None):
+        formatted = format_timestamp(timestamp)
+        extra = format_extra(extra)
+        target_extra = target_extra or {}
+        lines = []
+        for destination, latency, error in results:
+            if latency is None:
+                latency = float("nan")
+
+            lines.append("\t".join([
+                formatted, destination, str(latency), error or NO_ERROR
+            ]) + format_extra(target_extra.get(destination)) + extra + "\n")
+
+        self._write_lines(timestamp, lines)
+
+
+class BinaryWriter(LogWriter):
+    """
+    Fixed-width binary records of the round summaries, can be memory mapped
+    by the reader without any parsing
+    """
+
+    # Fixed-width records can be searched without an index
+    indexed = False
+
+    # Read too, to validate what's being appended to
+    mode = 'ab+'
+
+    def __init__(self, filename):
+        super(BinaryWriter, self).__init__(filename)
+
+        if self.file.tell() == 0:
+            self._write(BINARY_HEADER.pack(
+                BINARY_MAGIC, BINARY_VERSION, BINARY_HEADER.size,
+                BINARY_RECORD.size
+            ))
+        else:
+            self._validate()
+
+    def _validate(self):
+        """
+        Refuse to append to anything that isn't a compatible binary log, and
+        drop a partially written last record so the new records line up
+        """
+
+        self.file.seek(0)
+        data = self.file.read(BINARY_HEADER.size)
+        self.file.seek(0, os.SEEK_END)
+
+        try:
+            header_size, record_size = read_binary_header(data)
+        except ValueError as err:
+            self.file.close()
+            raise ValueError("Can't append to {0}: {1}".format(
+                self.filename, err
+            ))
+
+        if record_size != BINARY_RECORD.size:
+            self.file.close()
+            raise ValueError("Can't append to {0}: unexpected record "
+                             "size {1}".format(self.filename, record_size))
+
+        size = self.file.tell()
+        torn = (size - header_size) % record_size
+        if torn:
+            self.file.truncate(size - torn)
+            self.file.seek(0, os.SEEK_END)
+
+    def write_summary(self, timestamp, latency, status, extra=None):
+        # Fixed-width records have no room for extra columns
+        self._write(BINARY_RECORD.pack(
+            timestamp, latency, STATUS_CODES[status]
+        ))
+
+
+WRITERS = {
+    FORMAT_AGGREGATE: AggregateWriter,
+    FORMAT_TARGETS: TargetWriter,
+    FORMAT_BINARY: BinaryWriter
+}
+
+
+def get_writer(log_format, filename):
+    """
+    Create a writer for the given format
+
+    :param log_format: One of FORMATS
+    :param filename: File to append to
+    :return: LogWriter instance
+    """
+
+    return WRITERS[log_format](filename)
@@ -0,0 +1,328 @@
+"""
+Metrics of the running monitor served over HTTP in the Prometheus text
+format. Everything is kept in memory and updated after every check, a scrape
+never touches the disk.
+"""
+
+import time
+import threading
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from connquality.logformat import STATUS_OK, STATUS_DEGRADED, STATUS_ERROR
+
+METRICS_PATH = "/metrics"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0]
+
+# What the checks_total result label is for successful checks
+RESULT_OK = "OK"
+
+
+def _escape(value):
+    """
+    Escape a label value
+    """
+
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value))
+
+
+def _format_sample(name, labels, value):
+    """
+    Format a line of the exposition format
+
+    :param name: Metric name
+    :param labels: List of (name, value) tuples
+    :param value: Number
+    :return: String
+    """
+
+    if labels:
+        name += "{" + ",".join(
+            '{0}="{1}"'.format(label, _escape(label_value))
+            for label, label_value in labels
+        ) + "}"
+
+    return "{0} {1}".format(name, _format_value(value))
+
+
+class TargetMetrics(object):
+    """
+    Metrics of a single target
+    """
+
+    def __init__(self):
+        self.latency = None
+        self.up = 0
+        self.last_check = None
+        self.results = {}
+
+        # Successful checks per bucket, the last one is +Inf
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.latency_count = 0
+
+    def add(self, timestamp, latency, error):
+        result = error or RESULT_OK
+        self.results[result] = self.results.get(result, 0) + 1
+        self.last_check = timestamp
+
+        if latency is None:
+            self.up = 0
+            return
+
+        self.up = 1
+        self.latency = latency
+        self.latency_sum += latency
+        self.latency_count += 1
+
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.buckets[index] += 1
+                return
+
+        self.buckets[-1] += 1
+
+
+class Metrics(object):
+    """
+    In-memory metrics of every target and of the rounds, updated by the
+    monitor thread and read by the HTTP server thread
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.targets = {}
+        self.rounds = dict(
+            (status, 0) for status in (STATUS_OK, STATUS_DEGRADED,
+                                       STATUS_ERROR)
+        )
+        self.round_latency = None
+        self.started = time.time()
+
+    def add_results(self, timestamp, results):
+        """
+        Add the results of checks
+
+        :param timestamp: Unix timestamp of the checks
+        :param results: List of (destination, latency or None, error or
+                        None) tuples
+        """
+
+        with self.lock:
+            for destination, latency, error in results:
+                if destination not in self.targets:
+                    self.targets[destination] = TargetMetrics()
+
+                self.targets[destination].add(timestamp, latency, error)
+
+    def add_summary(self, timestamp, latency, status):
+        """
+        Add the summary of a round of checks
+
+        :param timestamp: Unix timestamp of the round
+        :param latency: Average latency in seconds
+        :param status: One of Monitor.STATUS_*
+        """
+
+        with self.lock:
+            self.rounds[status] = self.rounds.get(status, 0) + 1
+            self.round_latency = latency
+
+    def format(self):
+        """
+        Format the metrics in the Prometheus text exposition format
+
+        :return: String
+        """
+
+        lines = []
+
+        def add_metric(name, metric_type, help_text, samples):
+            lines.append("# HELP {0} {1}".format(name, help_text))
+            lines.append("# TYPE {0} {1}".format(name, metric_type))
+            for sample_name, labels, value in samples:
+                lines.append(_format_sample(sample_name, labels, value))
+
+        with self.lock:
+            targets = sorted(self.targets.items())
+
+            add_metric(
+                "connquality_up", "gauge",
+                "Whether the last check of the target succeeded",
+                [("connquality_up", [("target", target)], metrics.up)
+                 for target, metrics in targets]
+            )
+
+            add_metric(
+                "connquality_latency_seconds", "gauge",
+                "Latency of the last successful check of the target",
+                [("connquality_latency_seconds", [("target", target)],
+                  metrics.latency)
+                 for target, metrics in targets
+                 if metrics.latency is not None]
+            )
+
+            add_metric(
+                "connquality_last_check_timestamp_seconds", "gauge",
+                "Unix time of the last check of the target",
+                [("connquality_last_check_timestamp_seconds",
+                  [("target", target)], metrics.last_check)
+                 for target, metrics in targets]
+            )
+
+            add_metric(
+                "connquality_checks_total", "counter",
+                "Checks by target and result, OK or the error class",
+                [("connquality_checks_total",
+                  [("target", target), ("result", result)], count)
+                 for target, metrics in targets
+                 for result, count in sorted(metrics.results.items())]
+            )
+
+            samples = []
+            for target, metrics in targets:
+                count = 0
+                bounds = LATENCY_BUCKETS + [float("inf")]
+                for bound, bucket in zip(bounds, metrics.buckets):
+                    count += bucket
+                    samples.append((
+                        "connquality_check_latency_seconds_bucket",
+                        [("target", target), ("le", _format_value(bound))],
+                        count
+                    ))
+                samples.append(("connquality_check_latency_seconds_sum",
+                                [("target", target)], metrics.latency_sum))
+                samples.append(("connquality_check_latency_seconds_count",
+                                [("target", target)],
+                                metrics.latency_count))
+
+            add_metric(
+                "connquality_check_latency_seconds", "histogram",
+                "Latencies of the successful checks of the target",
+                samples
+            )
+
+            add_metric(
+                "connquality_rounds_total", "counter",
+                "Rounds of checks by status",
+                [("connquality_rounds_total", [("status", status)], count)
+                 for status, count in sorted(self.rounds.items())]
+            )
+
+            if self.round_latency is not None:
+                add_metric(
+                    "connquality_round_latency_seconds", "gauge",
+                    "Average latency of the last round of checks",
+                    [("connquality_round_latency_seconds", [],
+                      self.round_latency)]
+                )
+
+            add_metric(
+                "connquality_start_time_seconds", "gauge",
+                "Unix time the monitor started",
+                [("connquality_start_time_seconds", [], self.started)]
+            )
+
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serves the metrics of the server's Metrics
+    """
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != METRICS_PATH:
+            self.send_error(404)
+            return
+
+        body = self.server.metrics.format().encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger = self.server.logger
+        if logger:
+            logger.debug("Metrics request from {0}: {1}".format(
+                self.address_string(), format % args
+            ))
+
+
+class MetricsServer(object):
+    """
+    HTTP server for the metrics, running in a daemon thread so it never
+    holds up the checks or exiting
+    """
+
+    def __init__(self, metrics, address="127.0.0.1", port=9157,
+                 logger=None):
+        """
+        :param metrics: Metrics to serve
+        :param address: Address to listen on
+        :param port: Port to listen on, 0 for any free port
+        """
+
+        self.metrics = metrics
+        self.address = address
+        self.port = port
+        self.logger = logger
+
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        """
+        Start listening, socket errors are raised here
+
+        :return: Port the server listens on
+        """
+
+        self.server = HTTPServer((self.address, self.port), MetricsHandler)
+        self.server.metrics = self.metrics
+        self.server.logger = self.logger
+        self.port = self.server.server_address[1]
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        if self.logger:
+            self.logger.info("Serving metrics on http://{0}:{1}{2}".format(
+                self.address, self.port, METRICS_PATH
+            ))
+
+        return self.port
+
+    def close(self):
+        """
+        Stop the server
+        """
+
+        if self.server is None:
+            return
+
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.server = None
@@ -5,26 +5,65 @@ Monitoring system
 import sys
 import argparse
 import time
-import datetime
 import socket
+import errno
 import logging
-import platform
 
+# The monitor runs without numpy and the graphing dependencies, the modules it
+# imports here and for its options only use the standard library
+from connquality.scheduler import Scheduler, parse_schedule, \
+    get_monotonic_clock
+from connquality.logformat import FORMATS, FORMAT_AGGREGATE, FORMAT_TARGETS, \
+    get_writer, format_timestamp, STATUS_OK, STATUS_DEGRADED, STATUS_ERROR
+from connquality.rotation import PERIODS, RotatingWriter, parse_size
+from connquality.instrumentation import IterationTimer, TimedStreamHandler, \
+    format_summary, CHECKS, WRITES
+from connquality.burst import Burst, get_columns as get_burst_columns
+from connquality.resolver import Resolver, get_address, DEFAULT_TTL, \
+    DEFAULT_NEGATIVE_TTL
+from connquality.timing import CheckResult, format_phases, RESOLVE, SOCKET, \
+    CONNECT, CLOSE
 
-IS_WINDOWS = platform.system() == "Windows"
+
+# time.clock is gone from Python 3.8 and time.time jumps with the system time
+_clock = getattr(time, "perf_counter", None) or get_monotonic_clock()
 
 
 def get_clock():
     """
-    Get a timestamp with high resolution for calculating elapsed time
+    Get a timestamp with high resolution for calculating elapsed time, from a
+    monotonic clock
 
     :return: A timestamp (not necessarily a unix timestamp)
     :rtype: float
     """
-    if IS_WINDOWS:
-        return time.clock()
-    else:
-        return time.time()
+
+    return _clock()
+
+
+def get_error_class(err):
+    """
+    Classify a socket error for the logs
+
+    :param err: The caught exception
+    :return: One of Check.ERROR_*
+    """
+
+    if isinstance(err, socket.timeout):
+        return Check.ERROR_TIMEOUT
+
+    if isinstance(err, (socket.gaierror, socket.herror)):
+        return Check.ERROR_DNS
+
+    code = getattr(err, "errno", None)
+    if code == errno.ECONNREFUSED:
+        return Check.ERROR_REFUSED
+    if code in (errno.ENETUNREACH, errno.EHOSTUNREACH):
+        return Check.ERROR_UNREACHABLE
+    if code == errno.ETIMEDOUT:
+        return Check.ERROR_TIMEOUT
+
+    return Check.ERROR_SOCKET
 
 
 class Check(object):
@@ -32,11 +71,29 @@ class Check(object):
     Base class for all connection checks
     """
 
+    ERROR_TIMEOUT = "TIMEOUT"
+    ERROR_REFUSED = "REFUSED"
+    ERROR_UNREACHABLE = "UNREACHABLE"
+    ERROR_DNS = "DNS"
+    ERROR_SOCKET = "SOCKET"
+
     def __init__(self, destination, logger=None):
         self.destination = destination
         self.logger = logger
+        self.error = None
+
+        # Timing of the phases of the last check
+        self.result = CheckResult()
+
+        # Seconds spent resolving the destination in the last check, None if
+        # it wasn't resolved
+        self.dns_time = None
+
         self.parse_destination(destination)
 
+    def __str__(self):
+        return self.destination
+
     def parse_destination(self, destination):
         """
         Validate and parse destination address
@@ -50,7 +107,8 @@ class Check(object):
 
     def check(self):
         """
-        Run the connection check
+        Run the connection check, sets self.error to one of Check.ERROR_* if
+        it fails and times its phases in self.result
 
         :returns: Latency in seconds or None if failed
         """
@@ -62,12 +120,24 @@ class Check(object):
 
 class TCPCheck(Check):
     """
-    TCP/IP connection check
+    TCP/IP connection check, the address is resolved before connecting so
+    the latency is the TCP handshake alone
     """
 
-    def __init__(self, destination, logger=None):
+    def __init__(self, destination, logger=None, resolver=None):
+        """
+        :param destination: host:port
+        :param logger: Optional logger
+        :param resolver: Optional Resolver shared by the checks, the address
+                         is looked up on every check without one
+        """
+
         self.address = None
         self.port = None
+        self.resolver = resolver
+
+        # Address connected to in the last check
+        self.sockaddr = None
 
         super(TCPCheck, self).__init__(destination, logger)
 
@@ -101,26 +171,35 @@ class TCPCheck(Check):
                 self.destination
             ))
 
+        result = self.result
+        result.begin()
+        self.dns_time = None
+
         try:
+            self.sockaddr = self._resolve()
+            result.mark(RESOLVE)
+            self.dns_time = result.get_seconds(RESOLVE)
+
             soc = self._get_socket()
+            result.mark(SOCKET)
 
-            start = get_clock()
             self._connect(soc)
-            end = get_clock()
+            result.mark(CONNECT)
 
             self._close_socket(soc)
+            result.mark(CLOSE)
 
-            elapsed = round(end - start, 6)
+            self.error = None
 
             if self.logger:
-                self.logger.debug(
-                    "Connection to {0} established in {1}s".format(
-                        self.destination, elapsed
-                    )
-                )
+                self.logger.debug("Connection to {0} established: {1}".format(
+                    self.destination, format_phases(result)
+                ))
 
-            return elapsed
+            return result.latency
         except socket.error as err:
+            self.error = result.error = get_error_class(err)
+
             if self.logger:
                 self.logger.warn("Caught socket error when connecting to "
                                  "{0}".format(self.destination))
@@ -128,6 +207,16 @@ class TCPCheck(Check):
 
             return None
 
+    def _resolve(self):
+        """
+        Look up the address to connect to, overridden in tests
+        """
+
+        if self.resolver is not None:
+            return self.resolver.resolve(self.address, self.port)
+
+        return get_address(self.address, self.port)
+
     def _get_socket(self):
         """
         Return a new socket, overridden in tests
@@ -147,7 +236,7 @@ class TCPCheck(Check):
         Connect to the address with the given socket, overridden in tests
         """
 
-        soc.connect((self.address, self.port))
+        soc.connect(self.sockaddr)
 
 
 class Monitor(object):
@@ -155,14 +244,32 @@ class Monitor(object):
     Manages connection monitoring and logging
     """
 
-    STATUS_ERROR = "ERROR"
-    STATUS_DEGRADED = "DEGRADED"
-    STATUS_OK = "OK"
+    STATUS_ERROR = STATUS_ERROR
+    STATUS_DEGRADED = STATUS_DEGRADED
+    STATUS_OK = STATUS_OK
 
     def __init__(self, options):
         self.options = options
         self.logger = None
         self.checks = []
+        self.engine = None
+        self.scheduler = None
+        self.writer = None
+        self.metrics = None
+        self.metrics_server = None
+        self.sketches = None
+        self.rollups = None
+        self.round = {}
+
+        # Bursts of every check
+        self.bursts = {}
+
+        # Lookup times of the checks in the current round and their average
+        self.round_dns_times = []
+        self.round_dns = None
+
+        # Timing of the monitor's own work
+        self.timer = IterationTimer()
 
     def _initialize(self):
         """
@@ -172,8 +279,41 @@ class Monitor(object):
 
         socket.setdefaulttimeout(self.options.timeout)
 
+        self.scheduler = Scheduler(spread=self.options.spread,
+                                   logger=self.logger)
+
+        # Shared by all the checks, many of them may be to the same host
+        resolver = Resolver(self.options.dns_ttl,
+                            self.options.dns_negative_ttl, self.logger)
+
         for tcp_address in self.options.tcp:
-            self.checks.append(TCPCheck(tcp_address, self.logger))
+            destination, interval, offset = parse_schedule(
+                tcp_address, self.options.interval
+            )
+
+            check = TCPCheck(destination, self.logger, resolver)
+            self.checks.append(check)
+            self.scheduler.add(check, interval, offset)
+
+        if self.options.engine == "async":
+            from connquality.engine import AsyncEngine
+            self.engine = AsyncEngine(self.options.timeout, self.logger)
+
+        if self.options.metrics_port is not None:
+            from connquality.metrics import Metrics, MetricsServer
+            self.metrics = Metrics()
+            self.metrics_server = MetricsServer(
+                self.metrics, self.options.metrics_address,
+                self.options.metrics_port, self.logger
+            )
+
+        if self.options.sketches:
+            from connquality.sketch import SketchWriter
+            self.sketches = SketchWriter(self.options.logfile)
+
+        if self.options.rollups:
+            from connquality.rollup import RollupWriter
+            self.rollups = RollupWriter(self.options.logfile)
 
     def _initialize_logger(self):
         """
@@ -183,7 +323,9 @@ class Monitor(object):
         self.logger = logging.getLogger("connquality")
         self.logger.setLevel(logging.DEBUG)
 
-        handler = logging.StreamHandler()
+        handler = TimedStreamHandler()
+        self.timer.handler = handler
+
         if self.options.quiet:
             handler.setLevel(logging.ERROR)
         else:
@@ -195,27 +337,78 @@ class Monitor(object):
 
         self.logger.addHandler(handler)
 
-    def _run_checks(self):
+    def _probe(self, checks):
         """
-        Runs all the checks, determines average latency and connection status
+        Run the given checks, concurrently if an engine is available
 
-        :return: avg latency, Monitor.STATUS_*
+        :return: List of latencies (or None for failures) in check order
         """
 
-        if self.logger:
-            self.logger.debug("Running checks")
+        with self.timer.measure(CHECKS):
+            if self.engine:
+                return self.engine.run(checks)
+
+            return [check.check() for check in checks]
+
+    def _probe_burst(self, checks):
+        """
+        Run --burst probes of the given checks, --burst-spacing seconds
+        apart, failing a check only if every probe failed
 
-        check_count = len(self.checks)
+        :return: List of median latencies (or None for failures) and list of
+                 burst summaries, in check order
+        """
+
+        bursts = []
+        for check in checks:
+            if check not in self.bursts:
+                self.bursts[check] = Burst(self.options.burst)
+
+            burst = self.bursts[check]
+            burst.reset()
+            bursts.append(burst)
+
+        clock = get_monotonic_clock()
+        start = clock()
+
+        for probe in range(self.options.burst):
+            delay = start + probe * self.options.burst_spacing - clock()
+            if delay > 0:
+                time.sleep(delay)
+
+            latencies = self._probe(checks)
+            for check, burst, latency in zip(checks, bursts, latencies):
+                burst.add(latency, check.error)
+
+        medians = []
+        summaries = []
+        for check, burst in zip(checks, bursts):
+            summary = burst.summarize()
+            check.error = None if burst.count else burst.error
+            medians.append(summary["median"])
+            summaries.append(summary)
+
+        return medians, summaries
+
+    def _summarize(self, latencies):
+        """
+        Determine average latency and connection status for a round of checks
+
+        :param latencies: List of latencies (or None for failures)
+        :return: avg latency, Monitor.STATUS_*
+        """
+
+        check_count = len(latencies)
         errors = 0
-        latencies = []
+        successes = []
 
-        for check in self.checks:
-            latency = check.check()
+        # Failed checks have no latency, leave them out of the average
 
+        for latency in latencies:
             if latency is None:
                 errors += 1
             else:
-                latencies.append(latency)
+                successes.append(latency)
 
         if errors == check_count:
             if self.logger:
@@ -230,8 +423,8 @@ class Monitor(object):
                 self.logger.debug("All tests OK")
             result = self.STATUS_OK
 
-        if latencies:
-            avg_latency = round(sum(latencies) / float(check_count), 6)
+        if successes:
+            avg_latency = round(sum(successes) / float(len(successes)), 6)
         else:
             avg_latency = self.options.timeout
 
@@ -240,6 +433,70 @@ class Monitor(object):
 
         return avg_latency, result
 
+    def _run_checks(self, checks):
+        """
+        Runs the due checks, writes their results and collects them into the
+        current round
+
+        :return: avg latency, Monitor.STATUS_* once every check has reported
+                 in this round, otherwise None
+        """
+
+        if self.logger:
+            self.logger.debug("Running checks")
+
+        target_extra = {}
+        if self.options.burst > 1:
+            latencies, summaries = self._probe_burst(checks)
+
+            for check, summary in zip(checks, summaries):
+                target_extra[check.destination] = get_burst_columns(summary)
+        else:
+            latencies = self._probe(checks)
+
+        results = []
+        for check, latency in zip(checks, latencies):
+            results.append((check.destination, latency, check.error))
+            self.round.setdefault(check, []).append(latency)
+
+            # The latency is the connect alone, the lookup goes next to it
+            if check.dns_time is not None:
+                target_extra.setdefault(check.destination, []).append(
+                    ("dns", check.dns_time)
+                )
+                self.round_dns_times.append(check.dns_time)
+
+        timestamp = time.time()
+
+        if self.writer:
+            with self.timer.measure(WRITES):
+                self.writer.write_results(timestamp, results,
+                                          self._get_extra(),
+                                          target_extra or None)
+
+        if self.sketches:
+            with self.timer.measure(WRITES):
+                self.sketches.add(timestamp, results)
+
+        if self.metrics:
+            self.metrics.add_results(timestamp, results)
+
+        if len(self.round) < len(self.checks):
+            return None
+
+        latencies = []
+        for check in self.checks:
+            latencies.extend(self.round[check])
+        self.round = {}
+
+        if self.round_dns_times:
+            self.round_dns = round(
+                sum(self.round_dns_times) / len(self.round_dns_times), 6
+            )
+            self.round_dns_times = []
+
+        return self._summarize(latencies)
+
     def _get_timestamp(self, timestamp=None):
         """
         Get the current time in a standard format for the log file
@@ -250,24 +507,79 @@ class Monitor(object):
         if not timestamp:
             timestamp = time.time()
 
-        timestamp_dt = datetime.datetime.fromtimestamp(timestamp)
-        return timestamp_dt.isoformat()
+        return format_timestamp(timestamp)
 
-    def _sleep(self, elapsed):
+    def _get_extra(self):
         """
-        Sleep until it's time for the next iteration
+        Get the extra log columns of the current iteration
 
-        :param elapsed: Time spent in the previous iteration
+        :return: List of (name, value) tuples, None if not enabled
         """
-        remaining = round(self.options.interval - elapsed, 3)
 
-        if self.logger:
-            self.logger.debug("Waiting for {0}s before next iteration".format(
-                remaining
-            ))
+        if not self.options.timing_columns:
+            return None
+
+        return self.timer.get_columns()
+
+    def _get_summary_extra(self):
+        """
+        Get the extra log columns of a round summary, the average lookup
+        time and the timings if enabled
+
+        :return: List of (name, value) tuples, None if there are none
+        """
+
+        extra = []
+        if self.round_dns is not None:
+            extra.append(("dns", self.round_dns))
+
+        extra.extend(self._get_extra() or [])
+
+        return extra or None
+
+    def _report_overhead(self):
+        """
+        Log a summary of the monitor's own timings every
+        --timing-summary seconds
+        """
+
+        interval = self.options.timing_summary
+        if not interval:
+            return
+
+        if self.timer.clock() - self.timer.period_start < interval:
+            return
+
+        summary = self.timer.get_summary()
+        self.timer.reset()
+
+        if not self.logger:
+            return
+
+        self.logger.info(format_summary(summary))
+
+        budget = self.options.overhead_budget
+        if budget is not None and summary["cpu_percent"] > budget:
+            self.logger.warn(
+                "Monitor used {0:.2f} % CPU, over the budget of {1} %, its "
+                "measurements may be distorted".format(
+                    summary["cpu_percent"], budget
+                )
+            )
+
+    def _get_writer(self):
+        """
+        Create the log writer, rotating the log if requested
+        """
+
+        options = self.options
+
+        if options.rotate_size or options.rotate_period:
+            return RotatingWriter(options.format, options.logfile,
+                                  options.rotate_size, options.rotate_period,
+                                  options.compress, self.logger)
 
-        if remaining > 0:
-            time.sleep(remaining)
+        return get_writer(options.format, options.logfile)
 
     def run(self):
         """
@@ -279,19 +591,48 @@ class Monitor(object):
         if self.logger:
             self.logger.info("Starting connquality monitor")
 
-        with open(self.options.logfile, 'a') as monitoring_log:
+        self.writer = self._get_writer()
+
+        if self.metrics_server:
+            self.metrics_server.start()
+
+        try:
             while True:
-                start = get_clock()
+                checks, lateness = self.scheduler.wait()
+                self.timer.start(lateness)
+
+                summary = self._run_checks(checks)
 
-                latency, result = self._run_checks()
-                timestamp = self._get_timestamp()
+                if summary is not None:
+                    latency, result = summary
+                    timestamp = time.time()
 
-                line = "\t".join([timestamp, str(latency), result]) + "\n"
-                monitoring_log.write(line)
-                monitoring_log.flush()
+                    with self.timer.measure(WRITES):
+                        self.writer.write_summary(timestamp, latency, result,
+                                                  self._get_summary_extra())
 
-                end = get_clock()
-                self._sleep(end - start)
+                        if self.rollups:
+                            self.rollups.add(timestamp, latency, result)
+
+                    if self.metrics:
+                        self.metrics.add_summary(timestamp, latency, result)
+
+                self.timer.finish()
+                self._report_overhead()
+        finally:
+            self.writer.close()
+
+            if self.sketches:
+                self.sketches.close()
+
+            if self.rollups:
+                self.rollups.close()
+
+            if self.metrics_server:
+                self.metrics_server.close()
+
+            if self.engine:
+                self.engine.close()
 
 
 def parse_options(args):
@@ -307,18 +648,98 @@ def parse_options(args):
         required=True,
         action="append",
         help="TCP/IP address to monitor, e.g. google.com:80. For best results"
-             " use multiple addresses."
+             " use multiple addresses. Append @interval or @interval+offset "
+             "to check it on its own schedule, e.g. google.com:80@10+5"
     )
     parser.add_argument("--logfile", default="connection.log",
                         help="Where to store the connection quality data")
+    parser.add_argument("--format", default=FORMAT_AGGREGATE,
+                        choices=FORMATS,
+                        help="Log an average latency and status line per "
+                             "round (aggregate), the same as fixed-width "
+                             "binary records (binary) or a line per target "
+                             "per check (targets)")
+    parser.add_argument("--rotate-size", default=None, type=parse_size,
+                        help="Rotate the log when it grows this big, e.g. "
+                             "100M")
+    parser.add_argument("--rotate-period", default=None,
+                        choices=sorted(PERIODS.keys()),
+                        help="Rotate the log when a new hour, day, week or "
+                             "month starts")
+    parser.add_argument("--no-compress", dest="compress", default=True,
+                        action="store_false",
+                        help="Leave rotated logs uncompressed instead of "
+                             "compressing them with gzip")
     parser.add_argument("--interval", default=30.0, type=float,
                         help="How many seconds between checks")
+    parser.add_argument("--no-spread", dest="spread", default=True,
+                        action="store_false",
+                        help="Start all checks at the same time instead of "
+                             "spreading them evenly across the interval")
     parser.add_argument("--timeout", default=3.0, type=float,
                         help="How many seconds to wait for connection")
+    parser.add_argument("--dns-ttl", default=DEFAULT_TTL, type=float,
+                        help="How many seconds to keep the addresses of the "
+                             "targets for, 0 to look them up on every check. "
+                             "Expired addresses are looked up again in the "
+                             "background")
+    parser.add_argument("--dns-negative-ttl", default=DEFAULT_NEGATIVE_TTL,
+                        type=float,
+                        help="How many seconds to keep failed lookups for")
+    parser.add_argument("--engine", default="async",
+                        choices=["async", "serial"],
+                        help="Run the checks of an iteration concurrently "
+                             "(async) or one after another (serial)")
+    parser.add_argument("--burst", default=1, type=int,
+                        help="Probe every target this many times per "
+                             "interval and log the min, median, p95 and max "
+                             "latency, jitter and loss ratio of the burst, "
+                             "needs --format=targets")
+    parser.add_argument("--burst-spacing", default=0.2, type=float,
+                        help="How many seconds between the probes of a "
+                             "burst")
+    parser.add_argument("--sketches", default=False, action="store_true",
+                        help="Keep latency quantile sketches of every target "
+                             "for every minute, hour and day next to the "
+                             "log, for percentiles over long time ranges "
+                             "without reading the log")
+    parser.add_argument("--rollups", default=False, action="store_true",
+                        help="Keep rollups of the round summaries for every "
+                             "minute, hour and day next to the log, so long "
+                             "time ranges are graphed without reading the "
+                             "whole log. Not for --format=targets, which has "
+                             "no round summaries")
+    parser.add_argument("--metrics-port", default=None, type=int,
+                        help="Serve the current latencies and status "
+                             "counters for Prometheus on this port at "
+                             "/metrics")
+    parser.add_argument("--metrics-address", default="127.0.0.1",
+                        help="Address to serve the metrics on, e.g. 0.0.0.0 "
+                             "for all interfaces")
+    parser.add_argument("--timing-columns", default=False,
+                        action="store_true",
+                        help="Add the monitor's own timings to the text log "
+                             "lines as extra name=value columns: lateness, "
+                             "checks, logging, cpu and last_write seconds")
+    parser.add_argument("--timing-summary", default=None, type=float,
+                        help="Log a summary of the monitor's own timings and "
+                             "CPU use every this many seconds")
+    parser.add_argument("--overhead-budget", default=None, type=float,
+                        help="Warn in the timing summary when the monitor "
+                             "uses more than this percentage of CPU time")
     parser.add_argument("--quiet", default=False, action="store_true",
                         help="Do not output log data to screen")
 
-    return parser.parse_args(args)
+    options = parser.parse_args(args)
+
+    if options.rollups and options.format == FORMAT_TARGETS:
+        parser.error("--rollups needs the round summaries of the aggregate "
+                     "or binary format")
+    if options.burst > 1 and options.format != FORMAT_TARGETS:
+        parser.error("--burst needs --format=targets, the other formats "
+                     "have no columns for the statistics of every target")
+
+    return options
 
 
 def start_monitor():
@@ -0,0 +1,495 @@
+"""
+Outages, the periods checks were failing or degraded, found by run-length
+encoding the status column. The outages of whole logs are kept in a small
+index next to the log, so only what has been appended is read again. Time
+ranges are found by reading just the range.
+"""
+
+import os
+import numpy
+
+from connquality.logformat import BINARY_HEADER, COMPRESSED_SUFFIX, \
+    STATUS_OK, is_binary, read_binary_header
+from connquality.parser import STATUSES, BINARY_DTYPE, iter_chunks, \
+    parse_text, iter_columns, map_binary, binary_columns, select, \
+    find_complete_end
+from connquality.cache import get_log_state, is_valid, load_sidecar, \
+    save_sidecar
+from connquality.rotation import find_segments
+
+OUTAGES_SUFFIX = ".outages.npz"
+
+# Bump when the stored arrays change
+OUTAGES_VERSION = 1
+
+OK = STATUSES[STATUS_OK]
+
+# ongoing is True for outages still going on at the end of the log, leading
+# for outages starting at the first entry of their target in the log
+COLUMNS = ["starts", "ends", "statuses", "latencies", "ongoing", "leading"]
+
+# The run each target was in at the end of what has been read
+STATE_COLUMNS = ["starts", "statuses", "latencies", "lasts", "leading"]
+
+
+def get_outages_filename(filename):
+    """
+    Get the outage index path for a log
+
+    :param filename: Path to the log
+    :return: Path to the index
+    """
+
+    return filename + OUTAGES_SUFFIX
+
+
+def empty_outages():
+    """
+    :return: Dict of column name to empty numpy array, targets is None
+    """
+
+    outages = dict((name, numpy.zeros(0)) for name in COLUMNS)
+    outages["ongoing"] = numpy.zeros(0, dtype=bool)
+    outages["leading"] = numpy.zeros(0, dtype=bool)
+    outages["targets"] = None
+
+    return outages
+
+
+def find_runs(statuses):
+    """
+    Run-length encode statuses
+
+    :param statuses: numpy array of STATUSES values
+    :return: numpy array of the indexes where every run of the same status
+             starts
+    """
+
+    if not len(statuses):
+        return numpy.zeros(0, dtype=numpy.intp)
+
+    changes = numpy.nonzero(statuses[1:] != statuses[:-1])[0] + 1
+    return numpy.concatenate([[0], changes])
+
+
+def _concatenate(parts):
+    """
+    Concatenate outages, per-target outages and aggregate ones included
+    """
+
+    parts = [part for part in parts if len(part["starts"])]
+    if not parts:
+        return empty_outages()
+
+    outages = dict(
+        (name, numpy.concatenate([part[name] for part in parts]))
+        for name in COLUMNS
+    )
+
+    outages["targets"] = None
+    if any(part["targets"] is not None for part in parts):
+        outages["targets"] = numpy.concatenate([
+            part["targets"] if part["targets"] is not None
+            else numpy.full(len(part["starts"]), "")
+            for part in parts
+        ])
+
+    return outages
+
+
+def _sort(outages):
+    order = numpy.argsort(outages["starts"], kind="mergesort")
+    return select(outages, order)
+
+
+class OutageFinder(object):
+    """
+    Finds the outages of a log chunk by chunk. A run of the same status can
+    continue from one chunk to the next, so the run every target is in is
+    kept until the status changes.
+    """
+
+    def __init__(self):
+        self.parts = []
+
+        # Target (None for aggregate entries) to the start, status, worst
+        # latency, last timestamp and leading flag of its current run
+        self.runs = {}
+
+    def add(self, timestamps, statuses, latencies, target=None):
+        """
+        Add the next entries of one target
+
+        :param timestamps: numpy array of unix timestamps
+        :param statuses: numpy array of STATUSES values
+        :param latencies: numpy array of latencies, NaN for failures
+        :param target: Target of the entries, None for aggregate entries
+        """
+
+        if not len(timestamps):
+            return
+
+        indexes = find_runs(statuses)
+        starts = timestamps[indexes].astype(numpy.float64)
+        run_statuses = statuses[indexes].astype(numpy.float64)
+        worst = numpy.fmax.reduceat(
+            latencies.astype(numpy.float64), indexes
+        )
+
+        # Every status lasts until the next entry
+        ends = numpy.append(starts[1:], timestamps[-1])
+        leading = numpy.zeros(len(indexes), dtype=bool)
+
+        current = self.runs.get(target)
+        if current is None:
+            leading[0] = True
+        elif current[1] == run_statuses[0]:
+            starts[0] = current[0]
+            worst[0] = numpy.fmax(worst[0], current[2])
+            leading[0] = current[4]
+        else:
+            self._add_closed(target, [current[0]], [starts[0]],
+                             [current[1]], [current[2]], [current[4]])
+
+        self._add_closed(target, starts[:-1], ends[:-1], run_statuses[:-1],
+                         worst[:-1], leading[:-1])
+
+        self.runs[target] = [starts[-1], run_statuses[-1], worst[-1],
+                             float(timestamps[-1]), bool(leading[-1])]
+
+    def _add_closed(self, target, starts, ends, statuses, latencies,
+                    leading):
+        statuses = numpy.asarray(statuses, dtype=numpy.float64)
+        failing = statuses != OK
+
+        if not failing.any():
+            return
+
+        count = int(failing.sum())
+        self.parts.append({
+            "starts": numpy.asarray(starts, dtype=numpy.float64)[failing],
+            "ends": numpy.asarray(ends, dtype=numpy.float64)[failing],
+            "statuses": statuses[failing],
+            "latencies": numpy.asarray(latencies,
+                                       dtype=numpy.float64)[failing],
+            "ongoing": numpy.zeros(count, dtype=bool),
+            "leading": numpy.asarray(leading, dtype=bool)[failing],
+            "targets": None if target is None else numpy.full(count, target)
+        })
+
+    def add_columns(self, columns):
+        """
+        Add the next entries of a log
+
+        :param columns: Dict of column name to numpy array, as the parser
+                        returns them
+        """
+
+        targets = columns["targets"]
+
+        if targets is None:
+            self.add(columns["timestamps"], columns["statuses"],
+                     columns["latencies"])
+            return
+
+        for target in numpy.unique(targets):
+            selected = targets == target
+            self.add(columns["timestamps"][selected],
+                     columns["statuses"][selected],
+                     columns["latencies"][selected], str(target))
+
+    def get_outages(self):
+        """
+        :return: Dict of column name to numpy array of the outages in the
+                 order they started, targets is None for aggregate logs
+        """
+
+        ongoing = []
+        for target, (start, status, latency, last, leading) in \
+                self.runs.items():
+            if status == OK:
+                continue
+
+            ongoing.append({
+                "starts": numpy.array([start]),
+                "ends": numpy.array([last]),
+                "statuses": numpy.array([status]),
+                "latencies": numpy.array([latency]),
+                "ongoing": numpy.array([True]),
+                "leading": numpy.array([leading]),
+                "targets": None if target is None else numpy.array([target])
+            })
+
+        # Closed outages are kept together from now on
+        self.parts = [_concatenate(self.parts)]
+
+        return _sort(_concatenate(self.parts + ongoing))
+
+    def get_arrays(self):
+        """
+        :return: Dict of array name to numpy array for saving the finder
+        """
+
+        closed = _concatenate(self.parts)
+        arrays = dict((name, closed[name]) for name in COLUMNS)
+        if closed["targets"] is not None:
+            arrays["targets"] = closed["targets"]
+
+        targets = list(self.runs)
+        arrays["state_targets"] = numpy.array(
+            [target or "" for target in targets], dtype=numpy.str_
+        )
+
+        for column, name in enumerate(STATE_COLUMNS):
+            arrays["state_" + name] = numpy.array(
+                [self.runs[target][column] for target in targets],
+                dtype=bool if name == "leading" else numpy.float64
+            )
+
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Continue from a saved finder
+
+        :param arrays: Dict of array name to numpy array from get_arrays
+        :return: OutageFinder
+        """
+
+        finder = cls()
+
+        closed = dict((name, arrays[name]) for name in COLUMNS)
+        closed["targets"] = arrays.get("targets")
+        finder.parts = [closed]
+
+        for row, target in enumerate(arrays["state_targets"]):
+            finder.runs[str(target) or None] = [
+                float(arrays["state_" + name][row])
+                if name != "leading" else bool(arrays["state_" + name][row])
+                for name in STATE_COLUMNS
+            ]
+
+        return finder
+
+
+def load_outages_index(filename):
+    """
+    Load the outage index of a log
+
+    :param filename: Path to the log
+    :return: Dict of array name to numpy array, None if there's no usable
+             index
+    """
+
+    return load_sidecar(get_outages_filename(filename), OUTAGES_VERSION)
+
+
+def save_outages_index(filename, finder, state):
+    """
+    Write the outage index of a log, replacing the previous one
+
+    :param filename: Path to the log
+    :param finder: OutageFinder that has read the log as far as state says
+    :param state: Dict from cache.get_log_state
+    """
+
+    save_sidecar(get_outages_filename(filename), finder.get_arrays(),
+                 OUTAGES_VERSION, state)
+
+
+def _read_entries(filename, f, finder, offset, size):
+    """
+    Add the entries of the log after offset to the finder
+
+    :return: Offset the log has been read up to
+    """
+
+    if filename.endswith(COMPRESSED_SUFFIX):
+        # Rotated segments don't change, they're read once from the start
+        for columns in iter_columns(filename):
+            finder.add_columns(columns)
+        return size
+
+    if is_binary(filename):
+        f.seek(0)
+        header_size = read_binary_header(f.read(BINARY_HEADER.size))[0]
+        records = map_binary(filename)
+
+        done = max(offset - header_size, 0) // BINARY_DTYPE.itemsize
+        finder.add_columns(binary_columns(records[done:]))
+        return header_size + len(records) * BINARY_DTYPE.itemsize
+
+    end = find_complete_end(f, offset, size)
+
+    f.seek(offset)
+    for data in iter_chunks(f, limit=end - offset):
+        finder.add_columns(parse_text(data))
+
+    return end
+
+
+def update_outages(filename, logger=None):
+    """
+    Find the outages of a single log file, reusing its outage index and
+    only reading the entries appended since the index was saved
+
+    :param filename: Path to the log
+    :return: Dict of column name to numpy array
+    """
+
+    index = load_outages_index(filename)
+
+    with open(filename, 'rb') as f:
+        stat = os.fstat(f.fileno())
+
+        if index is not None and not is_valid(index, stat, f):
+            if logger:
+                logger.info("Log has been replaced, dropping outage index")
+            index = None
+
+        if index is None:
+            finder = OutageFinder()
+            offset = 0
+        else:
+            finder = OutageFinder.from_arrays(index)
+            offset = int(index["offset"])
+
+            if filename.endswith(COMPRESSED_SUFFIX):
+                return finder.get_outages()
+
+        end = _read_entries(filename, f, finder, offset, stat.st_size)
+        if end == offset:
+            return finder.get_outages()
+
+        state = get_log_state(f, stat, end)
+
+    try:
+        save_outages_index(filename, finder, state)
+    except (IOError, OSError) as err:
+        if logger:
+            logger.warn("Could not save outage index: {0}".format(err))
+
+    return finder.get_outages()
+
+
+def _same_target(outages, target):
+    if outages["targets"] is None:
+        return numpy.full(len(outages["starts"]), target is None)
+
+    return outages["targets"] == (target or "")
+
+
+def join_outages(parts):
+    """
+    Join the outages of consecutive rotated segments, an outage going on at
+    the end of a segment continues in the next one if it starts that with
+    the same status
+
+    :param parts: List of dicts from update_outages, oldest first
+    :return: Dict of column name to numpy array
+    """
+
+    if not parts:
+        return empty_outages()
+
+    joined = dict(
+        (name, values.copy() if values is not None else None)
+        for name, values in parts[0].items()
+    )
+
+    for part in parts[1:]:
+        keep = numpy.ones(len(part["starts"]), dtype=bool)
+
+        for index in numpy.nonzero(joined["ongoing"])[0]:
+            target = None
+            if joined["targets"] is not None:
+                target = str(joined["targets"][index]) or None
+
+            matches = numpy.nonzero(
+                part["leading"] & keep &
+                (part["statuses"] == joined["statuses"][index]) &
+                _same_target(part, target)
+            )[0]
+
+            # Whether or not it continues, it's over by the next segment
+            joined["ongoing"][index] = False
+
+            if len(matches):
+                match = matches[0]
+                joined["ends"][index] = part["ends"][match]
+                joined["latencies"][index] = numpy.fmax(
+                    joined["latencies"][index], part["latencies"][match]
+                )
+                joined["ongoing"][index] = part["ongoing"][match]
+                keep[match] = False
+
+        joined = _concatenate([joined, select(part, keep)])
+
+    return _sort(joined)
+
+
+def query_outages(outages, start=None, end=None):
+    """
+    Select the outages overlapping a time range
+
+    :param outages: Dict of column name to numpy array
+    :param start: Optional unix timestamp to start from
+    :param end: Optional unix timestamp to end at
+    :return: Dict of column name to numpy array
+    """
+
+    selected = numpy.ones(len(outages["starts"]), dtype=bool)
+
+    if start is not None:
+        selected &= outages["ends"] >= start
+
+    if end is not None:
+        selected &= outages["starts"] <= end
+
+    return select(outages, selected)
+
+
+def find_outages(filename, start=None, end=None, logger=None):
+    """
+    Find the outages of a time range by reading only that range of the log,
+    found through the time index, and nothing else. Outages going on at
+    the edges of the range are cut there.
+
+    :param filename: Path to the log
+    :param start: Optional unix timestamp to start from
+    :param end: Optional unix timestamp to end at
+    :return: Dict of column name to numpy array
+    """
+
+    finder = OutageFinder()
+
+    # Runs continue from one rotated segment to the next by themselves
+    for segment in find_segments(filename, start, end):
+        for columns in iter_columns(segment, start, end, logger=logger):
+            finder.add_columns(columns)
+
+    return finder.get_outages()
+
+
+def read_outages(filename, start=None, end=None, logger=None):
+    """
+    Find the outages of a log overlapping a time range, rotated segments of
+    it included. A time range costs as much as reading the range, only the
+    outages of whole logs go through the outage index.
+
+    :param filename: Path to the log
+    :param start: Optional unix timestamp to start from
+    :param end: Optional unix timestamp to end at
+    :return: Dict of column name to numpy array of the outages in the order
+             they started, targets is None for aggregate logs
+    """
+
+    if start is not None or end is not None:
+        return find_outages(filename, start, end, logger)
+
+    parts = [
+        update_outages(segment, logger) for segment in find_segments(filename)
+    ]
+
+    return join_outages(parts)
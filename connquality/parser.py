@@ -0,0 +1,791 @@
+"""
+Vectorized parsing of the text log formats
+"""
+
+import os
+import time
+import numpy
+import multiprocessing
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    # Python < 3.8, the arrays are pickled instead
+    shared_memory = None
+
+from connquality.logformat import BINARY_HEADER, STATUS_CODES, STATUSES, \
+    STATUS_OK, STATUS_DEGRADED, STATUS_ERROR, COMPRESSED_SUFFIX, is_binary, \
+    read_binary_header, open_log
+from connquality.index import load_index, parse_timestamp
+from connquality.rollup import read_rollup_header
+
+# How much of the file to parse at once
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# Parsing less than this per process isn't worth starting processes for
+PARALLEL_MIN_SIZE = 4 * 1024 * 1024
+
+COLUMNS = ["timestamps", "datetimes", "latencies", "statuses", "targets"]
+
+# Matches logformat.BINARY_RECORD
+BINARY_DTYPE = numpy.dtype([
+    ("timestamp", "<f8"),
+    ("latency", "<f4"),
+    ("status", "u1"),
+    ("reserved", "V3")
+])
+
+# Matches rollup.ROLLUP_RECORD
+ROLLUP_DTYPE = numpy.dtype([
+    ("start", "<f8"),
+    ("count", "<u4"),
+    ("degraded", "<u4"),
+    ("errors", "<u4"),
+    ("sum", "<f8"),
+    ("min", "<f8"),
+    ("max", "<f8"),
+    ("reserved", "V4")
+])
+
+
+def iter_chunks(f, chunk_size=CHUNK_SIZE, limit=None):
+    """
+    Read a file in large blocks that always end at a line boundary
+
+    :param f: File object opened in binary mode
+    :param limit: Optional maximum number of bytes to read
+    :return: Generator of bytes
+    """
+
+    remainder = b""
+
+    while True:
+        if limit is not None:
+            if limit <= 0:
+                break
+            data = f.read(min(chunk_size, limit))
+            limit -= len(data)
+        else:
+            data = f.read(chunk_size)
+
+        if not data:
+            break
+
+        data = remainder + data
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            remainder = data
+            continue
+
+        remainder = data[end:]
+        yield data[:end]
+
+    if remainder:
+        yield remainder
+
+
+def local_to_epoch(datetimes):
+    """
+    Convert local time datetime64 values to unix timestamps, giving the same
+    results as time.mktime() does
+
+    :param datetimes: numpy array of datetime64[us]
+    :return: numpy array of unix timestamps
+    """
+
+    micros = datetimes.astype(numpy.int64)
+
+    # UTC offsets only change on hour boundaries, look them up per hour
+    hours, inverse = numpy.unique(micros // 3600000000, return_inverse=True)
+
+    offsets = numpy.empty(len(hours))
+    for index, hour in enumerate(hours):
+        hour_dt = numpy.datetime64(int(hour), "h").astype(object)
+        offsets[index] = hour * 3600.0 - time.mktime(hour_dt.timetuple())
+
+    return micros / 1E6 - offsets[inverse.reshape(-1)]
+
+
+def epoch_to_local(timestamps):
+    """
+    Convert unix timestamps to local time datetime64 values, like the text
+    logs store them
+
+    :param timestamps: numpy array of unix timestamps
+    :return: numpy array of datetime64[us]
+    """
+
+    # Per hour like in local_to_epoch
+    hours, inverse = numpy.unique(
+        numpy.floor(timestamps / 3600.0), return_inverse=True
+    )
+    offsets = numpy.array([
+        time.localtime(hour * 3600.0).tm_gmtoff for hour in hours
+    ], dtype=numpy.float64)
+
+    local = timestamps + offsets[inverse.reshape(-1)]
+    return numpy.round(local * 1E6).astype("datetime64[us]")
+
+
+def map_statuses(values):
+    """
+    Map status strings to their STATUSES values
+
+    :param values: numpy array of status bytes
+    :return: numpy array of floats
+    """
+
+    unique, inverse = numpy.unique(values, return_inverse=True)
+    lookup = numpy.array([STATUSES[status.decode()] for status in unique],
+                         dtype=numpy.float64)
+    return lookup[inverse.reshape(-1)]
+
+
+def _is_number(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _get_aggregate_rows(fields):
+    """
+    Tell aggregate lines from per-target lines with the same number of
+    fields, aggregate lines have a number in the second field
+
+    :param fields: 2D array from _split_fields
+    :return: Boolean numpy array, True for aggregate lines
+    """
+
+    count = len(fields)
+
+    if fields.shape[1] < 4:
+        return numpy.ones(count, dtype=bool)
+
+    try:
+        fields[:, 1].astype(numpy.float64)
+        return numpy.ones(count, dtype=bool)
+    except ValueError:
+        pass
+
+    unique, inverse = numpy.unique(fields[:, 1], return_inverse=True)
+    numbers = numpy.array([_is_number(value) for value in unique], dtype=bool)
+    return numbers[inverse.reshape(-1)]
+
+
+def _split_fields(lines, field_count):
+    """
+    Split lines with the same number of fields into a 2D array of fields
+    """
+
+    fields = b"\t".join(lines).split(b"\t")
+    return numpy.array(fields).reshape(-1, field_count)
+
+
+def empty_columns():
+    """
+    Columns for an empty log
+
+    :return: Dict of column name to empty numpy array, targets is None
+    """
+
+    return {
+        "timestamps": numpy.zeros(0),
+        "datetimes": numpy.zeros(0, dtype="datetime64[us]"),
+        "latencies": numpy.zeros(0),
+        "statuses": numpy.zeros(0),
+        "targets": None
+    }
+
+
+def parse_text(data):
+    """
+    Parse complete lines of a text log, aggregate and per-target lines may be
+    mixed and any extra trailing fields are ignored
+
+    :param data: Bytes of one or more complete lines
+    :return: Dict of column name to numpy array, targets is None when there
+             are no per-target lines
+    """
+
+    lines = numpy.array([line for line in data.split(b"\n") if line])
+    count = len(lines)
+
+    if not count:
+        return empty_columns()
+
+    datetimes = numpy.empty(count, dtype="datetime64[us]")
+    latencies = numpy.empty(count)
+    statuses = numpy.empty(count)
+    target_parts = []
+
+    # Lines with the same number of fields can be split in one go
+    field_counts = numpy.char.count(lines, b"\t") + 1
+
+    for field_count in numpy.unique(field_counts):
+        selected = numpy.nonzero(field_counts == field_count)[0]
+
+        if field_count < 3:
+            raise ValueError("Malformed log line {0!r}".format(
+                lines[selected[0]]
+            ))
+
+        fields = _split_fields(lines[selected], field_count)
+
+        datetimes[selected] = fields[:, 0].astype("datetime64[us]")
+
+        aggregate = _get_aggregate_rows(fields)
+
+        # timestamp, latency, status
+        rows = selected[aggregate]
+        if len(rows):
+            latencies[rows] = fields[aggregate, 1].astype(numpy.float64)
+            statuses[rows] = map_statuses(fields[aggregate, 2])
+
+        # timestamp, target, latency, error class
+        per_target = ~aggregate
+        rows = selected[per_target]
+        if len(rows):
+            target_parts.append(
+                (rows, fields[per_target, 1].astype(numpy.str_))
+            )
+            latencies[rows] = fields[per_target, 2].astype(numpy.float64)
+            statuses[rows] = numpy.where(
+                fields[per_target, 3] == STATUS_OK.encode(),
+                STATUSES[STATUS_OK],
+                STATUSES[STATUS_ERROR]
+            )
+
+    targets = None
+    if target_parts:
+        width = max(part.dtype.itemsize // 4 for _, part in target_parts)
+        targets = numpy.zeros(count, dtype="U{0}".format(width))
+        for selected, part in target_parts:
+            targets[selected] = part
+
+    return {
+        "timestamps": local_to_epoch(datetimes),
+        "datetimes": datetimes,
+        "latencies": latencies,
+        "statuses": statuses,
+        "targets": targets
+    }
+
+
+def concatenate(parts):
+    """
+    Join columns parsed from consecutive chunks
+
+    :param parts: List of dicts from parse_text
+    :return: Dict of column name to numpy array
+    """
+
+    if not parts:
+        return empty_columns()
+
+    if len(parts) == 1:
+        return parts[0]
+
+    columns = {}
+    for name in COLUMNS:
+        if name == "targets":
+            continue
+
+        # Binary logs leave datetimes to be worked out later
+        if any(part[name] is None for part in parts):
+            columns[name] = None
+            continue
+
+        columns[name] = numpy.concatenate([part[name] for part in parts])
+
+    if any(part["targets"] is not None for part in parts):
+        columns["targets"] = numpy.concatenate([
+            part["targets"] if part["targets"] is not None
+            else numpy.zeros(len(part["latencies"]), dtype=numpy.str_)
+            for part in parts
+        ])
+    else:
+        columns["targets"] = None
+
+    return columns
+
+
+def parse_file(f, chunk_size=CHUNK_SIZE, limit=None):
+    """
+    Parse a text log from the current position
+
+    :param f: File object opened in binary mode
+    :param limit: Optional maximum number of bytes to parse
+    :return: Dict of column name to numpy array
+    """
+
+    return concatenate([
+        parse_text(data) for data in iter_chunks(f, chunk_size, limit)
+    ])
+
+
+def split_ranges(f, start, end, count):
+    """
+    Split a byte range of a text log into about count ranges that start and
+    end at line boundaries
+
+    :param f: File object opened in binary mode
+    :param start: Offset of the start of a line
+    :param end: Offset of the end of a line or the file
+    :param count: Number of ranges to aim for
+    :return: List of (start, end) offsets
+    """
+
+    boundaries = [start]
+
+    for number in range(1, count):
+        position = start + (end - start) * number // count
+        if position <= boundaries[-1]:
+            continue
+
+        # Move to the start of the next line
+        f.seek(position - 1)
+        position += len(f.readline()) - 1
+
+        if position >= end:
+            break
+
+        boundaries.append(position)
+
+    boundaries.append(end)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _share_columns(columns):
+    """
+    Move parsed columns to a shared memory block for the parent process
+
+    :return: Block name, list of (column, dtype, length, offset)
+    """
+
+    arrays = [
+        (name, columns[name]) for name in COLUMNS
+        if columns[name] is not None
+    ]
+
+    block = shared_memory.SharedMemory(
+        create=True, size=max(sum(array.nbytes for _, array in arrays), 1)
+    )
+
+    layout = []
+    offset = 0
+    for name, array in arrays:
+        numpy.ndarray(array.shape, array.dtype, buffer=block.buf,
+                      offset=offset)[:] = array
+        layout.append((name, array.dtype.str, len(array), offset))
+        offset += array.nbytes
+
+    block.close()
+    return block.name, layout
+
+
+def _parse_range(args):
+    """
+    Parse a byte range of a text log in a worker process
+
+    :return: None and the shared columns, or an error message
+    """
+
+    filename, start, end = args
+
+    try:
+        with open(filename, 'rb') as f:
+            f.seek(start)
+            columns = parse_file(f, limit=end - start)
+    except ValueError as err:
+        return str(err), None
+
+    if shared_memory is None:
+        return None, columns
+
+    return None, _share_columns(columns)
+
+
+def _gather(results):
+    """
+    Join the columns of the workers in order, releasing the shared memory
+    """
+
+    if shared_memory is None:
+        return concatenate([columns for _, columns in results])
+
+    blocks = []
+    try:
+        parts = []
+        for _, (name, layout) in results:
+            block = shared_memory.SharedMemory(name=name)
+            blocks.append(block)
+
+            part = dict((column, None) for column in COLUMNS)
+            for column, dtype, length, offset in layout:
+                part[column] = numpy.ndarray(length, dtype, buffer=block.buf,
+                                             offset=offset)
+            parts.append(part)
+
+        # Copied out of the shared memory, a single part has to be copied
+        columns = concatenate(parts)
+        if len(parts) == 1:
+            columns = dict(
+                (column, None if array is None else array.copy())
+                for column, array in columns.items()
+            )
+
+        # The views have to go before the blocks can be closed
+        del parts, part
+        return columns
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def _release(results):
+    if shared_memory is None:
+        return
+
+    for error, shared in results:
+        if error is None:
+            block = shared_memory.SharedMemory(name=shared[0])
+            block.close()
+            block.unlink()
+
+
+def parse_parallel(filename, start=0, end=None, jobs=None):
+    """
+    Parse a text log with several processes, each parsing a part of it. The
+    arrays come back through shared memory and are joined in order.
+
+    :param filename: Path to the log
+    :param start: Offset of the line to start from
+    :param end: Optional offset to stop at, defaults to the end of the last
+                complete line
+    :param jobs: Number of processes, defaults to the number of CPUs
+    :return: Dict of column name to numpy array
+    """
+
+    if end is None:
+        with open(filename, 'rb') as f:
+            end = find_complete_end(f, start, os.fstat(f.fileno()).st_size)
+
+    jobs = jobs or multiprocessing.cpu_count()
+    jobs = min(jobs, max((end - start) // PARALLEL_MIN_SIZE, 1))
+
+    if jobs < 2:
+        with open(filename, 'rb') as f:
+            f.seek(start)
+            return parse_file(f, limit=end - start)
+
+    with open(filename, 'rb') as f:
+        ranges = split_ranges(f, start, end, jobs)
+
+    if shared_memory is not None:
+        # Started here so the workers share it, otherwise every worker
+        # starts its own, which removes the blocks when the worker exits
+        resource_tracker.ensure_running()
+
+    pool = multiprocessing.Pool(len(ranges))
+    try:
+        results = pool.map(_parse_range, [
+            (filename, range_start, range_end)
+            for range_start, range_end in ranges
+        ])
+    finally:
+        pool.close()
+        pool.join()
+
+    errors = [error for error, _ in results if error is not None]
+    if errors:
+        _release(results)
+        raise ValueError(errors[0])
+
+    return _gather(results)
+
+
+def select(columns, selected):
+    """
+    Select the same rows from every column
+
+    :param columns: Dict of column name to numpy array or None
+    :param selected: Anything numpy can index with
+    :return: Dict of column name to numpy array or None
+    """
+
+    return dict(
+        (name, values[selected] if values is not None else None)
+        for name, values in columns.items()
+    )
+
+
+def map_binary(filename):
+    """
+    Map the records of a binary log to memory
+
+    :param filename: Path to the log, compressed logs are read to memory
+    :return: numpy array of BINARY_DTYPE records backed by the file
+    """
+
+    compressed = filename.endswith(COMPRESSED_SUFFIX)
+
+    with open_log(filename) as f:
+        if compressed:
+            # Can't be mapped, but rotated segments are not that big
+            data = f.read()
+        else:
+            data = f.read(BINARY_HEADER.size)
+
+    header_size, record_size = read_binary_header(data)
+
+    if record_size != BINARY_DTYPE.itemsize:
+        raise ValueError("Unexpected record size {0} in {1}".format(
+            record_size, filename
+        ))
+
+    size = len(data) if compressed else os.path.getsize(filename)
+
+    # A partially written last record is ignored
+    count = (size - header_size) // record_size
+
+    if not count:
+        return numpy.zeros(0, dtype=BINARY_DTYPE)
+
+    if compressed:
+        return numpy.frombuffer(data, dtype=BINARY_DTYPE, count=count,
+                                offset=header_size)
+
+    return numpy.memmap(filename, dtype=BINARY_DTYPE, mode='r',
+                        offset=header_size, shape=(count,))
+
+
+def binary_columns(records):
+    """
+    Columns of binary log records, timestamps and latencies are views to the
+    records and datetimes are left for the caller to work out when needed
+
+    :param records: numpy array of BINARY_DTYPE records
+    :return: Dict of column name to numpy array, datetimes is None
+    """
+
+    status_values = numpy.zeros(max(STATUS_CODES.values()) + 1)
+    for status, code in STATUS_CODES.items():
+        status_values[code] = STATUSES[status]
+
+    return {
+        "timestamps": records["timestamp"],
+        "datetimes": None,
+        "latencies": records["latency"],
+        "statuses": status_values[records["status"]],
+        "targets": None
+    }
+
+
+def map_rollups(filename):
+    """
+    Map the records of a rollup file to memory
+
+    :param filename: Path to the rollup file
+    :return: numpy array of ROLLUP_DTYPE records backed by the file
+    """
+
+    with open(filename, 'rb') as f:
+        header_size, record_size = read_rollup_header(f.read(1024))
+
+    if record_size != ROLLUP_DTYPE.itemsize:
+        raise ValueError("Unexpected record size {0} in {1}".format(
+            record_size, filename
+        ))
+
+    # A partially written last record is ignored
+    count = (os.path.getsize(filename) - header_size) // record_size
+
+    if not count:
+        return numpy.zeros(0, dtype=ROLLUP_DTYPE)
+
+    return numpy.memmap(filename, dtype=ROLLUP_DTYPE, mode='r',
+                        offset=header_size, shape=(count,))
+
+
+def rollup_columns(records, seconds):
+    """
+    Columns of rollup records
+
+    :param records: numpy array of ROLLUP_DTYPE records
+    :param seconds: Length of the buckets of the records
+    :return: Dict of the middle timestamps of the buckets, the number of
+             summaries, their latency sums, mins and maxes, and the worst
+             status of every bucket as STATUSES values
+    """
+
+    statuses = numpy.where(
+        records["errors"] > 0, STATUSES[STATUS_ERROR],
+        numpy.where(records["degraded"] > 0, STATUSES[STATUS_DEGRADED],
+                    STATUSES[STATUS_OK])
+    )
+
+    return {
+        "timestamps": records["start"] + seconds / 2.0,
+        "counts": records["count"].astype(numpy.int64),
+        "sums": records["sum"],
+        "mins": records["min"],
+        "maxes": records["max"],
+        "statuses": statuses
+    }
+
+
+def _iter_binary(filename, start, end, chunk_size):
+    records = map_binary(filename)
+
+    first = 0
+    last = len(records)
+    if start is not None:
+        first = numpy.searchsorted(records["timestamp"], start, "left")
+    if end is not None:
+        last = numpy.searchsorted(records["timestamp"], end, "right")
+
+    step = max(chunk_size // BINARY_DTYPE.itemsize, 1)
+    for position in range(first, last, step):
+        yield binary_columns(records[position:min(position + step, last)])
+
+
+def _iter_text(filename, start, end, chunk_size, logger):
+    start_offset = 0
+    end_offset = None
+
+    # Compressed logs have no index to seek with
+    indexed = not filename.endswith(COMPRESSED_SUFFIX)
+
+    if indexed and (start is not None or end is not None):
+        index = load_index(filename, logger)
+        start_offset, end_offset = index.find_range(start, end)
+
+    with open_log(filename) as f:
+        # A partially written last line is left for later, compressed
+        # segments are complete
+        if indexed and end_offset is None:
+            end_offset = find_complete_end(f, start_offset,
+                                           os.fstat(f.fileno()).st_size)
+
+        limit = None
+        if end_offset is not None:
+            limit = end_offset - start_offset
+
+        f.seek(start_offset)
+
+        for data in iter_chunks(f, chunk_size, limit):
+            columns = parse_text(data)
+            finished = False
+
+            if end is not None:
+                # Everything after the first entry past the end is skipped
+                beyond = numpy.nonzero(columns["timestamps"] > end)[0]
+                if len(beyond):
+                    columns = select(columns, slice(0, beyond[0]))
+                    finished = True
+
+            if start is not None:
+                columns = select(columns, columns["timestamps"] >= start)
+
+            if len(columns["timestamps"]):
+                yield columns
+
+            if finished:
+                return
+
+
+def iter_columns(filename, start=None, end=None, chunk_size=CHUNK_SIZE,
+                 logger=None):
+    """
+    Read a log of any format in chunks, only holding one chunk in memory
+
+    :param filename: Path to the log
+    :param start: Optional unix timestamp to start from
+    :param end: Optional unix timestamp to end at
+    :param chunk_size: Roughly how many bytes to read at once
+    :return: Generator of dicts of column name to numpy array, datetimes
+             are None for binary logs
+    """
+
+    if is_binary(filename):
+        return _iter_binary(filename, start, end, chunk_size)
+
+    return _iter_text(filename, start, end, chunk_size, logger)
+
+
+def find_complete_end(f, offset, size):
+    """
+    Find the end of the last complete line after offset, so a partially
+    written last line can be left for later
+
+    :param f: File object opened in binary mode
+    :param offset: Where to stop looking
+    :param size: Size of the file
+    :return: Offset after the last newline, offset if there's none
+    """
+
+    block = 4096
+    end = size
+
+    while end > offset:
+        position = max(end - block, offset)
+        f.seek(position)
+        data = f.read(end - position)
+
+        newline = data.rfind(b"\n")
+        if newline != -1:
+            return position + newline + 1
+
+        end = position
+
+    return offset
+
+
+def _last_line(f, size):
+    """
+    Find the last complete line by reading backwards from the end
+    """
+
+    block = 4096
+    while True:
+        position = max(size - block, 0)
+        f.seek(position)
+        data = f.read(size - position)
+
+        # Ignore a partially written last line
+        end = data.rfind(b"\n")
+        start = data.rfind(b"\n", 0, end) + 1
+
+        if start > 0 or position == 0:
+            return data[start:end + 1]
+
+        block *= 2
+
+
+def get_time_span(filename):
+    """
+    Get the timestamps of the first and last entries of a log without
+    reading all of it
+
+    :param filename: Path to the log
+    :return: first unix timestamp, last unix timestamp, None, None if empty
+    """
+
+    if is_binary(filename):
+        records = map_binary(filename)
+        if not len(records):
+            return None, None
+        return records["timestamp"][0], records["timestamp"][-1]
+
+    with open_log(filename) as f:
+        first = f.readline()
+        if not first.endswith(b"\n"):
+            return None, None
+
+        f.seek(0, os.SEEK_END)
+        last = _last_line(f, f.tell())
+
+    return parse_timestamp(first), parse_timestamp(last)
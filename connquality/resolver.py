@@ -0,0 +1,139 @@
+"""
+Cache of the addresses of the monitored hosts, shared by all the checks so
+the latency of a check is the TCP handshake alone and name lookups don't run
+on every check.
+"""
+
+import socket
+import threading
+
+from connquality.scheduler import get_monotonic_clock
+
+# The system resolver doesn't tell the TTL of the records, the addresses are
+# kept for a fixed time and failed lookups for a shorter one
+DEFAULT_TTL = 300.0
+DEFAULT_NEGATIVE_TTL = 30.0
+
+
+def get_address(host, port):
+    """
+    Look up the IPv4 address to connect to
+
+    :param host: Host name or IP address
+    :param port: Port number
+    :return: (IP address, port) tuple
+    """
+
+    infos = socket.getaddrinfo(host, port, socket.AF_INET,
+                               socket.SOCK_STREAM)
+    return infos[0][4]
+
+
+class Resolver(object):
+    """
+    Keeps the address of every host, or the error its lookup failed with, for
+    a while. Only the first lookup of a host blocks, expired entries are
+    still returned while a background thread looks the host up again, so
+    refreshing never holds up the checks.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL,
+                 logger=None):
+        """
+        :param ttl: Seconds to keep addresses for, 0 to look up every time
+        :param negative_ttl: Seconds to keep failed lookups for
+        :param logger: Optional logger
+        """
+
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.logger = logger
+        self.clock = get_monotonic_clock()
+
+        # (host, port) to (expiry, address or None, error or None)
+        self.entries = {}
+
+        # Keys being looked up in the background
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+    def is_cached(self, host, port):
+        """
+        Check if resolve would return without looking the host up
+
+        :param host: Host name or IP address
+        :param port: Port number
+        :return: bool
+        """
+
+        return self.ttl > 0 and (host, port) in self.entries
+
+    def resolve(self, host, port):
+        """
+        Get the address of a host, raises the socket.gaierror or
+        socket.herror of a failed lookup
+
+        :param host: Host name or IP address
+        :param port: Port number
+        :return: (IP address, port) tuple
+        """
+
+        if self.ttl <= 0:
+            return get_address(host, port)
+
+        key = (host, port)
+        entry = self.entries.get(key)
+
+        if entry is None:
+            entry = self._lookup(key)
+        elif entry[0] <= self.clock():
+            self._refresh(key)
+
+        expiry, address, error = entry
+        if error is not None:
+            # A new exception every time, raising the cached one would keep
+            # adding to its traceback
+            raise error.__class__(*error.args)
+
+        return address
+
+    def _lookup(self, key):
+        """
+        Look a host up and cache the result
+
+        :param key: (host, port) tuple
+        :return: The new entry
+        """
+
+        try:
+            entry = (self.clock() + self.ttl, get_address(*key), None)
+        except (socket.gaierror, socket.herror) as err:
+            entry = (self.clock() + self.negative_ttl, None, err)
+
+        self.entries[key] = entry
+        return entry
+
+    def _refresh(self, key):
+        """
+        Look a host up again in a background thread, unless already being
+        looked up
+        """
+
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+        if self.logger:
+            self.logger.debug("Refreshing the address of {0}".format(key[0]))
+
+        thread = threading.Thread(target=self._run_refresh, args=(key,))
+        thread.daemon = True
+        thread.start()
+
+    def _run_refresh(self, key):
+        try:
+            self._lookup(key)
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
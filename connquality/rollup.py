@@ -0,0 +1,171 @@
+"""
+Rollups of the round summaries for every minute, hour and day, written by the
+monitor as the buckets end. Long time ranges are graphed from a few thousand
+rollup records instead of every entry of the log.
+"""
+
+import math
+import struct
+
+from connquality.logformat import STATUS_DEGRADED, STATUS_ERROR
+from connquality.sketch import RESOLUTIONS
+
+ROLLUP_SUFFIX = ".rollup."
+
+# Rollup files start with a header like the binary logs, followed by
+# fixed-width records of bucket start, number of summaries, DEGRADED and
+# ERROR summaries, latency sum, min and max
+ROLLUP_MAGIC = b"CQROLL"
+ROLLUP_VERSION = 1
+ROLLUP_HEADER = struct.Struct("<6sHHH4x")
+ROLLUP_RECORD = struct.Struct("<dIIIddd4x")
+
+
+def get_rollup_filename(filename, resolution):
+    """
+    Get the rollup file of a log
+
+    :param filename: Path to the log
+    :param resolution: One of sketch.MINUTE, HOUR or DAY
+    :return: Path to the rollup file
+    """
+
+    return filename + ROLLUP_SUFFIX + resolution
+
+
+def read_rollup_header(data):
+    """
+    Parse and validate a rollup file header
+
+    :param data: At least ROLLUP_HEADER.size bytes from the start of the file
+    :return: header size, record size
+    """
+
+    if len(data) < ROLLUP_HEADER.size:
+        raise ValueError("Rollup header is truncated")
+
+    magic, version, header_size, record_size = ROLLUP_HEADER.unpack(
+        data[:ROLLUP_HEADER.size]
+    )
+
+    if magic != ROLLUP_MAGIC:
+        raise ValueError("Not a connquality rollup file")
+
+    if version != ROLLUP_VERSION:
+        raise ValueError("Unsupported rollup version {0}".format(version))
+
+    return header_size, record_size
+
+
+class Rollup(object):
+    """
+    Count, latency sum, min and max and the DEGRADED and ERROR counts of the
+    summaries in a bucket
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.degraded = 0
+        self.errors = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, latency, status):
+        """
+        Add a round summary
+
+        :param latency: Average latency of the round
+        :param status: One of Monitor.STATUS_*
+        """
+
+        self.count += 1
+        self.sum += latency
+
+        if status == STATUS_DEGRADED:
+            self.degraded += 1
+        elif status == STATUS_ERROR:
+            self.errors += 1
+
+        if self.min is None or latency < self.min:
+            self.min = latency
+        if self.max is None or latency > self.max:
+            self.max = latency
+
+    def pack(self, start):
+        """
+        :param start: Unix timestamp of the start of the bucket
+        :return: Bytes of the record
+        """
+
+        return ROLLUP_RECORD.pack(start, self.count, self.degraded,
+                                  self.errors, self.sum, self.min, self.max)
+
+
+class RollupWriter(object):
+    """
+    Keeps the rollups of the current minute, hour and day and appends them to
+    the rollup files as the minutes, hours and days end
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: Path to the log, the rollup files are kept next to
+                         it
+        """
+
+        self.filename = filename
+
+        # Start of the current bucket and its rollup
+        self.starts = dict((name, None) for name, _ in RESOLUTIONS)
+        self.rollups = dict((name, None) for name, _ in RESOLUTIONS)
+
+    def add(self, timestamp, latency, status):
+        """
+        Add a round summary
+
+        :param timestamp: Unix timestamp of the summary
+        :param latency: Average latency of the round
+        :param status: One of Monitor.STATUS_*
+        """
+
+        for resolution, seconds in RESOLUTIONS:
+            start = math.floor(timestamp / seconds) * seconds
+            if start != self.starts[resolution] or \
+                    self.rollups[resolution] is None:
+                self._flush(resolution)
+                self.starts[resolution] = start
+                self.rollups[resolution] = Rollup()
+
+            self.rollups[resolution].add(latency, status)
+
+    def _flush(self, resolution):
+        """
+        Append the rollup of the current bucket to the rollup file
+        """
+
+        rollup = self.rollups[resolution]
+        if rollup is None:
+            return
+
+        data = rollup.pack(self.starts[resolution])
+
+        filename = get_rollup_filename(self.filename, resolution)
+        with open(filename, 'ab') as f:
+            if f.tell() == 0:
+                data = ROLLUP_HEADER.pack(ROLLUP_MAGIC, ROLLUP_VERSION,
+                                          ROLLUP_HEADER.size,
+                                          ROLLUP_RECORD.size) + data
+
+            f.write(data)
+
+        self.rollups[resolution] = None
+
+    def close(self):
+        """
+        Write the rollups of the buckets still going on, the readers merge
+        them with the rest of the bucket
+        """
+
+        for resolution, _ in RESOLUTIONS:
+            self._flush(resolution)
@@ -0,0 +1,315 @@
+"""
+Rotating logs by size or calendar period, rotated segments are named after
+the time they were rotated at and compressed in the background
+"""
+
+import os
+import re
+import time
+import gzip
+import shutil
+import calendar
+import threading
+
+from connquality.logformat import COMPRESSED_SUFFIX, get_writer
+from connquality.index import get_index_filename
+
+PERIOD_HOURLY = "hourly"
+PERIOD_DAILY = "daily"
+PERIOD_WEEKLY = "weekly"
+PERIOD_MONTHLY = "monthly"
+
+# Logs are rotated when the local time formatted with these changes
+PERIODS = {
+    PERIOD_HOURLY: "%Y%m%d%H",
+    PERIOD_DAILY: "%Y%m%d",
+    PERIOD_WEEKLY: "%Y%W",
+    PERIOD_MONTHLY: "%Y%m"
+}
+
+# Rotation time of a segment in UTC, e.g. connection.log.20150110T195536Z
+SEGMENT_TIME_FORMAT = "%Y%m%dT%H%M%SZ"
+
+SIZE_UNITS = {
+    "K": 1024,
+    "M": 1024 * 1024,
+    "G": 1024 * 1024 * 1024
+}
+
+
+def parse_size(size):
+    """
+    Parse a size like "500000", "100K", "10M" or "1G" into bytes
+
+    :param size: Number of bytes, optionally with a unit suffix
+    :return: Number of bytes
+    """
+
+    size = size.strip().upper()
+    multiplier = 1
+
+    if size and size[-1] in SIZE_UNITS:
+        multiplier = SIZE_UNITS[size[-1]]
+        size = size[:-1]
+
+    try:
+        size = int(float(size) * multiplier)
+    except ValueError:
+        raise ValueError("Size {0} doesn't look valid (expected e.g. "
+                         "500000, 100K or 10M)".format(size))
+
+    if size <= 0:
+        raise ValueError("Size must be positive, got {0}".format(size))
+
+    return size
+
+
+def _get_segment_pattern(filename):
+    return re.compile(
+        re.escape(os.path.basename(filename)) +
+        r"\.(\d{8}T\d{6}Z)(?:-(\d+))?(" + re.escape(COMPRESSED_SUFFIX) +
+        r")?$"
+    )
+
+
+def get_segment_filename(filename, timestamp):
+    """
+    Get a name for a segment of the log rotated at the given time
+
+    :param filename: Path to the log
+    :param timestamp: Unix timestamp of the rotation
+    :return: Path to the segment
+    """
+
+    base = "{0}.{1}".format(
+        filename, time.strftime(SEGMENT_TIME_FORMAT, time.gmtime(timestamp))
+    )
+
+    segment = base
+    number = 1
+    while os.path.exists(segment) or \
+            os.path.exists(segment + COMPRESSED_SUFFIX):
+        number += 1
+        segment = "{0}-{1}".format(base, number)
+
+    return segment
+
+
+def find_segments(filename, start=None, end=None):
+    """
+    Find the rotated segments of a log and the log itself, oldest first.
+    Every segment holds the entries from the previous rotation until its own
+    rotation time, so only the segments overlapping the time range need to
+    be opened.
+
+    :param filename: Path to the log
+    :param start: Optional unix timestamp to start from
+    :param end: Optional unix timestamp to end at
+    :return: List of paths, just the log when it hasn't been rotated
+    """
+
+    directory = os.path.dirname(filename)
+    pattern = _get_segment_pattern(filename)
+
+    segments = {}
+    for name in os.listdir(directory or "."):
+        match = pattern.match(name)
+        if not match:
+            continue
+
+        rotated = calendar.timegm(
+            time.strptime(match.group(1), SEGMENT_TIME_FORMAT)
+        )
+        key = (rotated, int(match.group(2) or 1))
+
+        # Both exist while the compressed one replaces the other
+        if key in segments and match.group(3):
+            continue
+
+        segments[key] = os.path.join(directory, name)
+
+    if not segments:
+        return [filename]
+
+    found = []
+    previous = None
+    for rotated, number in sorted(segments):
+        # The name is truncated to seconds
+        overlaps = start is None or rotated + 1 > start
+        if end is not None and previous is not None and previous > end:
+            overlaps = False
+
+        if overlaps:
+            found.append(segments[(rotated, number)])
+
+        previous = rotated
+
+    if os.path.exists(filename) and (end is None or previous <= end):
+        found.append(filename)
+
+    return found
+
+
+def compress_segment(segment):
+    """
+    Gzip a rotated segment, the uncompressed segment is only removed once the
+    compressed one is complete
+
+    :param segment: Path to the segment
+    :return: Path to the compressed segment
+    """
+
+    compressed = segment + COMPRESSED_SUFFIX
+    temp_filename = compressed + ".tmp"
+
+    with open(segment, 'rb') as source:
+        with gzip.open(temp_filename, 'wb') as target:
+            shutil.copyfileobj(source, target)
+
+    os.rename(temp_filename, compressed)
+    os.unlink(segment)
+
+    # Compressed segments are read from the start, there's nothing to seek
+    index_filename = get_index_filename(segment)
+    if os.path.exists(index_filename):
+        os.unlink(index_filename)
+
+    return compressed
+
+
+class RotatingWriter(object):
+    """
+    Writes through the LogWriter of the format, moving the log aside and
+    starting a new one when it gets too big or a new calendar period starts.
+    Rotation happens between writes, so no entry is lost.
+    """
+
+    def __init__(self, log_format, filename, max_size=None, period=None,
+                 compress=True, logger=None):
+        """
+        :param log_format: One of logformat.FORMATS
+        :param filename: Path to the log
+        :param max_size: Optional size in bytes to rotate at
+        :param period: Optional one of PERIODS to rotate at
+        :param compress: Compress rotated segments in the background
+        """
+
+        self.log_format = log_format
+        self.filename = filename
+        self.max_size = max_size
+        self.period = period
+        self.compress = compress
+        self.logger = logger
+
+        self.writer = None
+        self.empty_size = 0
+        self.period_key = None
+        self.threads = []
+
+        if os.path.exists(filename) and os.path.getsize(filename):
+            self.period_key = self._get_period_key(
+                os.path.getmtime(filename)
+            )
+            self.writer = get_writer(log_format, filename)
+        else:
+            self._open()
+
+        if compress:
+            # Segments left uncompressed by an earlier run
+            for segment in find_segments(filename)[:-1]:
+                if not segment.endswith(COMPRESSED_SUFFIX):
+                    self._start_compressing(segment)
+
+    def _open(self):
+        self.writer = get_writer(self.log_format, self.filename)
+        self.empty_size = self.writer.file.tell()
+        self.period_key = None
+
+    def _get_period_key(self, timestamp):
+        if not self.period:
+            return None
+
+        return time.strftime(PERIODS[self.period], time.localtime(timestamp))
+
+    def _should_rotate(self, timestamp):
+        if self.writer.file.tell() <= self.empty_size:
+            self.period_key = self._get_period_key(timestamp)
+            return False
+
+        if self.max_size and self.writer.file.tell() >= self.max_size:
+            return True
+
+        return self._get_period_key(timestamp) != self.period_key
+
+    def _rotate(self, timestamp):
+        """
+        Move the log aside as a segment and start a new one
+        """
+
+        self.writer.close()
+
+        segment = get_segment_filename(self.filename, timestamp)
+        index_filename = get_index_filename(self.filename)
+
+        try:
+            os.rename(self.filename, segment)
+            if os.path.exists(index_filename):
+                os.rename(index_filename, get_index_filename(segment))
+        except OSError as err:
+            # Better a log that's too big than lost entries
+            if self.logger:
+                self.logger.warn("Could not rotate {0}: {1}".format(
+                    self.filename, err
+                ))
+            self.writer = get_writer(self.log_format, self.filename)
+            return
+
+        self._open()
+        self.period_key = self._get_period_key(timestamp)
+
+        if self.logger:
+            self.logger.info("Rotated {0} to {1}".format(
+                self.filename, segment
+            ))
+
+        if self.compress:
+            self._start_compressing(segment)
+
+    def _compress(self, segment):
+        try:
+            compress_segment(segment)
+        except (IOError, OSError) as err:
+            if self.logger:
+                self.logger.error("Could not compress {0}: {1}".format(
+                    segment, err
+                ))
+
+    def _start_compressing(self, segment):
+        self.threads = [
+            thread for thread in self.threads if thread.is_alive()
+        ]
+
+        thread = threading.Thread(target=self._compress, args=(segment,))
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def _check(self, timestamp):
+        if self._should_rotate(timestamp):
+            self._rotate(timestamp)
+
+    def write_results(self, timestamp, results, extra=None,
+                      target_extra=None):
+        self._check(timestamp)
+        self.writer.write_results(timestamp, results, extra, target_extra)
+
+    def write_summary(self, timestamp, latency, status, extra=None):
+        self._check(timestamp)
+        self.writer.write_summary(timestamp, latency, status, extra)
+
+    def close(self):
+        self.writer.close()
+
+        # Let the segments finish compressing
+        for thread in self.threads:
+            thread.join()
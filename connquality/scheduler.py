@@ -0,0 +1,175 @@
+"""
+Check scheduling
+"""
+
+import time
+import heapq
+
+
+def get_monotonic_clock():
+    """
+    Get a clock function that is not affected by system time changes
+
+    :return: Function returning seconds as a float
+    """
+
+    return getattr(time, "monotonic", time.time)
+
+
+def parse_schedule(destination, interval):
+    """
+    Split an optional schedule from a destination, e.g. "google.com:80@10+5"
+    checks google.com:80 every 10 seconds, starting 5 seconds in
+
+    :param destination: Destination with optional @interval[+offset] suffix
+    :param interval: Default interval if none is given
+    :return: destination, interval, offset (None if not given)
+    """
+
+    if "@" not in destination:
+        return destination, interval, None
+
+    destination, schedule = destination.rsplit("@", 1)
+
+    offset = None
+    if "+" in schedule:
+        schedule, offset = schedule.split("+", 1)
+
+    try:
+        interval = float(schedule)
+        if offset is not None:
+            offset = float(offset)
+    except ValueError:
+        raise ValueError("Schedule {0} doesn't look valid (expected "
+                         "@interval or @interval+offset)".format(schedule))
+
+    if interval <= 0:
+        raise ValueError("Schedule interval must be positive, got "
+                         "{0}".format(interval))
+
+    return destination, interval, offset
+
+
+class Scheduler(object):
+    """
+    Keeps every scheduled item on its own absolute deadline, so the schedule
+    never drifts no matter how long the checks take
+    """
+
+    def __init__(self, spread=True, late_threshold=1.0, logger=None,
+                 clock=None, sleep=None):
+        """
+        :param spread: Spread items without an explicit offset evenly across
+                       their interval instead of starting them all at once
+        :param late_threshold: Warn when running more than this many seconds
+                               behind schedule
+        """
+
+        self.spread = spread
+        self.late_threshold = late_threshold
+        self.logger = logger
+        self.clock = clock or get_monotonic_clock()
+        self.sleep = sleep or time.sleep
+
+        self.items = []
+        self.queue = []
+        self.counter = 0
+
+    def add(self, item, interval, offset=None):
+        """
+        Add an item to be scheduled
+
+        :param item: Anything, returned from wait() when it's due
+        :param interval: Seconds between runs
+        :param offset: Seconds from start to first run, None to pick one
+        """
+
+        self.items.append((item, interval, offset))
+
+    def _get_offsets(self):
+        """
+        Figure out the start offsets, spreading items sharing an interval
+
+        :return: List of offsets in the same order as self.items
+        """
+
+        groups = {}
+        for item, interval, offset in self.items:
+            if offset is None:
+                groups[interval] = groups.get(interval, 0) + 1
+
+        positions = {}
+        offsets = []
+        for item, interval, offset in self.items:
+            if offset is None:
+                if self.spread:
+                    position = positions.get(interval, 0)
+                    positions[interval] = position + 1
+                    offset = interval * position / groups[interval]
+                else:
+                    offset = 0.0
+            offsets.append(offset)
+
+        return offsets
+
+    def start(self, now=None):
+        """
+        Set the initial deadlines relative to now
+        """
+
+        if now is None:
+            now = self.clock()
+
+        self.queue = []
+        offsets = self._get_offsets()
+        for (item, interval, _), offset in zip(self.items, offsets):
+            self._push(now + offset, interval, item)
+
+    def _push(self, deadline, interval, item):
+        # Counter keeps ordering stable and avoids comparing items
+        self.counter += 1
+        heapq.heappush(self.queue, (deadline, self.counter, interval, item))
+
+    def wait(self):
+        """
+        Sleep until the next deadline and return everything that is due
+
+        :return: List of due items, seconds we are behind schedule
+        """
+
+        if not self.queue:
+            self.start()
+
+        deadline = self.queue[0][0]
+        remaining = deadline - self.clock()
+
+        if remaining > 0:
+            if self.logger:
+                self.logger.debug("Waiting for {0}s before next check".format(
+                    round(remaining, 3)
+                ))
+            self.sleep(remaining)
+
+        now = self.clock()
+        lateness = max(now - deadline, 0.0)
+
+        due = []
+        while self.queue and self.queue[0][0] <= now:
+            deadline, _, interval, item = heapq.heappop(self.queue)
+            due.append(item)
+
+            next_deadline = deadline + interval
+            if next_deadline <= now:
+                skipped = int((now - deadline) // interval)
+                next_deadline = deadline + (skipped + 1) * interval
+
+                if self.logger:
+                    self.logger.warn("Skipped {0} run(s) of {1}, running "
+                                     "behind schedule".format(skipped, item))
+
+            self._push(next_deadline, interval, item)
+
+        if lateness > self.late_threshold and self.logger:
+            self.logger.warn("Running {0}s late".format(round(lateness, 3)))
+
+        return due, lateness
@@ -0,0 +1,411 @@
+"""
+Mergeable latency quantile sketches of every target, kept by the monitor for
+every minute, hour and day. Percentiles over any time range are found by
+merging a few sketches instead of reading the log.
+"""
+
+import os
+import json
+import math
+
+from connquality.buckets import get_bucket, get_bucket_latency, find_rank
+
+SKETCH_SUFFIX = ".sketches."
+
+MINUTE = "minute"
+HOUR = "hour"
+DAY = "day"
+
+# Resolutions from the finest to the coarsest with their length in seconds,
+# days are UTC days
+RESOLUTIONS = [(MINUTE, 60), (HOUR, 3600), (DAY, 86400)]
+
+# Target of the sketches of all the checks together
+ALL_TARGETS = ""
+
+
+def get_sketch_filename(filename, resolution):
+    """
+    Get the sketch file of a log
+
+    :param filename: Path to the log
+    :param resolution: One of MINUTE, HOUR or DAY
+    :return: Path to the sketch file
+    """
+
+    return filename + SKETCH_SUFFIX + resolution
+
+
+class QuantileSketch(object):
+    """
+    Counts of latencies in the logarithmic buckets of connquality.buckets,
+    only the buckets with latencies in them are kept. Quantiles are within 1%
+    of the real ones and two sketches merge by adding up their counts.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.failures = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, latency):
+        """
+        Add the latency of a check
+
+        :param latency: Latency in seconds or None if the check failed
+        """
+
+        if latency is None:
+            self.failures += 1
+            return
+
+        bucket = get_bucket(latency)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.sum += latency
+
+        if self.min is None or latency < self.min:
+            self.min = latency
+        if self.max is None or latency > self.max:
+            self.max = latency
+
+    def merge(self, other):
+        """
+        Add the latencies of another sketch to this one
+
+        :param other: QuantileSketch
+        """
+
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+        self.count += other.count
+        self.failures += other.failures
+        self.sum += other.sum
+
+        if other.min is not None and (self.min is None or
+                                      other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or
+                                      other.max > self.max):
+            self.max = other.max
+
+    def get_quantiles(self, percentiles):
+        """
+        Get approximate latency percentiles
+
+        :param percentiles: List of percentiles from 0 to 100
+        :return: List of latencies in seconds, None if there are no latencies
+        """
+
+        if not self.count:
+            return [None] * len(percentiles)
+
+        buckets = sorted(self.buckets)
+        counts = [self.buckets[bucket] for bucket in buckets]
+
+        quantiles = []
+        for percentile in percentiles:
+            if percentile <= 0:
+                quantiles.append(self.min)
+                continue
+            if percentile >= 100:
+                quantiles.append(self.max)
+                continue
+
+            bucket = find_rank(buckets, counts,
+                               percentile / 100.0 * self.count)
+
+            # The buckets are wider than the measured range at the edges
+            latency = get_bucket_latency(bucket)
+            quantiles.append(min(max(latency, self.min), self.max))
+
+        return quantiles
+
+    def to_dict(self):
+        """
+        :return: Dict of the sketch for JSON
+        """
+
+        return {
+            "buckets": dict(
+                (str(bucket), count) for bucket, count in self.buckets.items()
+            ),
+            "count": self.count,
+            "failures": self.failures,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Create a sketch from QuantileSketch.to_dict
+
+        :param data: Dict of the sketch
+        :return: QuantileSketch
+        """
+
+        sketch = cls()
+        sketch.buckets = dict(
+            (int(bucket), count) for bucket, count in data["buckets"].items()
+        )
+        sketch.count = data["count"]
+        sketch.failures = data["failures"]
+        sketch.sum = data["sum"]
+        sketch.min = data["min"]
+        sketch.max = data["max"]
+
+        return sketch
+
+
+class SketchWriter(object):
+    """
+    Keeps the sketches of the current minute, hour and day of every target,
+    and of all the targets together, and appends them to the sketch files as
+    the minutes, hours and days end. Every line is the start of the bucket,
+    a tab and the target and sketch as JSON.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: Path to the log, the sketch files are kept next to
+                         it
+        """
+
+        self.filename = filename
+
+        # Start of the current bucket and the sketches of the targets in it
+        self.starts = dict((resolution, None) for resolution, _ in RESOLUTIONS)
+        self.sketches = dict((resolution, {}) for resolution, _ in RESOLUTIONS)
+
+    def add(self, timestamp, results):
+        """
+        Add the results of a batch of checks
+
+        :param timestamp: Unix timestamp of the checks
+        :param results: List of (destination, latency or None, error or
+                        None) tuples
+        """
+
+        for resolution, seconds in RESOLUTIONS:
+            start = math.floor(timestamp / seconds) * seconds
+            if start != self.starts[resolution]:
+                self._flush(resolution)
+                self.starts[resolution] = start
+
+            sketches = self.sketches[resolution]
+            for destination, latency, error in results:
+                for target in (destination, ALL_TARGETS):
+                    if target not in sketches:
+                        sketches[target] = QuantileSketch()
+
+                    sketches[target].add(latency)
+
+    def _flush(self, resolution):
+        """
+        Append the sketches of the current bucket to the sketch file
+        """
+
+        sketches = self.sketches[resolution]
+        if not sketches:
+            return
+
+        start = self.starts[resolution]
+        lines = []
+        for target in sorted(sketches):
+            data = sketches[target].to_dict()
+            data["target"] = target
+            lines.append("{0}\t{1}\n".format(
+                repr(float(start)), json.dumps(data, sort_keys=True)
+            ))
+
+        # Written in one go, the readers skip an incomplete last line
+        filename = get_sketch_filename(self.filename, resolution)
+        with open(filename, 'ab') as f:
+            f.write("".join(lines).encode())
+
+        self.sketches[resolution] = {}
+
+    def close(self):
+        """
+        Write the sketches of the buckets still going on, merged with the
+        rest of the bucket when read
+        """
+
+        for resolution, _ in RESOLUTIONS:
+            self._flush(resolution)
+
+
+def _seek(f, size, timestamp):
+    """
+    Move to the first line of a sketch file with a bucket starting at or
+    after timestamp, the lines are in time order
+
+    :param f: Sketch file open in binary mode
+    :param size: Size of the file
+    :param timestamp: Unix timestamp
+    """
+
+    def find_line(offset):
+        # Start of the first line starting at or after offset
+        if offset == 0:
+            f.seek(0)
+        else:
+            f.seek(offset - 1)
+            f.readline()
+
+        return f.tell()
+
+    low = 0
+    high = size
+    while low < high:
+        middle = (low + high) // 2
+        find_line(middle)
+        line = f.readline()
+
+        if not line.endswith(b"\n") or \
+                float(line.split(b"\t", 1)[0]) >= timestamp:
+            high = middle
+        else:
+            low = middle + 1
+
+    find_line(low)
+
+
+def read_sketches(filename, resolution, start=None, end=None):
+    """
+    Read the sketches of a log at a resolution
+
+    :param filename: Path to the log
+    :param resolution: One of MINUTE, HOUR or DAY
+    :param start: Optional unix timestamp, only buckets starting at or after
+                  it are read
+    :param end: Optional unix timestamp, only buckets starting before it are
+                read
+    :return: Generator of bucket start, target, QuantileSketch in time order
+    """
+
+    path = get_sketch_filename(filename, resolution)
+    if not os.path.exists(path):
+        return
+
+    with open(path, 'rb') as f:
+        if start is not None:
+            _seek(f, os.fstat(f.fileno()).st_size, start)
+
+        for line in f:
+            # Being written right now
+            if not line.endswith(b"\n"):
+                break
+
+            bucket_start, data = line.split(b"\t", 1)
+            bucket_start = float(bucket_start)
+            if end is not None and bucket_start >= end:
+                break
+
+            data = json.loads(data.decode())
+            yield bucket_start, data["target"], QuantileSketch.from_dict(data)
+
+
+def _merge_range(filename, resolutions, start, end, merged):
+    """
+    Merge the sketches covering a time range into merged, whole buckets of
+    the coarsest resolution first and finer ones for the rest of the range
+    """
+
+    resolution, seconds = resolutions[-1]
+    finer = resolutions[:-1]
+
+    if finer:
+        # Only buckets entirely within the range
+        first = None if start is None else math.ceil(start / seconds) * \
+            seconds
+        last = None if end is None else math.floor(end / seconds) * seconds
+    else:
+        # Buckets overlapping the range
+        first = None if start is None else math.floor(start / seconds) * \
+            seconds
+        last = end
+
+    covered_start = None
+    covered_end = None
+
+    if first is None or last is None or first < last:
+        for bucket_start, target, sketch in read_sketches(
+                filename, resolution, first, last):
+            if target not in merged:
+                merged[target] = QuantileSketch()
+            merged[target].merge(sketch)
+
+            if covered_start is None:
+                covered_start = bucket_start
+            covered_end = bucket_start + seconds
+
+    if not finer:
+        return
+
+    if covered_start is None:
+        _merge_range(filename, finer, start, end, merged)
+    else:
+        # Before the first and after the last bucket found, e.g. the day
+        # going on right now
+        _merge_range(filename, finer, start, covered_start, merged)
+        _merge_range(filename, finer, covered_end, end, merged)
+
+
+def query_sketches(filename, start=None, end=None):
+    """
+    Merge the sketches of a time range, to the minute
+
+    :param filename: Path to the log
+    :param start: Optional unix timestamp to start from
+    :param end: Optional unix timestamp to end at
+    :return: Dict of targets to QuantileSketch, ALL_TARGETS for all the
+             checks together
+    """
+
+    merged = {}
+    _merge_range(filename, RESOLUTIONS, start, end, merged)
+    return merged
+
+
+def get_bands(filename, start, end, bins, percentiles, target=ALL_TARGETS):
+    """
+    Get percentiles over time from the sketches of the coarsest resolution
+    that still fits bins times in the time range
+
+    :param filename: Path to the log
+    :param start: Unix timestamp to start from
+    :param end: Unix timestamp to end at
+    :param bins: Number of times to get the percentiles at
+    :param percentiles: List of percentiles from 0 to 100
+    :param target: Target, defaults to all the checks together
+    :return: List of the middle times of the bins, list of lists of the
+             percentiles of every bin, None for bins without latencies
+    """
+
+    width = max(end - start, 1.0) / bins
+
+    resolution, seconds = RESOLUTIONS[0]
+    for name, length in RESOLUTIONS:
+        if length <= width:
+            resolution, seconds = name, length
+
+    sketches = [QuantileSketch() for _ in range(bins)]
+
+    for bucket_start, sketch_target, sketch in read_sketches(
+            filename, resolution, math.floor(start / seconds) * seconds,
+            end):
+        if sketch_target != target:
+            continue
+
+        index = int((bucket_start - start) / width)
+        sketches[min(max(index, 0), bins - 1)].merge(sketch)
+
+    times = [start + width * (index + 0.5) for index in range(bins)]
+    return times, [sketch.get_quantiles(percentiles) for sketch in sketches]
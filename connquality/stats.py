@@ -0,0 +1,499 @@
+"""
+Connection quality statistics without any plotting, computed in a single
+streaming pass over the log
+"""
+
+import sys
+import json
+import argparse
+import numpy
+
+from connquality.logformat import format_timestamp, STATUS_OK, \
+    STATUS_DEGRADED, STATUS_ERROR
+from connquality.parser import STATUSES, iter_columns, local_to_epoch, \
+    select
+from connquality.rotation import find_segments
+from connquality.buckets import LATENCY_MIN, LATENCY_GAMMA, LATENCY_BUCKETS, \
+    get_bucket_latency
+from connquality.sketch import query_sketches
+
+OUTPUT_TEXT = "text"
+OUTPUT_JSON = "json"
+
+PERCENTILES = [50, 95, 99]
+
+# Longer gaps between entries are counted as time not monitored
+DEFAULT_MAX_GAP = 300.0
+
+OK = STATUSES[STATUS_OK]
+DEGRADED = STATUSES[STATUS_DEGRADED]
+ERROR = STATUSES[STATUS_ERROR]
+
+
+def get_latency_buckets(latencies):
+    """
+    Find the histogram buckets of latencies, buckets.get_bucket for arrays
+
+    :param latencies: numpy array of latencies in seconds
+    :return: numpy array of bucket indexes
+    """
+
+    buckets = numpy.log(numpy.maximum(latencies, LATENCY_MIN) / LATENCY_MIN)
+    buckets = numpy.floor(buckets / numpy.log(LATENCY_GAMMA))
+
+    return numpy.minimum(buckets, LATENCY_BUCKETS - 1).astype(numpy.int64)
+
+
+class SeriesStats(object):
+    """
+    Statistics of a single series of entries, either the aggregate entries or
+    the entries of one target. Entries are added chunk by chunk, memory use
+    doesn't depend on the number of entries.
+    """
+
+    def __init__(self, max_gap=DEFAULT_MAX_GAP):
+        """
+        :param max_gap: Longest time in seconds between entries that still
+                        counts as monitored
+        """
+
+        self.max_gap = max_gap
+
+        self.entries = 0
+        self.first = None
+        self.last = None
+        self.last_status = None
+
+        self.ok_time = 0.0
+        self.degraded_time = 0.0
+        self.error_time = 0.0
+        self.unmonitored_time = 0.0
+
+        self.histogram = numpy.zeros(LATENCY_BUCKETS, dtype=numpy.int64)
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        self.latency_min = None
+        self.latency_max = None
+
+        self.outage_start = None
+        self.longest_outage = 0.0
+        self.longest_outage_start = None
+
+    def add(self, timestamps, latencies, statuses):
+        """
+        Add the next entries of the series
+
+        :param timestamps: numpy array of unix timestamps
+        :param latencies: numpy array of latencies, NaN for failures
+        :param statuses: numpy array of STATUSES values
+        """
+
+        if not len(timestamps):
+            return
+
+        if self.first is None:
+            self.first = timestamps[0]
+            times = timestamps
+            states = statuses
+
+            if statuses[0] == ERROR:
+                self.outage_start = timestamps[0]
+        else:
+            # Continue from the last entry of the previous chunk
+            times = numpy.concatenate([[self.last], timestamps])
+            states = numpy.concatenate([[self.last_status], statuses])
+
+        self.entries += len(timestamps)
+        self.last = timestamps[-1]
+        self.last_status = statuses[-1]
+
+        # Every status lasts until the next entry
+        gaps = numpy.diff(times)
+        previous = states[:-1]
+        monitored = gaps <= self.max_gap
+
+        self.ok_time += gaps[monitored & (previous == OK)].sum()
+        self.degraded_time += gaps[monitored & (previous == DEGRADED)].sum()
+        self.error_time += gaps[monitored & (previous == ERROR)].sum()
+        self.unmonitored_time += gaps[~monitored].sum()
+
+        self._add_outages(times, states)
+        self._add_latencies(latencies[statuses != ERROR])
+
+    def _add_outages(self, times, states):
+        failing = (states == ERROR).astype(numpy.int8)
+        changes = numpy.nonzero(numpy.diff(failing))[0] + 1
+
+        for index in changes:
+            if failing[index]:
+                self.outage_start = times[index]
+            else:
+                self._end_outage(times[index])
+
+    def _end_outage(self, timestamp):
+        duration = timestamp - self.outage_start
+        if duration > self.longest_outage:
+            self.longest_outage = duration
+            self.longest_outage_start = self.outage_start
+
+        self.outage_start = None
+
+    def _add_latencies(self, latencies):
+        latencies = latencies[numpy.isfinite(latencies)]
+        if not len(latencies):
+            return
+
+        self.histogram += numpy.bincount(get_latency_buckets(latencies),
+                                         minlength=LATENCY_BUCKETS)
+        self.latency_count += len(latencies)
+        self.latency_sum += latencies.sum()
+
+        low = latencies.min()
+        high = latencies.max()
+        if self.latency_min is None or low < self.latency_min:
+            self.latency_min = low
+        if self.latency_max is None or high > self.latency_max:
+            self.latency_max = high
+
+    def get_percentile(self, percentile):
+        """
+        Get an approximate latency percentile of the successful checks
+
+        :param percentile: Percentile from 0 to 100
+        :return: Latency in seconds, None if there are no latencies
+        """
+
+        if not self.latency_count:
+            return None
+
+        rank = percentile / 100.0 * self.latency_count
+        bucket = numpy.searchsorted(numpy.cumsum(self.histogram), rank)
+        bucket = min(bucket, LATENCY_BUCKETS - 1)
+
+        # The buckets are wider than the measured range at the edges
+        latency = get_bucket_latency(bucket)
+        return float(min(max(latency, self.latency_min), self.latency_max))
+
+    def get_results(self):
+        """
+        :return: Dict of the statistics
+        """
+
+        longest_outage = self.longest_outage
+        longest_outage_start = self.longest_outage_start
+
+        # An outage still going on at the end of the log
+        if self.outage_start is not None:
+            duration = self.last - self.outage_start
+            if duration >= longest_outage:
+                longest_outage = duration
+                longest_outage_start = self.outage_start
+
+        monitored = self.ok_time + self.degraded_time + self.error_time
+
+        latency = None
+        if self.latency_count:
+            latency = {
+                "min": float(self.latency_min),
+                "mean": self.latency_sum / self.latency_count,
+                "max": float(self.latency_max)
+            }
+            for percentile in PERCENTILES:
+                latency["p{0}".format(percentile)] = self.get_percentile(
+                    percentile
+                )
+
+        return {
+            "entries": self.entries,
+            "start": _format_time(self.first),
+            "end": _format_time(self.last),
+            "uptime": 100.0 * self.ok_time / monitored if monitored else None,
+            "ok_seconds": float(self.ok_time),
+            "degraded_seconds": float(self.degraded_time),
+            "error_seconds": float(self.error_time),
+            "unmonitored_seconds": float(self.unmonitored_time),
+            "latency": latency,
+            "longest_outage": {
+                "seconds": float(longest_outage),
+                "start": _format_time(longest_outage_start)
+            }
+        }
+
+
+def _format_time(timestamp):
+    if timestamp is None:
+        return None
+
+    return format_timestamp(float(timestamp))
+
+
+def _parse_time(value):
+    """
+    Parse a local time ISO 8601 timestamp or date into a unix timestamp
+    """
+
+    if value is None:
+        return None
+
+    datetimes = numpy.array([numpy.datetime64(value, "us")])
+    return float(local_to_epoch(datetimes)[0])
+
+
+def get_stats(filename, start=None, end=None, max_gap=DEFAULT_MAX_GAP,
+              logger=None):
+    """
+    Compute the statistics of a log in one pass, rotated segments of it
+    included
+
+    :param filename: Path to the log
+    :param start: Optional unix timestamp to start from
+    :param end: Optional unix timestamp to end at
+    :param max_gap: Longest time in seconds between entries that still
+                    counts as monitored
+    :return: List of dicts of statistics, the aggregate entries first with
+             target None, then every target
+    """
+
+    series = {}
+
+    for segment in find_segments(filename, start, end):
+        for columns in iter_columns(segment, start, end, logger=logger):
+            targets = columns["targets"]
+
+            if targets is None:
+                groups = [("", columns)]
+            else:
+                groups = [
+                    (target, select(columns, targets == target))
+                    for target in numpy.unique(targets)
+                ]
+
+            for target, part in groups:
+                if target not in series:
+                    series[target] = SeriesStats(max_gap)
+
+                series[target].add(part["timestamps"], part["latencies"],
+                                   part["statuses"])
+
+    results = []
+    for target in sorted(series):
+        result = series[target].get_results()
+        result["target"] = target or None
+        results.append(result)
+
+    return results
+
+
+def get_sketch_stats(filename, start=None, end=None):
+    """
+    Get the latency statistics from the quantile sketches the monitor keeps
+    with --sketches, without reading the log
+
+    :param filename: Path to the log
+    :param start: Optional unix timestamp to start from
+    :param end: Optional unix timestamp to end at
+    :return: List of dicts of the number of checks, failures and latency
+             statistics, all the checks together first with target None,
+             then every target
+    """
+
+    results = []
+
+    for target, sketch in sorted(query_sketches(filename, start,
+                                                end).items()):
+        latency = None
+        if sketch.count:
+            latency = {
+                "min": sketch.min,
+                "mean": sketch.sum / sketch.count,
+                "max": sketch.max
+            }
+            for percentile, value in zip(
+                    PERCENTILES, sketch.get_quantiles(PERCENTILES)):
+                latency["p{0}".format(percentile)] = value
+
+        results.append({
+            "target": target or None,
+            "checks": sketch.count + sketch.failures,
+            "failures": sketch.failures,
+            "latency": latency
+        })
+
+    return results
+
+
+def _format_duration(seconds):
+    seconds = int(round(seconds))
+    parts = []
+
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= size:
+            parts.append("{0}{1}".format(seconds // size, unit))
+            seconds %= size
+
+    parts.append("{0}s".format(seconds))
+    return " ".join(parts)
+
+
+def _format_latency(latency):
+    return "{0:.1f} ms".format(latency * 1000)
+
+
+def _format_latencies(latency):
+    """
+    Format the latency statistics of a series, one line per statistic
+    """
+
+    return [
+        "  Latency {0:<8} {1}".format(name + ":",
+                                      _format_latency(latency[name]))
+        for name in ["min", "mean"] + [
+            "p{0}".format(percentile) for percentile in PERCENTILES
+        ] + ["max"]
+    ]
+
+
+def format_text(filename, results):
+    """
+    Format statistics for humans
+
+    :param filename: Path to the log
+    :param results: List of dicts from get_stats
+    :return: String
+    """
+
+    lines = [filename]
+
+    if not results:
+        lines.append("  No entries")
+
+    for result in results:
+        lines.append("")
+
+        if result["target"] is None:
+            lines.append("All checks")
+        else:
+            lines.append("Target {0}".format(result["target"]))
+
+        lines.append("  Entries:         {0} ({1} - {2})".format(
+            result["entries"], result["start"], result["end"]
+        ))
+
+        if result["uptime"] is not None:
+            lines.append("  Uptime:          {0:.3f} %".format(
+                result["uptime"]
+            ))
+
+        lines.append("  Degraded:        {0}".format(
+            _format_duration(result["degraded_seconds"])
+        ))
+        lines.append("  Error:           {0}".format(
+            _format_duration(result["error_seconds"])
+        ))
+        lines.append("  Not monitored:   {0}".format(
+            _format_duration(result["unmonitored_seconds"])
+        ))
+
+        if result["latency"]:
+            lines.extend(_format_latencies(result["latency"]))
+
+        outage = result["longest_outage"]
+        if outage["start"]:
+            lines.append("  Longest outage:  {0} from {1}".format(
+                _format_duration(outage["seconds"]), outage["start"]
+            ))
+        else:
+            lines.append("  Longest outage:  none")
+
+    return "\n".join(lines)
+
+
+def format_sketch_text(filename, results):
+    """
+    Format statistics from the sketches for humans
+
+    :param filename: Path to the log
+    :param results: List of dicts from get_sketch_stats
+    :return: String
+    """
+
+    lines = [filename + " (sketches)"]
+
+    if not results:
+        lines.append("  No sketches")
+
+    for result in results:
+        lines.append("")
+
+        if result["target"] is None:
+            lines.append("All checks")
+        else:
+            lines.append("Target {0}".format(result["target"]))
+
+        lines.append("  Checks:          {0} ({1} failed)".format(
+            result["checks"], result["failures"]
+        ))
+
+        if result["latency"]:
+            lines.extend(_format_latencies(result["latency"]))
+
+    return "\n".join(lines)
+
+
+def parse_options(args):
+    """
+    Parse commandline arguments into options for the statistics
+
+    :param args:
+    :return:
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logfile", default="connection.log",
+                        help="Where is the connection quality data stored")
+    parser.add_argument("--start", default=None,
+                        help="Only include entries starting from this "
+                             "datetime")
+    parser.add_argument("--end", default=None,
+                        help="Only include entries until this datetime")
+    parser.add_argument("--output", default=OUTPUT_TEXT,
+                        choices=[OUTPUT_TEXT, OUTPUT_JSON],
+                        help="Print the statistics as text or JSON")
+    parser.add_argument("--max-gap", default=DEFAULT_MAX_GAP, type=float,
+                        help="Count longer gaps in seconds between entries "
+                             "as time not monitored")
+    parser.add_argument("--sketches", default=False, action="store_true",
+                        help="Only get the latency statistics, from the "
+                             "quantile sketches kept by monitor.py "
+                             "--sketches instead of the log")
+
+    return parser.parse_args(args)
+
+
+def start_stats():
+    """
+    Start the statistics application
+    """
+
+    options = parse_options(sys.argv[1:])
+
+    try:
+        start = _parse_time(options.start)
+        end = _parse_time(options.end)
+    except ValueError as err:
+        sys.exit("Invalid --start or --end: {0}".format(err))
+
+    if options.sketches:
+        results = get_sketch_stats(options.logfile, start, end)
+        format_results = format_sketch_text
+    else:
+        results = get_stats(options.logfile, start, end, options.max_gap)
+        format_results = format_text
+
+    if options.output == OUTPUT_JSON:
+        print(json.dumps({
+            "logfile": options.logfile,
+            "series": results
+        }, indent=2, sort_keys=True))
+    else:
+        print(format_results(options.logfile, results))
@@ -0,0 +1,47 @@
+"""
+Fixtures shared by the tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest2
+
+START = 1420919736.959123
+
+
+class TempDirTestCase(unittest2.TestCase):
+    """
+    Test case with a temporary directory for the logs and their sidecars,
+    removed after every test
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "connection.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+def write_log(writer, count, first=0, latency=0.1, status="OK"):
+    """
+    Write round summaries 30 seconds apart from START and close the log
+
+    :param writer: Any of the log writers
+    :param count: Number of summaries
+    :param first: Number of the first summary
+    :param latency: Latency of every summary, or a function of the number of
+                    the summary returning it
+    :param status: Status of every summary, or a function of the number of
+                   the summary returning it
+    """
+
+    for number in range(first, first + count):
+        writer.write_summary(
+            START + number * 30,
+            latency(number) if callable(latency) else latency,
+            status(number) if callable(status) else status
+        )
+
+    writer.close()
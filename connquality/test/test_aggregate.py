@@ -0,0 +1,138 @@
+"""
+Tests for connquality.aggregate module
+"""
+
+import os
+import numpy
+import shutil
+import tempfile
+import unittest2
+from connquality.aggregate import BucketAggregator
+from connquality.graph import Reader
+from connquality.logformat import AggregateWriter, format_timestamp
+
+START = 1420919736.959123
+
+
+class TestBucketAggregator(unittest2.TestCase):
+    """
+    Tests for BucketAggregator
+    """
+
+    def test_add_rollups(self):
+        """
+        Test folding rollups into buckets by their middle, the ones sticking
+        out of the range into the last bucket
+        """
+
+        aggregator = BucketAggregator(0.0, 100.0, 2)
+        aggregator.add_rollups({
+            "timestamps": numpy.array([10.0, 30.0, 60.0, 130.0]),
+            "counts": numpy.array([2, 3, 1, 4]),
+            "sums": numpy.array([0.2, 0.6, 0.5, 1.0]),
+            "mins": numpy.array([0.05, 0.1, 0.5, 0.1]),
+            "maxes": numpy.array([0.15, 0.3, 0.5, 0.3]),
+            "statuses": numpy.array([0.0, 0.5, 0.0, 1.0])
+        })
+
+        columns = aggregator.get_columns()
+
+        self.assertEqual(list(aggregator.samples), [5, 5])
+        self.assertTrue(numpy.allclose(columns["latencies"], [0.16, 0.3]))
+        self.assertEqual(list(columns["latency_min"]), [0.05, 0.1])
+        self.assertEqual(list(columns["latency_max"]), [0.3, 0.5])
+        self.assertEqual(list(columns["statuses"]), [0.5, 1.0])
+
+    def test_add(self):
+        """
+        Test folding chunks into buckets
+        """
+
+        aggregator = BucketAggregator(0.0, 100.0, 4)
+
+        aggregator.add(numpy.array([0.0, 10.0, 30.0]),
+                       numpy.array([0.1, 0.3, 0.5]),
+                       numpy.array([0.0, 0.0, 0.5]))
+        aggregator.add(numpy.array([60.0, 100.0, 150.0]),
+                       numpy.array([numpy.nan, 0.2, 9.0]),
+                       numpy.array([1.0, 0.0, 1.0]))
+
+        columns = aggregator.get_columns()
+
+        self.assertEqual(list(columns["timestamps"]), [12.5, 37.5, 62.5, 87.5])
+        self.assertTrue(numpy.allclose(columns["latencies"],
+                                       [0.2, 0.5, numpy.nan, 0.2],
+                                       equal_nan=True))
+        self.assertEqual(list(columns["latency_min"][[0, 1, 3]]),
+                         [0.1, 0.5, 0.2])
+        self.assertEqual(list(columns["latency_max"][[0, 1, 3]]),
+                         [0.3, 0.5, 0.2])
+        self.assertEqual(list(columns["statuses"]), [0.0, 0.5, 1.0, 0.0])
+
+    def test_empty_buckets(self):
+        """
+        Test that buckets without any records are left out
+        """
+
+        aggregator = BucketAggregator(0.0, 100.0, 10)
+        aggregator.add(numpy.array([5.0]), numpy.array([0.1]),
+                       numpy.array([0.0]))
+
+        columns = aggregator.get_columns()
+        self.assertEqual(list(columns["timestamps"]), [5.0])
+
+
+class TestStreamingRead(unittest2.TestCase):
+    """
+    Tests for Reader streaming reads
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "connection.log")
+
+        writer = AggregateWriter(self.filename)
+        for number in range(1000):
+            status = "ERROR" if number == 500 else "OK"
+            writer.write_summary(START + number * 30, 0.1 + number, status)
+        writer.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_streaming(self):
+        """
+        Test that streaming reads aggregate the whole log
+        """
+
+        reader = Reader()
+        reader.read(self.filename, data_points=10, streaming=True)
+
+        self.assertEqual(reader.entries, 1000)
+        self.assertEqual(len(reader.latencies), 10)
+        self.assertAlmostEqual(reader.latency_min[0], 0.1)
+        self.assertAlmostEqual(reader.latency_max[-1], 999.1)
+        self.assertEqual(list(reader.statuses).count(1.0), 1)
+        self.assertEqual(len(reader.timestamp_dts), 10)
+
+    def test_streaming_range(self):
+        """
+        Test that streaming reads respect the time range
+        """
+
+        reader = Reader()
+        reader.read(self.filename, format_timestamp(START + 100 * 30),
+                    format_timestamp(START + 199 * 30), data_points=5,
+                    streaming=True)
+
+        self.assertEqual(reader.entries, 100)
+        self.assertAlmostEqual(reader.latency_min[0], 100.1, places=5)
+        self.assertAlmostEqual(reader.latency_max[-1], 199.1, places=5)
+
+    def test_streaming_needs_data_points(self):
+        """
+        Test that streaming reads need to know the number of buckets
+        """
+
+        with self.assertRaises(ValueError):
+            Reader().read(self.filename, streaming=True)
@@ -0,0 +1,155 @@
+"""
+Tests for connquality.batch module
+"""
+
+import os
+import json
+import multiprocessing
+import unittest2
+from mock import Mock, patch
+from connquality.graph import Reader, Graph
+from connquality.logformat import AggregateWriter, BinaryWriter
+from connquality.batch import parse_duration, load_manifest, get_window, \
+    run_batch, _read_log
+from connquality.test.helpers import START, TempDirTestCase, write_log
+
+
+class TestBatch(TempDirTestCase):
+    """
+    Tests for batch rendering
+    """
+
+    def _path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def _write_log(self, writer_class, name):
+        write_log(writer_class(self._path(name)), 3000)
+
+    def test_parse_duration(self):
+        """
+        Test parsing window durations
+        """
+
+        self.assertEqual(parse_duration("90"), 90)
+        self.assertEqual(parse_duration("30m"), 1800)
+        self.assertEqual(parse_duration("24h"), 86400)
+        self.assertEqual(parse_duration("7d"), 604800)
+
+        for duration in ("", "d", "-1h", "1y"):
+            with self.assertRaises(ValueError):
+                parse_duration(duration)
+
+    def test_load_manifest(self):
+        """
+        Test that jobs need a logfile and an outfile
+        """
+
+        filename = self._path("manifest.json")
+        with open(filename, "w") as f:
+            json.dump([{"logfile": "connection.log"}], f)
+
+        with self.assertRaises(ValueError):
+            load_manifest(filename)
+
+    def test_get_window(self):
+        """
+        Test working out the time range of jobs
+        """
+
+        reader = Reader()
+
+        self.assertEqual(get_window({}, reader), (None, None))
+        self.assertEqual(get_window({"window": "1h"}, reader, 10000.0),
+                         (6400.0, 10000.0))
+
+        start, end = get_window({"end": "2015-01-10T21:55:36.959123",
+                                 "window": "60"}, reader)
+        self.assertAlmostEqual(end, START, places=5)
+        self.assertAlmostEqual(start, START - 60, places=5)
+
+    def test_run_batch(self):
+        """
+        Test that every log is read once and a failing job doesn't stop the
+        others
+        """
+
+        self._write_log(AggregateWriter, "text.log")
+        self._write_log(BinaryWriter, "binary.log")
+
+        jobs = [
+            {"logfile": self._path("text.log"),
+             "outfile": self._path("day.png"), "window": "1d",
+             "end": "2015-01-11T21:55:36", "datapoints": 100},
+            {"logfile": self._path("text.log"),
+             "outfile": self._path("all.svg"), "dpi": 50},
+            {"logfile": self._path("binary.log"),
+             "outfile": self._path("binary.png"), "downsample": "envelope",
+             "datapoints": 100},
+            {"logfile": self._path("binary.log"),
+             "outfile": self._path("missing/dir.png")},
+        ]
+
+        logger = Mock()
+        with patch("connquality.batch._read_log",
+                   wraps=_read_log) as read_log:
+            failures = run_batch(jobs, 2, logger)
+
+        self.assertEqual(failures, 1)
+        self.assertEqual(read_log.call_count, 2)
+        self.assertEqual(logger.error.call_count, 1)
+
+        for name in ("day.png", "all.svg", "binary.png"):
+            self.assertTrue(os.path.exists(self._path(name)))
+
+    @unittest2.skipUnless(multiprocessing.get_start_method() == "fork",
+                          "the workers need the patched Graph")
+    def test_worker_killed(self):
+        """
+        Test that a worker dying outright fails its job instead of hanging
+        the batch
+        """
+
+        self._write_log(AggregateWriter, "text.log")
+
+        jobs = [{"logfile": self._path("text.log"),
+                 "outfile": self._path("crash.png")}]
+
+        logger = Mock()
+        with patch("connquality.batch.Graph",
+                   side_effect=lambda options: os._exit(1)):
+            failures = run_batch(jobs, 1, logger)
+
+        self.assertEqual(failures, 1)
+        self.assertEqual(logger.error.call_count, 1)
+
+    @unittest2.skipUnless(multiprocessing.get_start_method() == "fork",
+                          "the workers need the patched Graph")
+    def test_worker_killed_others_render(self):
+        """
+        Test that only the job killing its worker fails, the jobs the pool
+        lost with it are rendered again
+        """
+
+        self._write_log(AggregateWriter, "text.log")
+
+        names = ["first.png", "crash.png", "third.png", "fourth.png"]
+        jobs = [
+            {"logfile": self._path("text.log"), "outfile": self._path(name)}
+            for name in names
+        ]
+
+        def crash(options):
+            if options.outfile.endswith("crash.png"):
+                os._exit(1)
+            return Graph(options)
+
+        logger = Mock()
+        with patch("connquality.batch.Graph", side_effect=crash):
+            failures = run_batch(jobs, 2, logger)
+
+        self.assertEqual(failures, 1)
+        self.assertEqual(logger.error.call_count, 1)
+        self.assertIn("crash.png", logger.error.call_args[0][0])
+        self.assertTrue(logger.warning.called)
+        for name in ("first.png", "third.png", "fourth.png"):
+            self.assertTrue(os.path.exists(self._path(name)))
@@ -0,0 +1,111 @@
+"""
+Tests for connquality.benchmark module
+"""
+
+import os
+from mock import patch
+from connquality.graph import Reader
+from connquality.benchmark import generate_log, run_benchmarks, \
+    compare_results, measure, parse_count, FakeTCPCheck, BENCHMARKS
+from connquality.test.helpers import TempDirTestCase
+
+
+class TestBenchmark(TempDirTestCase):
+    """
+    Tests for the benchmarks
+    """
+
+    def test_generate_log(self):
+        """
+        Test that the synthetic logs parse in every format and have outages
+        """
+
+        for log_format in ("aggregate", "targets", "binary"):
+            generate_log(self.filename, 3000, log_format, outage_rate=0.01)
+
+            reader = Reader()
+            reader.read(self.filename)
+
+            self.assertEqual(reader.entries, 3000)
+            self.assertGreater(reader.statuses.max(), 0)
+            self.assertLess(reader.statuses.mean(), 0.5)
+
+    def test_seed(self):
+        """
+        Test that the same seed gives the same log
+        """
+
+        generate_log(self.filename, 100, seed=1)
+        with open(self.filename, 'rb') as f:
+            first = f.read()
+
+        generate_log(self.filename, 100, seed=1)
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(f.read(), first)
+
+    def test_fake_check(self):
+        """
+        Test that the fake checks measure something and fail at the rate
+        """
+
+        self.assertIsNotNone(FakeTCPCheck("a:1").check())
+
+        check = FakeTCPCheck("a:1", failure_rate=1.0)
+        self.assertIsNone(check.check())
+        self.assertEqual(check.error, check.ERROR_REFUSED)
+
+    def test_run_benchmarks(self):
+        """
+        Test running every benchmark and comparing the results
+        """
+
+        generate_log(self.filename, 1000)
+
+        # A monitor may be appending to the index of a log in use
+        with open(self.filename + ".idx", "wb") as f:
+            f.write(b"in use")
+
+        with patch("connquality.benchmark.CHECK_ROUNDS", 2):
+            results = run_benchmarks(self.filename, repeat=1)
+
+        self.assertEqual([result["name"] for result in results["results"]],
+                         BENCHMARKS)
+        self.assertEqual(results["results"][0]["items"], 1000)
+        self.assertEqual(results["results"][2]["items"], 1000)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ["connection.log", "connection.log.idx"])
+        with open(self.filename + ".idx", "rb") as f:
+            self.assertEqual(f.read(), b"in use")
+
+        previous = dict(results, results=[
+            dict(result, seconds=result["seconds"] * 2)
+            for result in results["results"]
+        ])
+        changes = compare_results(previous, results)
+
+        self.assertEqual(len(changes), len(BENCHMARKS))
+        self.assertAlmostEqual(changes[0][3], -50.0)
+
+        with self.assertRaises(ValueError):
+            compare_results(dict(previous, version=0), results)
+
+    def test_measure(self):
+        """
+        Test that setup runs before every run and the best time is kept
+        """
+
+        calls = []
+        result = measure(lambda: calls.append("run") or 10,
+                         lambda: calls.append("setup"), repeat=2)
+
+        self.assertEqual(calls, ["setup", "run"] * 3)
+        self.assertEqual(result["items"], 10)
+        self.assertIsNotNone(result["peak_memory"])
+
+    def test_parse_count(self):
+        """
+        Test counts in the scientific notation
+        """
+
+        self.assertEqual(parse_count("1e6"), 1000000)
+        self.assertEqual(parse_count("100"), 100)
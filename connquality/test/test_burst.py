@@ -0,0 +1,99 @@
+"""
+Tests for connquality.burst module
+"""
+
+import math
+import numpy
+import unittest2
+from connquality.burst import Burst, percentile, get_columns
+
+
+class TestBurst(unittest2.TestCase):
+    """
+    Tests for Burst
+    """
+
+    def test_percentile(self):
+        """
+        Test that the percentiles match numpy's
+        """
+
+        values = [0.3, 0.1, 0.25, 0.2, 0.9, 0.15, 0.12]
+        ordered = sorted(values)
+
+        for percent in (0, 5, 50, 95, 100):
+            self.assertAlmostEqual(percentile(ordered, len(values), percent),
+                                   numpy.percentile(values, percent))
+
+        self.assertIsNone(percentile(ordered, 0, 50))
+
+    def test_summarize(self):
+        """
+        Test the statistics of a burst with a lost probe
+        """
+
+        burst = Burst(5)
+        for latency in (0.1, 0.3, None, 0.2, 0.4):
+            burst.add(latency, "TIMEOUT" if latency is None else None)
+
+        summary = burst.summarize()
+
+        self.assertEqual(summary["min"], 0.1)
+        self.assertEqual(summary["median"], 0.25)
+        self.assertEqual(summary["p95"], 0.385)
+        self.assertEqual(summary["max"], 0.4)
+        self.assertEqual(summary["loss"], 0.2)
+        self.assertEqual(burst.error, "TIMEOUT")
+
+        # |0.3 - 0.1|, |0.2 - 0.3|, |0.4 - 0.2| smoothed by 1/16
+        jitter = 0.0
+        for difference in (0.2, 0.1, 0.2):
+            jitter += (difference - jitter) / 16
+        self.assertAlmostEqual(summary["jitter"], jitter, 6)
+
+    def test_rounding(self):
+        """
+        Test that every latency statistic is rounded to microseconds
+        """
+
+        burst = Burst(2)
+        burst.add(0.000266282, None)
+        burst.add(0.0012345678, None)
+
+        summary = burst.summarize()
+
+        self.assertEqual(summary["min"], 0.000266)
+        self.assertEqual(summary["max"], 0.001235)
+
+    def test_jitter_carries_on(self):
+        """
+        Test that the jitter estimate continues from the previous burst
+        """
+
+        burst = Burst(2)
+        burst.add(0.1)
+        burst.add(0.1)
+        burst.summarize()
+
+        burst.reset()
+        burst.add(0.5)
+        burst.add(None, "TIMEOUT")
+        summary = burst.summarize()
+
+        self.assertEqual(summary["jitter"], 0.025)
+        self.assertEqual(summary["loss"], 0.5)
+
+    def test_all_lost(self):
+        """
+        Test that a burst without replies has no latencies
+        """
+
+        burst = Burst(3)
+        for _ in range(3):
+            burst.add(None, "REFUSED")
+
+        columns = dict(get_columns(burst.summarize()))
+
+        self.assertTrue(math.isnan(columns["median"]))
+        self.assertEqual(columns["loss"], 1.0)
+        self.assertEqual(columns["jitter"], 0.0)
@@ -0,0 +1,122 @@
+"""
+Tests for connquality.cache module
+"""
+
+import os
+import numpy
+from mock import patch
+from connquality.graph import Reader
+from connquality.parser import parse_file
+from connquality.logformat import AggregateWriter
+from connquality.cache import read_cached, load_cache, get_cache_filename
+from connquality.test.helpers import TempDirTestCase, write_log
+
+
+class TestCache(TempDirTestCase):
+    """
+    Tests for the parsed log cache
+    """
+
+    def _write_log(self, first, count):
+        write_log(AggregateWriter(self.filename), count, first,
+                  latency=lambda number: 0.1 + number)
+
+    def test_read_cached(self):
+        """
+        Test that only the appended lines are parsed
+        """
+
+        self._write_log(0, 100)
+        columns = read_cached(self.filename)
+        self.assertEqual(len(columns["timestamps"]), 100)
+
+        size = os.path.getsize(self.filename)
+        self.assertEqual(int(load_cache(self.filename)["offset"]), size)
+
+        # Append more lines and a partially written one
+        self._write_log(100, 10)
+        with open(self.filename, "ab") as f:
+            f.write(b"2015-01-10T22:5")
+
+        with patch("connquality.cache.parse_file",
+                   wraps=parse_file) as parse_mock:
+            columns = read_cached(self.filename)
+
+            self.assertEqual(parse_mock.call_count, 1)
+            self.assertLess(parse_mock.call_args[1]["limit"], size)
+
+        self.assertEqual(len(columns["timestamps"]), 110)
+        self.assertAlmostEqual(columns["latencies"][-1], 109.1)
+        self.assertTrue(numpy.all(numpy.diff(columns["timestamps"]) > 0))
+
+        # The partial line is parsed once it's complete
+        with open(self.filename, "ab") as f:
+            f.write(b"6:06\t0.5\tDEGRADED\n")
+
+        columns = read_cached(self.filename)
+        self.assertEqual(len(columns["timestamps"]), 111)
+        self.assertEqual(columns["statuses"][-1], 0.5)
+
+    def test_truncated(self):
+        """
+        Test that the cache is dropped when the log is truncated
+        """
+
+        self._write_log(0, 100)
+        read_cached(self.filename)
+
+        with open(self.filename, "w"):
+            pass
+        self._write_log(500, 5)
+
+        columns = read_cached(self.filename)
+        self.assertEqual(len(columns["timestamps"]), 5)
+        self.assertAlmostEqual(columns["latencies"][0], 500.1)
+
+    def test_replaced(self):
+        """
+        Test that the cache is dropped when the log is rotated and a longer
+        one takes its place
+        """
+
+        self._write_log(0, 10)
+        read_cached(self.filename)
+
+        os.rename(self.filename, self.filename + ".1")
+        self._write_log(1000, 20)
+
+        columns = read_cached(self.filename)
+        self.assertEqual(len(columns["timestamps"]), 20)
+        self.assertAlmostEqual(columns["latencies"][0], 1000.1)
+
+    def test_corrupt(self):
+        """
+        Test that a broken cache file is ignored
+        """
+
+        self._write_log(0, 10)
+        with open(get_cache_filename(self.filename), "wb") as f:
+            f.write(b"garbage")
+
+        columns = read_cached(self.filename)
+        self.assertEqual(len(columns["timestamps"]), 10)
+
+    def test_reader(self):
+        """
+        Test that cached reads give the same results as uncached ones
+        """
+
+        self._write_log(0, 1000)
+
+        expected = Reader()
+        expected.read(self.filename, data_points=50)
+
+        for _ in range(2):
+            reader = Reader()
+            reader.read(self.filename, data_points=50, cache=True)
+
+            self.assertEqual(list(reader.timestamps),
+                             list(expected.timestamps))
+            self.assertEqual(list(reader.latencies),
+                             list(expected.latencies))
+            self.assertEqual(reader.entries, expected.entries)
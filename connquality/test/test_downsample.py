@@ -0,0 +1,120 @@
+"""
+Tests for connquality.downsample module
+"""
+
+import numpy
+import unittest2
+from connquality.downsample import lttb, downsample, get_bucket_starts, \
+    filter_average, MODE_LTTB, MODE_ENVELOPE, MODE_AVERAGE
+
+
+def get_columns(count=10000):
+    """
+    Flat latency with a single spike and a single error
+    """
+
+    latencies = numpy.ones(count) * 0.05
+    latencies[1234] = 2.0
+
+    statuses = numpy.zeros(count)
+    statuses[4321] = 1.0
+
+    return {
+        "timestamps": numpy.arange(count) * 30.0,
+        "datetimes": None,
+        "latencies": latencies,
+        "statuses": statuses,
+        "targets": None
+    }
+
+
+class TestDownsample(unittest2.TestCase):
+    """
+    Tests for downsampling
+    """
+
+    def test_lttb(self):
+        """
+        Test that LTTB keeps the end points and the spike
+        """
+
+        x = numpy.arange(1000.0)
+        y = numpy.sin(x / 50.0)
+        y[500] = 10.0
+
+        indexes, starts = lttb(x, y, 100)
+
+        self.assertEqual(len(indexes), 100)
+        self.assertEqual(indexes[0], 0)
+        self.assertEqual(indexes[-1], 999)
+        self.assertIn(500, indexes)
+        self.assertTrue(numpy.all(numpy.diff(indexes) > 0))
+        self.assertTrue(numpy.all(indexes >= starts))
+
+    def test_lttb_small(self):
+        """
+        Test that there's nothing to do when there are few enough points
+        """
+
+        indexes, _ = lttb(numpy.arange(10.0), numpy.arange(10.0), 20)
+        self.assertEqual(list(indexes), list(range(10)))
+
+    def test_bucket_starts(self):
+        """
+        Test splitting into buckets
+        """
+
+        self.assertEqual(list(get_bucket_starts(10, 5)), [0, 2, 4, 6, 8])
+        self.assertEqual(list(get_bucket_starts(3, 5)), [0, 1, 2])
+
+    def test_downsample_lttb(self):
+        """
+        Test that spikes and errors survive LTTB downsampling
+        """
+
+        result = downsample(get_columns(), 100, MODE_LTTB)
+
+        self.assertEqual(len(result["timestamps"]), 100)
+        self.assertEqual(result["latencies"].max(), 2.0)
+        self.assertEqual(result["statuses"].max(), 1.0)
+
+    def test_downsample_envelope(self):
+        """
+        Test that envelopes keep the extremes and the worst status
+        """
+
+        result = downsample(get_columns(), 100, MODE_ENVELOPE)
+
+        self.assertEqual(len(result["timestamps"]), 100)
+        self.assertEqual(result["latency_max"].max(), 2.0)
+        self.assertEqual(result["latency_min"].min(), 0.05)
+        self.assertEqual(result["statuses"].max(), 1.0)
+        self.assertEqual(result["statuses"].sum(), 1.0)
+        self.assertAlmostEqual(result["latencies"].max(),
+                               (0.05 * 99 + 2.0) / 100)
+
+    def test_downsample_envelope_nan(self):
+        """
+        Test that failed checks don't hide the latency of the others
+        """
+
+        columns = get_columns(10000)
+        columns["latencies"][:5] = numpy.nan
+
+        result = downsample(columns, 1000, MODE_ENVELOPE)
+
+        self.assertAlmostEqual(result["latencies"][0], 0.05)
+        self.assertEqual(result["latency_min"][0], 0.05)
+
+    def test_downsample_average(self):
+        """
+        Test that average mode works like Reader._filter always did
+        """
+
+        columns = get_columns()
+        result = downsample(columns, 100, MODE_AVERAGE)
+
+        self.assertTrue(numpy.array_equal(
+            result["latencies"], filter_average(columns["latencies"], 100)
+        ))
+        self.assertLess(result["statuses"].max(), 1.0)
@@ -0,0 +1,194 @@
+"""
+Tests for connquality.engine module
+"""
+
+import time
+import errno
+import socket
+import unittest2
+from mock import Mock
+from connquality.monitor import Check, TCPCheck, get_clock
+from connquality.engine import AsyncEngine, TCPCheckAdapter, get_adapter
+
+
+class SleepCheck(Check):
+    """
+    Blocking check that takes a known amount of time
+    """
+
+    def parse_destination(self, destination):
+        self.delay = float(destination)
+
+    def check(self):
+        time.sleep(self.delay)
+        return self.delay
+
+
+class FailingCheck(SleepCheck):
+    """
+    Blocking check that is refused after a known amount of time and counts
+    its runs
+    """
+
+    def parse_destination(self, destination):
+        super(FailingCheck, self).parse_destination(destination)
+        self.runs = []
+
+    def check(self):
+        self.runs.append(self.delay)
+        time.sleep(self.delay)
+        self.error = self.result.error = Check.ERROR_REFUSED
+        return None
+
+
+class ResolvedCheck(TCPCheck):
+    """
+    TCP check to a fixed address, the native adapter still works for it
+    """
+
+    def _resolve(self):
+        return "127.0.0.1", self.port
+
+
+class RefusedCheck(ResolvedCheck):
+    """
+    TCP check on a fake connection that is always refused
+    """
+
+    connected = False
+
+    def _connect(self, soc):
+        self.connected = True
+        raise socket.error(errno.ECONNREFUSED, "Connection refused")
+
+
+class TestAsyncEngine(unittest2.TestCase):
+    """
+    Tests for AsyncEngine
+    """
+
+    def setUp(self):
+        self.engine = AsyncEngine(timeout=1.0)
+
+    def tearDown(self):
+        self.engine.close()
+
+    def test_get_adapter(self):
+        """
+        Test that TCP checks get the native adapter unless they override
+        what it does
+        """
+
+        self.assertIsInstance(get_adapter(TCPCheck("example.com:80")),
+                              TCPCheckAdapter)
+        self.assertIsInstance(get_adapter(ResolvedCheck("example.com:80")),
+                              TCPCheckAdapter)
+        self.assertNotIsInstance(get_adapter(RefusedCheck("example.com:80")),
+                                 TCPCheckAdapter)
+        self.assertNotIsInstance(get_adapter(SleepCheck("0")),
+                                 TCPCheckAdapter)
+
+        mocked = TCPCheck("example.com:80")
+        mocked.check = Mock(return_value=0.5)
+        self.assertNotIsInstance(get_adapter(mocked), TCPCheckAdapter)
+
+    def test_overridden(self):
+        """
+        Test that TCP checks overriding the socket hooks or check() keep
+        working on the async engine
+        """
+
+        refused = RefusedCheck("example.com:80")
+        mocked = TCPCheck("example.com:80")
+        mocked.check = Mock(return_value=0.5)
+
+        self.assertEqual(self.engine.run([refused, mocked]), [None, 0.5])
+        self.assertEqual(refused.error, Check.ERROR_REFUSED)
+        self.assertTrue(refused.connected)
+        self.assertTrue(mocked.check.called)
+
+    def test_concurrent(self):
+        """
+        Test that checks run at the same time and results keep their order
+        """
+
+        checks = [SleepCheck("0.2"), SleepCheck("0.1"), SleepCheck("0.2")]
+
+        start = get_clock()
+        result = self.engine.run(checks)
+        elapsed = get_clock() - start
+
+        self.assertEqual(result, [0.2, 0.1, 0.2])
+        self.assertLess(elapsed, 0.4)
+
+    def test_timeout(self):
+        """
+        Test that a slow check fails without holding up the others
+        """
+
+        self.engine.timeout = 0.1
+
+        result = self.engine.run([SleepCheck("0.3"), SleepCheck("0")])
+        self.assertEqual(result, [None, 0.0])
+
+    def test_many(self):
+        """
+        Test that no check waits for a free thread, the wait would count
+        against its timeout
+        """
+
+        self.engine.timeout = 0.5
+
+        result = self.engine.run([SleepCheck("0.2") for _ in range(64)])
+        self.assertEqual(result, [0.2] * 64)
+
+    def test_late_thread(self):
+        """
+        Test that the thread of a timed out check can't overwrite the error
+        and timings of the check, and the check isn't started again while
+        the thread is still going
+        """
+
+        self.engine.timeout = 0.1
+
+        check = FailingCheck("0.3")
+        result = check.result
+
+        self.assertEqual(self.engine.run([check]), [None])
+        self.assertEqual(self.engine.run([check]), [None])
+        self.assertEqual(len(check.runs), 1)
+
+        time.sleep(0.4)
+        self.assertEqual(check.error, Check.ERROR_TIMEOUT)
+        self.assertIs(check.result, result)
+        self.assertEqual(result.error, Check.ERROR_TIMEOUT)
+
+        self.engine.timeout = 1.0
+        self.assertEqual(self.engine.run([check]), [None])
+        self.assertEqual(len(check.runs), 2)
+        self.assertEqual(check.error, Check.ERROR_REFUSED)
+
+    def test_tcp(self):
+        """
+        Test the native TCP adapter against a local listener
+        """
+
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        port = server.getsockname()[1]
+
+        try:
+            tcp = TCPCheck("127.0.0.1:{0}".format(port))
+            tcp._close_socket = Mock(side_effect=tcp._close_socket)
+
+            result = self.engine.run([tcp])
+
+            self.assertIsInstance(result[0], float)
+            self.assertIsInstance(tcp.dns_time, float)
+            self.assertEqual(tcp._close_socket.call_count, 1)
+        finally:
+            server.close()
+
+        result = self.engine.run([tcp])
+        self.assertEqual(result, [None])
@@ -2,9 +2,31 @@
 Tests for connquality.graph module
 """
 
+import os
+import numpy
+import shutil
 import unittest2
-from mock import Mock
-from connquality.graph import Reader
+from mock import Mock, patch
+from connquality.graph import Reader, Graph, parse_options, iter_records
+from connquality.parser import parse_file
+from connquality.logformat import BinaryWriter, AggregateWriter, \
+    format_timestamp
+from connquality.rotation import RotatingWriter
+from connquality.sketch import SketchWriter
+from connquality.rollup import RollupWriter, get_rollup_filename
+from connquality.outages import OutageFinder
+from connquality.test.helpers import START, TempDirTestCase, write_log
+
+
+AGGREGATE_LOG = """2015-01-10T21:55:36.959123\t0.1\tOK
+2015-01-10T21:56:06.959123\t0.2\tDEGRADED
+2015-01-10T21:56:36.959123\t3.0\tERROR
+"""
+
+TARGETS_LOG = """2015-01-10T21:55:36.959123\ta:1\t0.1\tOK
+2015-01-10T21:55:46.959123\tb:2\tnan\tTIMEOUT
+2015-01-10T21:56:06.959123\ta:1\t0.2\tOK
+"""
 
 
 class TestReader(unittest2.TestCase):
@@ -50,6 +72,27 @@ class TestReader(unittest2.TestCase):
             result = reader._filter(source, i)
             self.assertEqual(len(result), i)
 
+    def test_filter_array(self):
+        """
+        Test that _filter_array gives the same results as _filter
+        """
+
+        reader = Reader()
+
+        source = list(numpy.random.random(997))
+
+        for target_length in [1, 2, 3, 10, 100, 500, 996, 997, 1000]:
+            expected = reader._filter(source, target_length)
+            result = reader._filter_array(numpy.array(source), target_length)
+            self.assertEqual(len(result), len(expected))
+            self.assertTrue(numpy.allclose(result, expected))
+
+            labels = [str(i) for i in range(997)]
+            picked = reader._filter_array(numpy.array(labels), target_length,
+                                          average=False)
+            expected = reader._filter(labels, target_length)
+            self.assertEqual(list(picked), expected)
+
     def test_filter_avg(self):
         """
         Test that _filter works ok
@@ -70,3 +113,485 @@ class TestReader(unittest2.TestCase):
         result = reader._filter(source, 1)
 
         self.assertEqual(result, expected)
+
+
+class TestReaderFormats(TempDirTestCase):
+    """
+    Tests for reading the different log formats
+    """
+
+    def _write(self, data):
+        with open(self.filename, "w") as f:
+            f.write(data)
+
+    def test_read_aggregate(self):
+        """
+        Test reading the aggregate format
+        """
+
+        self._write(AGGREGATE_LOG)
+
+        reader = Reader()
+        reader.read(self.filename)
+
+        self.assertEqual(reader.entries, 3)
+        self.assertEqual(list(reader.latencies), [0.1, 0.2, 3.0])
+        self.assertEqual(list(reader.statuses), [0, 0.5, 1])
+        self.assertEqual(reader.targets, None)
+
+    def test_read_targets(self):
+        """
+        Test reading the per-target format
+        """
+
+        self._write(TARGETS_LOG)
+
+        reader = Reader()
+        reader.read(self.filename)
+
+        self.assertEqual(reader.entries, 3)
+        self.assertEqual(list(reader.targets), ["a:1", "b:2", "a:1"])
+        self.assertEqual(list(reader.statuses), [0, 1, 0])
+        self.assertEqual(reader.latencies[2], 0.2)
+
+    def test_read_binary(self):
+        """
+        Test reading the binary format
+        """
+
+        writer = BinaryWriter(self.filename)
+        writer.write_summary(1420919736.959123, 0.1, "OK")
+        writer.write_summary(1420919766.959123, 0.2, "DEGRADED")
+        writer.write_summary(1420919796.959123, 3.0, "ERROR")
+        writer.close()
+
+        # Partially written records are ignored
+        with open(self.filename, "ab") as f:
+            f.write(b"\x00\x01")
+
+        reader = Reader()
+        reader.read(self.filename)
+
+        self.assertEqual(reader.entries, 3)
+        self.assertEqual(list(reader.timestamps),
+                         [1420919736.959123, 1420919766.959123,
+                          1420919796.959123])
+        self.assertTrue(numpy.allclose(reader.latencies, [0.1, 0.2, 3.0]))
+        self.assertEqual(list(reader.statuses), [0, 0.5, 1])
+        self.assertEqual(str(reader.timestamp_dts[0]),
+                         reader._iso8601_to_datetime(
+                             "2015-01-10T21:55:36.959123"
+                         ).isoformat())
+
+        reader = Reader()
+        reader.read(self.filename, start="2015-01-10T21:56:00")
+        self.assertEqual(reader.entries, 2)
+
+    def _write_rollups(self, start, count):
+        writer = BinaryWriter(self.filename)
+        rollups = RollupWriter(self.filename)
+
+        for number in range(count):
+            timestamp = start + number * 30
+            status = "ERROR" if number % 100 == 0 else "OK"
+            latency = 3.0 if status == "ERROR" else 0.01 * (1 + number % 7)
+
+            writer.write_summary(timestamp, latency, status)
+            rollups.add(timestamp, latency, status)
+
+        writer.close()
+        return rollups
+
+    def test_read_rollups(self):
+        """
+        Test that the coarsest rollups with enough data points are read
+        instead of the log, finer ones after the last of them
+        """
+
+        # Midnight UTC, two days and a bit with the last hour going on
+        start = 1420848000.0
+        self._write_rollups(start, 2 * 2880 + 150)
+
+        raw = Reader()
+        raw.read(self.filename, data_points=40, mode="envelope",
+                 rollups=False)
+
+        reader = Reader()
+        reader.read(self.filename, data_points=40)
+
+        # Only the last minute going on is missing
+        self.assertEqual(reader.entries, 2 * 2880 + 150 - 2)
+        self.assertEqual(reader.lines, 48 + 74)
+        self.assertEqual(len(reader.latencies), 40)
+        self.assertAlmostEqual(reader.latencies.mean(), raw.latencies.mean(),
+                               delta=0.01)
+        self.assertEqual(reader.statuses.max(), 1)
+        self.assertEqual(reader.latency_max.max(), 3.0)
+
+        # Finding the outages would read the log after all
+        self.assertIsNone(reader.outages)
+        self.assertEqual(len(raw.outages["starts"]), 60)
+
+        # Even the minutes are too coarse
+        reader = Reader()
+        reader.read(self.filename, data_points=10000)
+        self.assertEqual(reader.lines, 2 * 2880 + 150)
+
+    def test_rollups_restart(self):
+        """
+        Test that the buckets written out by a monitor stopping are merged
+        with the rest of them after a restart, not taken as complete
+        """
+
+        # Stopped at 10:05 on the third day, restarted with an ERROR
+        start = 1420848000.0
+        stopped = 2 * 2880 + 1210
+        self._write_rollups(start, stopped).close()
+        self._write_rollups(start + stopped * 30, 1190)
+
+        raw = Reader()
+        raw.read(self.filename, data_points=2, rollups=False)
+
+        reader = Reader()
+        reader.read(self.filename, data_points=2)
+
+        # Only the last minute going on is missing
+        self.assertLess(reader.lines, raw.lines)
+        self.assertEqual(reader.entries, raw.entries - 2)
+        self.assertEqual(list(reader.statuses), [1, 1])
+        self.assertEqual(reader.latency_max.max(), 3.0)
+
+    def test_range_outages(self):
+        """
+        Test that the outages of a time range are found in the entries read
+        for it, without reading the log again
+        """
+
+        def status(number):
+            return "ERROR" if number % 10 < 2 else "OK"
+
+        for writer_class in (AggregateWriter, BinaryWriter):
+            filename = os.path.join(self.tmpdir, writer_class.__name__)
+            write_log(writer_class(filename), 100, status=status)
+
+            reader = Reader()
+            with patch("connquality.outages.iter_columns") as scan:
+                reader.read(filename,
+                            start=format_timestamp(START + 15 * 30),
+                            end=format_timestamp(START + 45 * 30),
+                            data_points=5)
+
+            self.assertFalse(scan.called)
+            self.assertEqual(list(reader.outages["starts"] - START),
+                             [600, 900, 1200])
+            self.assertEqual(list(reader.outages["ends"] - START),
+                             [660, 960, 1260])
+
+            reader = Reader()
+            reader.read(filename, start=format_timestamp(START + 15 * 30),
+                        data_points=5, streaming=True)
+            self.assertEqual(len(reader.outages["starts"]), 8)
+
+    def test_torn_last_line(self):
+        """
+        Test that every way of reading leaves a partially written last line
+        for later
+        """
+
+        write_log(AggregateWriter(self.filename), 100)
+        with open(self.filename, "a") as f:
+            f.write(format_timestamp(START + 100 * 30) + "\t0.")
+
+        start = format_timestamp(START + 10 * 30)
+        for kwargs in ({}, {"start": start}, {"jobs": 2},
+                       {"data_points": 10, "streaming": True},
+                       {"data_points": 10, "streaming": True,
+                        "start": start}):
+            reader = Reader()
+            reader.read(self.filename, **kwargs)
+            self.assertEqual(reader.entries, 100 - 10 * ("start" in kwargs))
+
+        chunks = list(iter_records(self.filename, start))
+        self.assertEqual(len(chunks[0]["timestamps"]), 90)
+
+    def test_update_outages(self):
+        """
+        Test that updates only look for outages in the new entries, an outage
+        going on continues into them
+        """
+
+        write_log(AggregateWriter(self.filename), 12,
+                  status=lambda number: "ERROR" if number >= 10 else "OK")
+
+        reader = Reader()
+        reader.update(self.filename)
+        self.assertEqual(list(reader.outages["ongoing"]), [True])
+
+        write_log(AggregateWriter(self.filename), 8, 12,
+                  status=lambda number: "ERROR" if number < 15 else "OK")
+
+        with patch("connquality.outages.OutageFinder.add_columns",
+                   autospec=True,
+                   side_effect=OutageFinder.add_columns) as add_columns:
+            reader.update(self.filename)
+
+        self.assertEqual(len(add_columns.call_args[0][1]["timestamps"]), 8)
+        self.assertEqual(list(reader.outages["starts"] - START), [300])
+        self.assertEqual(list(reader.outages["ends"] - START), [450])
+        self.assertEqual(list(reader.outages["ongoing"]), [False])
+
+    def test_rollups_after_log(self):
+        """
+        Test that the log is read when the rollups start later than it
+        """
+
+        self._write_rollups(1420848000.0, 2880).close()
+        os.unlink(get_rollup_filename(self.filename, "minute"))
+
+        reader = Reader()
+        reader.read(self.filename, data_points=40)
+        self.assertEqual(reader.lines, 2880)
+
+        self._write_rollups(1420848000.0 + 86400, 10).close()
+
+        reader = Reader()
+        reader.read(self.filename, data_points=40)
+        self.assertEqual(reader.lines, 2890)
+
+    def test_stale_rollups(self):
+        """
+        Test that the log is read when the rollups end before it does, and
+        that reading the rollups tells which mode they stand in for
+        """
+
+        start = 1420848000.0
+        self._write_rollups(start, 2880).close()
+
+        logger = Mock()
+        reader = Reader()
+        reader.read(self.filename, data_points=40, logger=logger)
+        self.assertEqual(reader.lines, 1440)
+        self.assertIn("--downsample=lttb",
+                      " ".join(call[0][0]
+                               for call in logger.info.call_args_list))
+
+        # The monitor went on without --rollups
+        writer = BinaryWriter(self.filename)
+        for number in range(600):
+            writer.write_summary(start + 86400 + number * 30, 0.01, "OK")
+        writer.close()
+
+        reader = Reader()
+        reader.read(self.filename, data_points=40, mode="envelope")
+        self.assertEqual(reader.lines, 3480)
+
+        # Unless only the range the rollups cover is graphed
+        reader = Reader()
+        reader.read(self.filename, start="2015-01-10T06:00:00",
+                    end="2015-01-10T18:00:00", data_points=40)
+        self.assertEqual(reader.lines, 721)
+
+    def test_update(self):
+        """
+        Test that updates only read the new complete lines
+        """
+
+        self._write(AGGREGATE_LOG[:-20])
+
+        reader = Reader()
+        self.assertTrue(reader.update(self.filename))
+        self.assertEqual(list(reader.latencies), [0.1, 0.2])
+        self.assertFalse(reader.update(self.filename))
+
+        with open(self.filename, "a") as f:
+            f.write(AGGREGATE_LOG[-20:])
+
+        with patch("connquality.parser.parse_file",
+                   wraps=parse_file) as parse_mock:
+            self.assertTrue(reader.update(self.filename))
+            self.assertEqual(parse_mock.call_args[1]["limit"],
+                             len(AGGREGATE_LOG.splitlines(True)[2]))
+
+        self.assertEqual(list(reader.latencies), [0.1, 0.2, 3.0])
+
+        # Truncated logs are read again
+        self._write(AGGREGATE_LOG.split("\n", 1)[0] + "\n")
+        self.assertTrue(reader.update(self.filename))
+        self.assertEqual(list(reader.latencies), [0.1])
+
+
+class TestIterRecords(TempDirTestCase):
+    """
+    Tests for iter_records
+    """
+
+    def _write_log(self, writer):
+        write_log(writer, 1000, latency=lambda number: 0.1 + number)
+
+    def test_iter_records(self):
+        """
+        Test that all formats are read in chunks of the same size
+        """
+
+        writers = [
+            AggregateWriter,
+            BinaryWriter,
+            lambda filename: RotatingWriter("aggregate", filename,
+                                            max_size=4096),
+        ]
+
+        for writer in writers:
+            shutil.rmtree(self.tmpdir)
+            os.mkdir(self.tmpdir)
+            self._write_log(writer(self.filename))
+
+            chunks = list(iter_records(self.filename, chunk_size=300))
+
+            self.assertEqual([len(chunk["timestamps"]) for chunk in chunks],
+                             [300, 300, 300, 100])
+
+            latencies = numpy.concatenate([
+                chunk["latencies"] for chunk in chunks
+            ])
+            self.assertTrue(numpy.allclose(latencies,
+                                           numpy.arange(1000) + 0.1))
+
+            for chunk in chunks:
+                self.assertEqual(len(chunk["datetimes"]),
+                                 len(chunk["timestamps"]))
+                self.assertEqual(chunk["targets"], None)
+
+    def test_iter_records_range(self):
+        """
+        Test that the time range can be given either way
+        """
+
+        self._write_log(AggregateWriter(self.filename))
+
+        chunks = list(iter_records(self.filename, "2015-01-10T22:00:36",
+                                   START + 19 * 30))
+
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(len(chunks[0]["timestamps"]), 10)
+        self.assertAlmostEqual(chunks[0]["latencies"][0], 10.1)
+
+
+class TestGraph(TempDirTestCase):
+    """
+    Tests for Graph
+    """
+
+    def setUp(self):
+        super(TestGraph, self).setUp()
+        self.outfile = os.path.join(self.tmpdir, "graph.png")
+
+    def test_update_graph(self):
+        """
+        Test that updating the graph reuses the drawn lines
+        """
+
+        with open(self.filename, "w") as f:
+            f.write(TARGETS_LOG)
+
+        graph = Graph(parse_options([
+            "--logfile", self.filename, "--outfile", self.outfile,
+            "--watch", "1"
+        ]))
+        graph.logger = Mock()
+
+        reader = Reader()
+        reader.update(self.filename)
+        graph._draw_graph(reader)
+
+        figure = graph.figure
+        line = graph.artists["a:1"][0]
+        self.assertEqual(len(line.get_xdata()), 2)
+        self.assertTrue(os.path.exists(self.outfile))
+
+        with open(self.filename, "a") as f:
+            f.write("2015-01-10T21:56:36.959123\ta:1\t0.3\tOK\n"
+                    "2015-01-10T21:56:36.959123\tc:3\t0.3\tOK\n")
+
+        reader.update(self.filename)
+        graph._update_graph(reader)
+
+        self.assertIs(graph.figure, figure)
+        self.assertIs(graph.artists["a:1"][0], line)
+        self.assertEqual(list(line.get_ydata()), [0.1, 0.2, 0.3])
+        self.assertIn("c:3", graph.artists)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ["connection.log", "graph.png"])
+
+    def test_draw_outages(self):
+        """
+        Test that outages are shaded with one collection per status
+        """
+
+        with open(self.filename, "w") as f:
+            f.write(AGGREGATE_LOG)
+
+        graph = Graph(parse_options([
+            "--logfile", self.filename, "--outfile", self.outfile
+        ]))
+        graph.logger = Mock()
+
+        reader = Reader()
+        reader.read(self.filename)
+        self.assertEqual(list(reader.outages["statuses"]), [0.5, 1])
+
+        graph._draw_graph(reader)
+
+        collections = graph.outage_collections
+        self.assertEqual(len(collections), 2)
+        for collection in collections:
+            self.assertIn(collection, graph.latency_axis.collections)
+
+        # Shading is replaced, not added, on updates
+        graph._update_graph(reader)
+        self.assertEqual(len(graph.latency_axis.collections), 2)
+
+    def test_draw_bands(self):
+        """
+        Test that percentile bands are drawn from the sketches
+        """
+
+        with open(self.filename, "w") as f:
+            f.write(AGGREGATE_LOG)
+
+        reader = Reader()
+        reader.read(self.filename)
+
+        writer = SketchWriter(self.filename)
+        for number, timestamp in enumerate(reader.timestamps):
+            writer.add(timestamp, [("a:1", 0.1 * (number + 1), None)])
+        writer.close()
+
+        graph = Graph(parse_options([
+            "--logfile", self.filename, "--outfile", self.outfile,
+            "--percentiles", "95,50", "--datapoints", "10"
+        ]))
+        graph.logger = Mock()
+        self.assertEqual(graph.options.percentiles, [50.0, 95.0])
+
+        graph._read_bands(reader)
+        self.assertEqual(reader.bands["latencies"].shape, (10, 2))
+
+        graph._draw_graph(reader)
+        self.assertEqual(len(graph.band_artists), 3)
+
+        graph._update_graph(reader)
+        self.assertEqual(len(graph.band_artists), 3)
+        self.assertEqual(len(graph.latency_axis.lines), 3)
+
+        with patch("sys.stderr"):
+            with self.assertRaises(SystemExit):
+                parse_options(["--percentiles", "50,101"])
+
+    def test_watch_options(self):
+        """
+        Test that --watch can't be combined with the other read modes
+        """
+
+        with patch("sys.stderr"):
+            with self.assertRaises(SystemExit):
+                parse_options(["--watch", "5", "--cache"])
@@ -0,0 +1,135 @@
+"""
+Tests for connquality.index module
+"""
+
+import os
+from mock import patch
+from connquality.graph import Reader
+from connquality.logformat import AggregateWriter, format_timestamp
+from connquality.index import IndexWriter, Index, build_index, load_index, \
+    read_entries, get_index_filename, parse_timestamp
+from connquality.test.helpers import START, TempDirTestCase, write_log
+
+
+class TestIndex(TempDirTestCase):
+    """
+    Tests for the sidecar index
+    """
+
+    def _write_log(self, count, interval=None):
+        writer = AggregateWriter(self.filename)
+        if interval:
+            writer.index.interval = interval
+            writer.index.lines = interval
+
+        write_log(writer, count)
+
+    def test_parse_timestamp(self):
+        """
+        Test that timestamps are parsed from log lines
+        """
+
+        line = format_timestamp(START).encode() + b"\t0.1\tOK\n"
+        self.assertAlmostEqual(parse_timestamp(line), START, places=6)
+
+    def test_writer(self):
+        """
+        Test that the writer indexes the same lines a rebuild would
+        """
+
+        self._write_log(10, interval=4)
+
+        timestamps, offsets = read_entries(get_index_filename(self.filename))
+        built = build_index(self.filename, interval=4)
+
+        self.assertEqual(offsets, built.offsets)
+        self.assertEqual(len(offsets), 3)
+        for written, parsed in zip(timestamps, built.timestamps):
+            self.assertAlmostEqual(written, parsed, places=6)
+
+    def test_writer_truncated_log(self):
+        """
+        Test that an index pointing past the end of the log is dropped
+        """
+
+        self._write_log(10, interval=4)
+
+        with open(self.filename, "w"):
+            pass
+
+        writer = IndexWriter(self.filename)
+        writer.close()
+
+        self.assertEqual(read_entries(get_index_filename(self.filename)),
+                         ([], []))
+
+    def test_find_range(self):
+        """
+        Test finding offsets for a time range
+        """
+
+        index = Index([10.0, 20.0, 30.0], [0, 100, 200])
+
+        self.assertEqual(index.find_range(), (0, None))
+        self.assertEqual(index.find_range(5.0, 40.0), (0, None))
+        self.assertEqual(index.find_range(20.0, 20.0), (0, 200))
+        self.assertEqual(index.find_range(21.0, 25.0), (100, 200))
+        self.assertEqual(index.find_range(35.0), (200, None))
+
+    def test_load_index(self):
+        """
+        Test that a missing or outdated index is rebuilt
+        """
+
+        self._write_log(3000)
+        os.unlink(get_index_filename(self.filename))
+
+        index = load_index(self.filename)
+        self.assertEqual(len(index.offsets), 3)
+        self.assertTrue(os.path.exists(get_index_filename(self.filename)))
+
+        # Replace the log with a different one
+        os.unlink(self.filename)
+        self._write_log(5)
+        with open(self.filename, "a") as f:
+            f.write("\n" * 100000)
+
+        index = load_index(self.filename)
+        self.assertEqual(index.offsets, [0])
+
+    def test_save_atomic(self):
+        """
+        Test that a rebuilt index replaces the old one without removing it
+        first, readers never see it missing
+        """
+
+        self._write_log(3000)
+        with open(get_index_filename(self.filename), "wb") as f:
+            f.write(b"outdated")
+
+        with patch("connquality.index.os.unlink") as unlink:
+            index = load_index(self.filename)
+
+        self.assertFalse(unlink.called)
+        self.assertEqual(read_entries(get_index_filename(self.filename))[1],
+                         index.offsets)
+
+    def test_read_range(self):
+        """
+        Test that the reader only reads the requested part of the log
+        """
+
+        self._write_log(5000)
+
+        start = format_timestamp(START + 3000 * 30)
+        end = format_timestamp(START + 3100 * 30)
+
+        reader = Reader()
+        reader.read(self.filename, start, end)
+
+        self.assertEqual(reader.entries, 101)
+        self.assertLess(reader.lines, 2048)
+        self.assertAlmostEqual(reader.timestamps[0], START + 3000 * 30,
+                               places=5)
+        self.assertAlmostEqual(reader.timestamps[-1], START + 3100 * 30,
+                               places=5)
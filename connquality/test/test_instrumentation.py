@@ -0,0 +1,117 @@
+"""
+Tests for connquality.instrumentation module
+"""
+
+import io
+import logging
+import unittest2
+from connquality.instrumentation import IterationTimer, TimedStreamHandler, \
+    format_summary, get_cpu_clock, CHECKS, WRITES
+
+
+class FakeClock(object):
+    """
+    Clock that only moves when told to
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestIterationTimer(unittest2.TestCase):
+    """
+    Tests for IterationTimer
+    """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cpu_clock = FakeClock()
+        self.timer = IterationTimer(self.clock, self.cpu_clock)
+
+    def _iteration(self, lateness, checks, writes, cpu):
+        self.timer.start(lateness)
+
+        with self.timer.measure(CHECKS):
+            self.clock.now += checks
+
+        columns = self.timer.get_columns()
+
+        with self.timer.measure(WRITES):
+            self.clock.now += writes
+
+        self.cpu_clock.now += cpu
+        self.timer.finish()
+
+        return dict(columns)
+
+    def test_columns(self):
+        """
+        Test the extra log columns of an iteration
+        """
+
+        self.assertEqual(self._iteration(0.5, 0.1, 0.01, 0.002),
+                         {"lateness": 0.5, "checks": 0.1, "logging": 0.0,
+                          "cpu": 0.0, "last_write": 0.0})
+
+        # Lines get the write time of the previous line
+        columns = self._iteration(0.0, 0.2, 0.02, 0.002)
+        self.assertEqual(columns["last_write"], 0.01)
+
+    def test_summary(self):
+        """
+        Test the mean and max timings and the CPU share
+        """
+
+        self._iteration(0.5, 0.1, 0.01, 0.002)
+        self._iteration(0.0, 0.3, 0.03, 0.002)
+        self.clock.now += 9.56
+
+        summary = self.timer.get_summary()
+
+        self.assertEqual(summary["iterations"], 2)
+        self.assertAlmostEqual(summary["seconds"], 10.0)
+        self.assertAlmostEqual(summary["cpu_percent"], 0.04)
+        self.assertAlmostEqual(summary["mean"]["checks"], 0.2)
+        self.assertAlmostEqual(summary["max"]["lateness"], 0.5)
+        self.assertAlmostEqual(summary["max"]["writes"], 0.03)
+        self.assertIn("2 iterations", format_summary(summary))
+
+        self.timer.reset()
+        self.assertEqual(self.timer.get_summary()["iterations"], 0)
+
+    def test_logging(self):
+        """
+        Test that the time spent logging is counted
+        """
+
+        clock = self.clock
+
+        class SlowStream(io.StringIO):
+            def write(self, data):
+                clock.now += 0.01
+                return io.StringIO.write(self, data)
+
+        handler = TimedStreamHandler(SlowStream(), self.clock)
+        self.timer.handler = handler
+
+        record = logging.LogRecord("test", logging.INFO, __file__, 1,
+                                   "message", None, None)
+
+        self.timer.start(0.0)
+        handler.emit(record)
+
+        self.assertGreater(dict(self.timer.get_columns())["logging"], 0.0)
+        self.assertIn("message", handler.stream.getvalue())
+
+    def test_cpu_clock(self):
+        """
+        Test that the CPU clock counts the work of the process
+        """
+
+        cpu_clock = get_cpu_clock()
+        start = cpu_clock()
+        sum(range(1000000))
+        self.assertGreater(cpu_clock(), start)
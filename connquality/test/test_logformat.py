@@ -0,0 +1,182 @@
+"""
+Tests for connquality.logformat module
+"""
+
+import os
+import shutil
+import tempfile
+import unittest2
+from connquality.logformat import get_writer, AggregateWriter, TargetWriter, \
+    BinaryWriter, FORMAT_AGGREGATE, FORMAT_TARGETS, FORMAT_BINARY, \
+    BINARY_HEADER, BINARY_RECORD, format_timestamp, is_binary, \
+    read_binary_header
+
+TIMESTAMP = 1420919736.959123
+
+
+class TestWriters(unittest2.TestCase):
+    """
+    Tests for the log writers
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "connection.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _read(self):
+        with open(self.filename) as f:
+            return f.read()
+
+    def test_get_writer(self):
+        """
+        Test that formats map to the right writers
+        """
+
+        writer = get_writer(FORMAT_AGGREGATE, self.filename)
+        self.assertIsInstance(writer, AggregateWriter)
+        writer.close()
+
+        writer = get_writer(FORMAT_TARGETS, self.filename)
+        self.assertIsInstance(writer, TargetWriter)
+        writer.close()
+
+        os.unlink(self.filename)
+
+        writer = get_writer(FORMAT_BINARY, self.filename)
+        self.assertIsInstance(writer, BinaryWriter)
+        writer.close()
+
+    def test_aggregate(self):
+        """
+        Test that the aggregate writer only writes round summaries
+        """
+
+        writer = AggregateWriter(self.filename)
+        writer.write_results(TIMESTAMP, [("a:1", 0.1, None)])
+        writer.write_summary(TIMESTAMP, 0.1, "OK")
+        writer.close()
+
+        self.assertEqual(self._read(),
+                         format_timestamp(TIMESTAMP) + "\t0.1\tOK\n")
+
+    def test_targets(self):
+        """
+        Test that the target writer writes a line per result
+        """
+
+        writer = TargetWriter(self.filename)
+        writer.write_results(TIMESTAMP, [
+            ("a:1", 0.1, None),
+            ("b:2", None, "TIMEOUT")
+        ])
+        writer.write_summary(TIMESTAMP, 0.1, "DEGRADED")
+        writer.close()
+
+        timestamp = format_timestamp(TIMESTAMP)
+        self.assertEqual(self._read(),
+                         timestamp + "\ta:1\t0.1\tOK\n" +
+                         timestamp + "\tb:2\tnan\tTIMEOUT\n")
+
+    def test_extra_columns(self):
+        """
+        Test that extra columns are added to the end of text lines
+        """
+
+        extra = [("lateness", 0.001), ("cpu", 0.0005)]
+
+        writer = TargetWriter(self.filename)
+        writer.write_results(TIMESTAMP, [("a:1", 0.1, None)], extra)
+        writer.close()
+
+        writer = AggregateWriter(self.filename)
+        writer.write_summary(TIMESTAMP, 0.1, "OK", extra)
+        writer.close()
+
+        timestamp = format_timestamp(TIMESTAMP)
+        self.assertEqual(self._read(),
+                         timestamp + "\ta:1\t0.1\tOK\tlateness=0.001\t"
+                         "cpu=0.0005\n" +
+                         timestamp + "\t0.1\tOK\tlateness=0.001\t"
+                         "cpu=0.0005\n")
+
+    def test_target_extra_columns(self):
+        """
+        Test that the extra columns of a target only go on its line
+        """
+
+        writer = TargetWriter(self.filename)
+        writer.write_results(TIMESTAMP, [
+            ("a:1", 0.1, None), ("b:2", 0.2, None)
+        ], [("cpu", 0.0005)], {"b:2": [("loss", 0.25)]})
+        writer.close()
+
+        timestamp = format_timestamp(TIMESTAMP)
+        self.assertEqual(self._read(),
+                         timestamp + "\ta:1\t0.1\tOK\tcpu=0.0005\n" +
+                         timestamp + "\tb:2\t0.2\tOK\tloss=0.25\t"
+                         "cpu=0.0005\n")
+
+    def test_binary(self):
+        """
+        Test that the binary writer writes a header and fixed-width records
+        """
+
+        for _ in range(2):
+            writer = BinaryWriter(self.filename)
+            writer.write_summary(TIMESTAMP, 0.5, "DEGRADED")
+            writer.close()
+
+        self.assertTrue(is_binary(self.filename))
+
+        with open(self.filename, "rb") as f:
+            data = f.read()
+
+        header_size, record_size = read_binary_header(data)
+        self.assertEqual(header_size, BINARY_HEADER.size)
+        self.assertEqual(record_size, BINARY_RECORD.size)
+        self.assertEqual(len(data), header_size + 2 * record_size)
+        self.assertEqual(BINARY_RECORD.unpack(data[-record_size:])[:3],
+                         (TIMESTAMP, 0.5, 1))
+
+    def test_binary_torn_write(self):
+        """
+        Test that a partially written last record is dropped before
+        appending, so the new records line up
+        """
+
+        writer = BinaryWriter(self.filename)
+        writer.write_summary(TIMESTAMP, 0.5, "DEGRADED")
+        writer.close()
+
+        with open(self.filename, "ab") as f:
+            f.write(BINARY_RECORD.pack(TIMESTAMP + 30, 0.6, 2)[:5])
+
+        writer = BinaryWriter(self.filename)
+        writer.write_summary(TIMESTAMP + 60, 0.7, "OK")
+        writer.close()
+
+        with open(self.filename, "rb") as f:
+            data = f.read()
+
+        record_size = BINARY_RECORD.size
+        self.assertEqual(len(data), BINARY_HEADER.size + 2 * record_size)
+        timestamp, latency, status = \
+            BINARY_RECORD.unpack(data[-record_size:])[:3]
+        self.assertEqual((timestamp, status), (TIMESTAMP + 60, 0))
+        self.assertAlmostEqual(latency, 0.7, places=6)
+
+    def test_binary_append_text(self):
+        """
+        Test that binary records are never appended to a text log
+        """
+
+        with open(self.filename, "w") as f:
+            f.write(format_timestamp(TIMESTAMP) + "\t0.1\tOK\n")
+
+        self.assertFalse(is_binary(self.filename))
+
+        with self.assertRaises(ValueError):
+            BinaryWriter(self.filename)
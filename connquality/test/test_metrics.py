@@ -0,0 +1,132 @@
+"""
+Tests for connquality.metrics module
+"""
+
+import unittest2
+from mock import Mock
+from connquality.metrics import Metrics, MetricsServer
+from connquality.monitor import Monitor, TCPCheck, Check, parse_options
+
+try:
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+except ImportError:
+    # Python 2
+    from urllib2 import urlopen, HTTPError
+
+START = 1420919736.959123
+
+
+class TestMetrics(unittest2.TestCase):
+    """
+    Tests for Metrics
+    """
+
+    def test_format(self):
+        """
+        Test the per-target metrics and the histogram buckets
+        """
+
+        metrics = Metrics()
+        metrics.add_results(START, [
+            ("a:1", 0.02, None),
+            ("b:2", None, "TIMEOUT")
+        ])
+        metrics.add_results(START + 30, [("a:1", 0.3, None)])
+        metrics.add_summary(START + 30, 0.16, "DEGRADED")
+
+        lines = metrics.format().splitlines()
+
+        self.assertIn('connquality_up{target="a:1"} 1.0', lines)
+        self.assertIn('connquality_up{target="b:2"} 0.0', lines)
+        self.assertIn('connquality_latency_seconds{target="a:1"} 0.3', lines)
+        self.assertIn('connquality_checks_total{target="a:1",result="OK"} '
+                      '2.0', lines)
+        self.assertIn('connquality_checks_total{target="b:2",'
+                      'result="TIMEOUT"} 1.0', lines)
+        self.assertIn('connquality_check_latency_seconds_bucket{'
+                      'target="a:1",le="0.025"} 1.0', lines)
+        self.assertIn('connquality_check_latency_seconds_bucket{'
+                      'target="a:1",le="0.5"} 2.0', lines)
+        self.assertIn('connquality_check_latency_seconds_bucket{'
+                      'target="a:1",le="+Inf"} 2.0', lines)
+        self.assertIn('connquality_check_latency_seconds_count{'
+                      'target="a:1"} 2.0', lines)
+        self.assertIn('connquality_rounds_total{status="DEGRADED"} 1.0',
+                      lines)
+        self.assertIn('connquality_round_latency_seconds 0.16', lines)
+
+    def test_escape(self):
+        """
+        Test that label values are escaped
+        """
+
+        metrics = Metrics()
+        metrics.add_results(START, [('a"\\b', 0.1, None)])
+
+        self.assertIn('connquality_up{target="a\\"\\\\b"} 1.0',
+                      metrics.format().splitlines())
+
+    def test_monitor(self):
+        """
+        Test that the monitor updates the metrics after the checks
+        """
+
+        monitor = Monitor(parse_options(["--tcp=a:1", "--engine=serial",
+                                         "--metrics-port=0"]))
+        monitor.metrics = Metrics()
+
+        check = TCPCheck("a:1")
+        check.check = Mock(return_value=None)
+        check.error = Check.ERROR_REFUSED
+        monitor.checks = [check]
+
+        monitor._run_checks([check])
+
+        self.assertEqual(monitor.metrics.targets["a:1"].results,
+                         {Check.ERROR_REFUSED: 1})
+
+
+class TestMetricsServer(unittest2.TestCase):
+    """
+    Tests for MetricsServer
+    """
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.server = MetricsServer(self.metrics, "127.0.0.1", 0)
+        self.port = self.server.start()
+
+    def tearDown(self):
+        self.server.close()
+
+    def _get(self, path):
+        return urlopen("http://127.0.0.1:{0}{1}".format(self.port, path),
+                       timeout=5)
+
+    def test_scrape(self):
+        """
+        Test that scrapes get the current metrics
+        """
+
+        response = self._get("/metrics")
+        self.assertEqual(response.getcode(), 200)
+        self.assertTrue(
+            response.info()["Content-Type"].startswith("text/plain")
+        )
+        self.assertNotIn(b'target="a:1"', response.read())
+
+        self.metrics.add_results(START, [("a:1", 0.1, None)])
+
+        body = self._get("/metrics").read().decode()
+        self.assertIn('connquality_up{target="a:1"} 1.0', body)
+
+    def test_not_found(self):
+        """
+        Test that only /metrics is served
+        """
+
+        with self.assertRaises(HTTPError) as context:
+            self._get("/")
+
+        self.assertEqual(context.exception.code, 404)
@@ -2,10 +2,37 @@
 Tests for connquality.monitor module
 """
 
+import errno
 import unittest2
 import socket
-from mock import Mock
-from connquality.monitor import parse_options, get_clock, TCPCheck
+from mock import Mock, patch
+from connquality.monitor import parse_options, get_clock, TCPCheck, \
+    Monitor, Check, get_error_class
+
+
+DEFAULT_OPTIONS = {
+    "logfile": "connection.log",
+    "quiet": False,
+    "interval": 30.0,
+    "timeout": 3.0,
+    "engine": "async",
+    "dns_ttl": 300.0,
+    "dns_negative_ttl": 30.0,
+    "spread": True,
+    "format": "aggregate",
+    "rotate_size": None,
+    "rotate_period": None,
+    "compress": True,
+    "burst": 1,
+    "burst_spacing": 0.2,
+    "sketches": False,
+    "rollups": False,
+    "metrics_port": None,
+    "metrics_address": "127.0.0.1",
+    "timing_columns": False,
+    "timing_summary": None,
+    "overhead_budget": None
+}
 
 
 class TestGetClock(unittest2.TestCase):
@@ -72,6 +99,7 @@ class TestTCPCheck(unittest2.TestCase):
 
         totally_a_socket = "I AM TOTALLY A SOCKET"
 
+        tcp._resolve = Mock(return_value=("192.0.2.1", 1000000))
         tcp._get_socket = Mock(return_value=totally_a_socket)
         tcp._close_socket = Mock()
         tcp._connect = Mock()
@@ -80,6 +108,11 @@ class TestTCPCheck(unittest2.TestCase):
         self.assertIsInstance(elapsed, float)
         self.assertGreater(elapsed, 0.0)
         self.assertLess(elapsed, 0.001)
+        self.assertIsInstance(tcp.dns_time, float)
+        self.assertEqual(tcp.sockaddr, ("192.0.2.1", 1000000))
+        self.assertEqual(tcp.result.latency, elapsed)
+        self.assertEqual([phase for phase, _ in tcp.result.get_phases()],
+                         ["resolve", "socket", "connect", "close"])
 
         tcp._connect.assert_called_with(totally_a_socket)
         tcp._close_socket.assert_called_with(totally_a_socket)
@@ -93,15 +126,235 @@ class TestTCPCheck(unittest2.TestCase):
 
         totally_a_socket = "I AM TOTALLY A SOCKET"
 
+        tcp._resolve = Mock(return_value=("192.0.2.1", 1000000))
         tcp._get_socket = Mock(return_value=totally_a_socket)
         tcp._close_socket = Mock()
         tcp._connect = Mock(side_effect=socket.error)
 
         elapsed = tcp.check()
         self.assertEqual(elapsed, None)
+        self.assertEqual(tcp.error, Check.ERROR_SOCKET)
+        self.assertEqual(tcp.result.error, Check.ERROR_SOCKET)
+        self.assertEqual(tcp.result.latency, None)
 
         tcp._connect.assert_called_with(totally_a_socket)
 
+    def test_check_dns_failure(self):
+        """
+        Test that a failed lookup fails the check without connecting
+        """
+
+        resolver = Mock()
+        resolver.resolve.side_effect = socket.gaierror(-2, "Unknown host")
+
+        tcp = TCPCheck("example.com:80", resolver=resolver)
+        tcp._connect = Mock()
+
+        self.assertEqual(tcp.check(), None)
+        self.assertEqual(tcp.error, Check.ERROR_DNS)
+        self.assertEqual(tcp.dns_time, None)
+        resolver.resolve.assert_called_with("example.com", 80)
+        self.assertFalse(tcp._connect.called)
+
+    def test_error_class(self):
+        """
+        Test that socket errors are classified
+        """
+
+        self.assertEqual(get_error_class(socket.timeout()),
+                         Check.ERROR_TIMEOUT)
+        self.assertEqual(get_error_class(socket.gaierror()),
+                         Check.ERROR_DNS)
+        self.assertEqual(get_error_class(socket.error(errno.ECONNREFUSED,
+                                                      "refused")),
+                         Check.ERROR_REFUSED)
+        self.assertEqual(get_error_class(socket.error(errno.EHOSTUNREACH,
+                                                      "unreachable")),
+                         Check.ERROR_UNREACHABLE)
+        self.assertEqual(get_error_class(socket.error()),
+                         Check.ERROR_SOCKET)
+
+
+class TestMonitor(unittest2.TestCase):
+    """
+    Tests for Monitor
+    """
+
+    def test_run_checks(self):
+        """
+        Test that a round is only summarized once every check has reported
+        """
+
+        monitor = Monitor(parse_options(["--tcp=a:1", "--engine=serial"]))
+
+        first = TCPCheck("a:1")
+        first.check = Mock(return_value=0.1)
+        second = TCPCheck("b:1")
+        second.check = Mock(return_value=None)
+        monitor.checks = [first, second]
+
+        self.assertEqual(monitor._run_checks([first]), None)
+        self.assertEqual(monitor._run_checks([first]), None)
+
+        result = monitor._run_checks([second])
+        self.assertEqual(result, (0.1, Monitor.STATUS_DEGRADED))
+        self.assertEqual(monitor.round, {})
+
+    def test_run_checks_results(self):
+        """
+        Test that per-target results are written with their error class
+        """
+
+        monitor = Monitor(parse_options(["--tcp=a:1", "--engine=serial"]))
+        monitor.writer = Mock()
+
+        check = TCPCheck("a:1")
+        check.check = Mock(return_value=None)
+        check.error = Check.ERROR_REFUSED
+        monitor.checks = [check]
+
+        monitor._run_checks([check])
+
+        results = monitor.writer.write_results.call_args[0][1]
+        self.assertEqual(results, [("a:1", None, Check.ERROR_REFUSED)])
+
+    def test_timing_columns(self):
+        """
+        Test that the monitor's own timings are written with the results
+        """
+
+        monitor = Monitor(parse_options(["--tcp=a:1", "--engine=serial",
+                                         "--timing-columns"]))
+        monitor.writer = Mock()
+
+        check = TCPCheck("a:1")
+        check.check = Mock(return_value=0.1)
+        monitor.checks = [check]
+
+        monitor.timer.start(0.25)
+        monitor._run_checks([check])
+
+        extra = dict(monitor.writer.write_results.call_args[0][2])
+        self.assertEqual(extra["lateness"], 0.25)
+        self.assertIn("checks", extra)
+        self.assertIn("cpu", extra)
+
+    def test_burst(self):
+        """
+        Test that a burst probes every target many times and logs the
+        statistics of the burst
+        """
+
+        monitor = Monitor(parse_options(["--tcp=a:1", "--tcp=b:2",
+                                         "--engine=serial", "--burst=4",
+                                         "--burst-spacing=0.5",
+                                         "--format=targets"]))
+        monitor.writer = Mock()
+
+        first = TCPCheck("a:1")
+        first.check = Mock(side_effect=[0.1, 0.3, None, 0.2])
+        first.error = Check.ERROR_TIMEOUT
+        second = TCPCheck("b:2")
+        second.check = Mock(return_value=None)
+        second.error = Check.ERROR_REFUSED
+        monitor.checks = [first, second]
+
+        with patch("connquality.monitor.time.sleep") as sleep:
+            summary = monitor._run_checks(monitor.checks)
+
+        self.assertEqual(sleep.call_count, 3)
+        self.assertEqual(summary, (0.2, Monitor.STATUS_DEGRADED))
+
+        timestamp, results, extra, target_extra = \
+            monitor.writer.write_results.call_args[0]
+        self.assertEqual(results, [("a:1", 0.2, None),
+                                   ("b:2", None, Check.ERROR_REFUSED)])
+
+        columns = dict(target_extra["a:1"])
+        self.assertEqual(columns["min"], 0.1)
+        self.assertEqual(columns["max"], 0.3)
+        self.assertEqual(columns["loss"], 0.25)
+        self.assertEqual(dict(target_extra["b:2"])["loss"], 1.0)
+
+    def test_dns_columns(self):
+        """
+        Test that the lookup times are logged next to the latencies
+        """
+
+        monitor = Monitor(parse_options(["--tcp=a:1", "--tcp=b:2",
+                                         "--engine=serial"]))
+        monitor.writer = Mock()
+
+        first = TCPCheck("a:1")
+        first.check = Mock(return_value=0.1)
+        first.dns_time = 0.02
+        second = TCPCheck("b:2")
+        second.check = Mock(return_value=0.2)
+        second.dns_time = 0.04
+        monitor.checks = [first, second]
+
+        monitor._run_checks(monitor.checks)
+
+        target_extra = monitor.writer.write_results.call_args[0][3]
+        self.assertEqual(target_extra, {"a:1": [("dns", 0.02)],
+                                        "b:2": [("dns", 0.04)]})
+        self.assertEqual(monitor._get_summary_extra(), [("dns", 0.03)])
+
+    def test_sketches(self):
+        """
+        Test that the results of the checks are added to the sketches
+        """
+
+        monitor = Monitor(parse_options(["--tcp=a:1", "--engine=serial",
+                                         "--sketches"]))
+        monitor.sketches = Mock()
+
+        check = TCPCheck("a:1")
+        check.check = Mock(return_value=0.1)
+        monitor.checks = [check]
+
+        monitor._run_checks([check])
+
+        self.assertEqual(monitor.sketches.add.call_args[0][1],
+                         [("a:1", 0.1, None)])
+
+    def test_report_overhead(self):
+        """
+        Test that going over the overhead budget is warned about
+        """
+
+        monitor = Monitor(parse_options([
+            "--tcp=a:1", "--timing-summary=60", "--overhead-budget=1"
+        ]))
+        monitor.logger = Mock()
+        monitor.timer.get_summary = Mock(return_value={
+            "iterations": 2, "seconds": 60.0, "cpu_percent": 5.0,
+            "mean": dict.fromkeys(monitor.timer.totals, 0.0),
+            "max": dict.fromkeys(monitor.timer.totals, 0.0)
+        })
+
+        monitor._report_overhead()
+        self.assertFalse(monitor.logger.info.called)
+
+        monitor.timer.period_start -= 60
+        monitor._report_overhead()
+        self.assertTrue(monitor.logger.info.called)
+        self.assertTrue(monitor.logger.warn.called)
+
+    def test_summarize(self):
+        """
+        Test that failed checks don't drag the average down
+        """
+
+        monitor = Monitor(parse_options(["--tcp=a:1"]))
+
+        self.assertEqual(monitor._summarize([0.1, 0.3, None]),
+                         (0.2, Monitor.STATUS_DEGRADED))
+        self.assertEqual(monitor._summarize([0.1, 0.3]),
+                         (0.2, Monitor.STATUS_OK))
+        self.assertEqual(monitor._summarize([None, None]),
+                         (3.0, Monitor.STATUS_ERROR))
+
 
 class TestParseOptions(unittest2.TestCase):
     """
@@ -121,16 +374,10 @@ class TestParseOptions(unittest2.TestCase):
         Test --tcp
         """
 
-        expected = {
-            "logfile": "connection.log",
-            "quiet": False,
-            "tcp": [
-                "google.com:80",
-                "example.com:123"
-            ],
-            "interval": 30.0,
-            "timeout": 3.0
-        }
+        expected = dict(DEFAULT_OPTIONS, tcp=[
+            "google.com:80",
+            "example.com:123"
+        ])
 
         args = "--tcp=google.com:80 --tcp=example.com:123"
         options = vars(parse_options(args.split(" ")))
@@ -141,13 +388,7 @@ class TestParseOptions(unittest2.TestCase):
         """
         Test that --quiet works
         """
-        expected = {
-            "logfile": "connection.log",
-            "quiet": True,
-            "tcp": ["example.com:123"],
-            "interval": 30.0,
-            "timeout": 3.0
-        }
+        expected = dict(DEFAULT_OPTIONS, tcp=["example.com:123"], quiet=True)
 
         args = "--tcp=example.com:123 --quiet"
         options = vars(parse_options(args.split(" ")))
@@ -159,13 +400,8 @@ class TestParseOptions(unittest2.TestCase):
         Test --logfile
         """
 
-        expected = {
-            "logfile": "test.log",
-            "quiet": False,
-            "tcp": ["example.com:123"],
-            "interval": 30.0,
-            "timeout": 3.0
-        }
+        expected = dict(DEFAULT_OPTIONS, tcp=["example.com:123"],
+                        logfile="test.log")
 
         args = "--tcp=example.com:123 --logfile=test.log"
         options = vars(parse_options(args.split(" ")))
@@ -177,13 +413,8 @@ class TestParseOptions(unittest2.TestCase):
         Test --interval
         """
 
-        expected = {
-            "logfile": "connection.log",
-            "quiet": False,
-            "tcp": ["example.com:123"],
-            "interval": 1.0,
-            "timeout": 3.0
-        }
+        expected = dict(DEFAULT_OPTIONS, tcp=["example.com:123"],
+                        interval=1.0)
 
         args = "--tcp=example.com:123 --interval=1"
         options = vars(parse_options(args.split(" ")))
@@ -195,15 +426,139 @@ class TestParseOptions(unittest2.TestCase):
         Test --timeout
         """
 
-        expected = {
-            "logfile": "connection.log",
-            "quiet": False,
-            "tcp": ["example.com:123"],
-            "interval": 30.0,
-            "timeout": 0.1
-        }
+        expected = dict(DEFAULT_OPTIONS, tcp=["example.com:123"],
+                        timeout=0.1)
 
         args = "--tcp=example.com:123 --timeout=0.1"
         options = vars(parse_options(args.split(" ")))
 
         self.assertEqual(options, expected)
+
+    def test_no_spread(self):
+        """
+        Test --no-spread
+        """
+
+        expected = dict(DEFAULT_OPTIONS, tcp=["example.com:123"],
+                        spread=False)
+
+        args = "--tcp=example.com:123 --no-spread"
+        options = vars(parse_options(args.split(" ")))
+
+        self.assertEqual(options, expected)
+
+    def test_format(self):
+        """
+        Test --format
+        """
+
+        expected = dict(DEFAULT_OPTIONS, tcp=["example.com:123"],
+                        format="targets")
+
+        args = "--tcp=example.com:123 --format=targets"
+        options = vars(parse_options(args.split(" ")))
+
+        self.assertEqual(options, expected)
+
+    def test_rollups(self):
+        """
+        Test that --rollups needs round summaries
+        """
+
+        options = parse_options(["--tcp=a:1", "--rollups"])
+        self.assertTrue(options.rollups)
+
+        with patch("sys.stderr"):
+            with self.assertRaises(SystemExit):
+                parse_options(["--tcp=a:1", "--rollups", "--format=targets"])
+
+    def test_dns_ttl(self):
+        """
+        Test --dns-ttl and --dns-negative-ttl
+        """
+
+        expected = dict(DEFAULT_OPTIONS, tcp=["example.com:123"],
+                        dns_ttl=60.0, dns_negative_ttl=5.0)
+
+        args = "--tcp=example.com:123 --dns-ttl=60 --dns-negative-ttl=5"
+        options = vars(parse_options(args.split(" ")))
+
+        self.assertEqual(options, expected)
+
+    def test_rotate(self):
+        """
+        Test --rotate-size, --rotate-period and --no-compress
+        """
+
+        expected = dict(DEFAULT_OPTIONS, tcp=["example.com:123"],
+                        rotate_size=10 * 1024 * 1024, rotate_period="daily",
+                        compress=False)
+
+        args = "--tcp=example.com:123 --rotate-size=10M " \
+               "--rotate-period=daily --no-compress"
+        options = vars(parse_options(args.split(" ")))
+
+        self.assertEqual(options, expected)
+
+    def test_engine(self):
+        """
+        Test --engine
+        """
+
+        expected = dict(DEFAULT_OPTIONS, tcp=["example.com:123"],
+                        engine="serial")
+
+        args = "--tcp=example.com:123 --engine=serial"
+        options = vars(parse_options(args.split(" ")))
+
+        self.assertEqual(options, expected)
+
+        with self.assertRaises(SystemExit):
+            parse_options("--tcp=example.com:123 --engine=foo".split(" "))
+
+    def test_timing(self):
+        """
+        Test --timing-columns, --timing-summary and --overhead-budget
+        """
+
+        expected = dict(DEFAULT_OPTIONS, tcp=["example.com:123"],
+                        timing_columns=True, timing_summary=3600.0,
+                        overhead_budget=1.0)
+
+        args = "--tcp=example.com:123 --timing-columns " \
+               "--timing-summary=3600 --overhead-budget=1"
+        options = vars(parse_options(args.split(" ")))
+
+        self.assertEqual(options, expected)
+
+    def test_burst(self):
+        """
+        Test --burst and --burst-spacing
+        """
+
+        expected = dict(DEFAULT_OPTIONS, tcp=["example.com:123"], burst=10,
+                        burst_spacing=0.05, format="targets")
+
+        args = "--tcp=example.com:123 --burst=10 --burst-spacing=0.05 " \
+               "--format=targets"
+        options = vars(parse_options(args.split(" ")))
+
+        self.assertEqual(options, expected)
+
+        with patch("sys.stderr"):
+            with self.assertRaises(SystemExit):
+                parse_options(["--tcp=example.com:123", "--burst=10"])
+
+    def test_metrics(self):
+        """
+        Test --metrics-port and --metrics-address
+        """
+
+        expected = dict(DEFAULT_OPTIONS, tcp=["example.com:123"],
+                        metrics_port=9157, metrics_address="0.0.0.0")
+
+        args = "--tcp=example.com:123 --metrics-port=9157 " \
+               "--metrics-address=0.0.0.0"
+        options = vars(parse_options(args.split(" ")))
+
+        self.assertEqual(options, expected)
@@ -0,0 +1,235 @@
+"""
+Tests for connquality.outages module
+"""
+
+import os
+import numpy
+import unittest2
+from mock import patch
+from connquality.parser import parse_text
+from connquality.logformat import AggregateWriter, TargetWriter, \
+    BinaryWriter
+from connquality.rotation import RotatingWriter
+from connquality.outages import OutageFinder, find_runs, update_outages, \
+    read_outages, query_outages, load_outages_index
+from connquality.test.helpers import START, TempDirTestCase, write_log
+
+STATUSES = ["OK", "OK", "ERROR", "ERROR", "DEGRADED", "OK", "OK", "ERROR",
+            "ERROR", "ERROR"]
+
+
+class TestOutageFinder(unittest2.TestCase):
+    """
+    Tests for finding outages
+    """
+
+    def _get_series(self):
+        timestamps = numpy.arange(10) * 30.0
+        statuses = numpy.array([0, 0, 1, 1, 0.5, 0, 0, 1, 1, 1])
+        latencies = numpy.arange(10) / 10.0
+        latencies[statuses == 1] = numpy.nan
+        latencies[3] = 0.9
+
+        return timestamps, statuses, latencies
+
+    def test_find_runs(self):
+        """
+        Test run-length encoding statuses
+        """
+
+        statuses = numpy.array([0, 0, 1, 1, 0.5, 0])
+        self.assertEqual(list(find_runs(statuses)), [0, 2, 4, 5])
+        self.assertEqual(list(find_runs(numpy.zeros(0))), [])
+
+    def test_add(self):
+        """
+        Test that every run of failing checks is an outage lasting until the
+        next check
+        """
+
+        finder = OutageFinder()
+        finder.add(*self._get_series())
+        outages = finder.get_outages()
+
+        self.assertEqual(list(outages["starts"]), [60.0, 120.0, 210.0])
+        self.assertEqual(list(outages["ends"]), [120.0, 150.0, 270.0])
+        self.assertEqual(list(outages["statuses"]), [1, 0.5, 1])
+        self.assertEqual(list(outages["latencies"][:2]), [0.9, 0.4])
+        self.assertTrue(numpy.isnan(outages["latencies"][2]))
+        self.assertEqual(list(outages["ongoing"]), [False, False, True])
+        self.assertIsNone(outages["targets"])
+
+    def test_chunks(self):
+        """
+        Test that adding in chunks gives the same outages
+        """
+
+        timestamps, statuses, latencies = self._get_series()
+
+        expected = OutageFinder()
+        expected.add(timestamps, statuses, latencies)
+        expected = expected.get_outages()
+
+        for size in range(1, 10):
+            finder = OutageFinder()
+            for start in range(0, 10, size):
+                finder.add(timestamps[start:start + size],
+                           statuses[start:start + size],
+                           latencies[start:start + size])
+
+            outages = finder.get_outages()
+            for name in ("starts", "ends", "statuses", "ongoing"):
+                self.assertEqual(list(outages[name]), list(expected[name]))
+
+    def test_targets(self):
+        """
+        Test that the outages of every target are found separately
+        """
+
+        finder = OutageFinder()
+        finder.add_columns(parse_text(
+            b"2015-01-10T21:55:36.959123\ta:1\tnan\tTIMEOUT\n"
+            b"2015-01-10T21:55:36.959123\tb:2\t0.1\tOK\n"
+            b"2015-01-10T21:56:06.959123\ta:1\t0.1\tOK\n"
+            b"2015-01-10T21:56:06.959123\tb:2\tnan\tREFUSED\n"
+        ))
+        outages = finder.get_outages()
+
+        self.assertEqual(list(outages["targets"]), ["a:1", "b:2"])
+        self.assertEqual(list(outages["ongoing"]), [False, True])
+        self.assertEqual(outages["ends"][0] - outages["starts"][0], 30.0)
+
+
+class TestOutageIndex(TempDirTestCase):
+    """
+    Tests for the outage index
+    """
+
+    def _write_log(self, writer, first, count):
+        write_log(writer, count, first,
+                  status=lambda number: STATUSES[number % len(STATUSES)])
+
+    def test_update(self):
+        """
+        Test that only the appended lines are read and an outage going on
+        continues
+        """
+
+        self._write_log(AggregateWriter(self.filename), 0, 9)
+        outages = update_outages(self.filename)
+        self.assertEqual(len(outages["starts"]), 3)
+        self.assertTrue(outages["ongoing"][-1])
+
+        size = os.path.getsize(self.filename)
+        index = load_outages_index(self.filename)
+        self.assertEqual(int(index["offset"]), size)
+
+        self._write_log(AggregateWriter(self.filename), 9, 11)
+
+        with patch("connquality.outages.parse_text",
+                   wraps=parse_text) as parse_mock:
+            outages = update_outages(self.filename)
+
+        self.assertEqual(parse_mock.call_count, 1)
+        self.assertEqual(len(parse_mock.call_args[0][0]),
+                         os.path.getsize(self.filename) - size)
+
+        self.assertEqual(list(outages["starts"] - START),
+                         [60, 120, 210, 360, 420, 510])
+        self.assertEqual(outages["ends"][2] - START, 300)
+        self.assertEqual(list(outages["ongoing"]), [False] * 5 + [True])
+
+    def test_replaced(self):
+        """
+        Test that the index of a replaced log is not used
+        """
+
+        self._write_log(AggregateWriter(self.filename), 0, 10)
+        update_outages(self.filename)
+
+        os.unlink(self.filename)
+        self._write_log(AggregateWriter(self.filename), 0, 2)
+
+        outages = update_outages(self.filename)
+        self.assertEqual(len(outages["starts"]), 0)
+
+    def test_binary(self):
+        """
+        Test the outages of binary logs
+        """
+
+        self._write_log(BinaryWriter(self.filename), 0, 10)
+        self.assertEqual(len(update_outages(self.filename)["starts"]), 3)
+
+        self._write_log(BinaryWriter(self.filename), 10, 10)
+        outages = update_outages(self.filename)
+
+        self.assertEqual(list(outages["starts"] - START),
+                         [60, 120, 210, 360, 420, 510])
+
+    def test_targets(self):
+        """
+        Test the outages of per-target logs
+        """
+
+        writer = TargetWriter(self.filename)
+        for number in range(10):
+            error = None if number % 3 else "TIMEOUT"
+            writer.write_results(START + number * 30, [
+                ("a:1", 0.1, error), ("b:2", 0.1, None)
+            ])
+        writer.close()
+
+        outages = update_outages(self.filename)
+        self.assertEqual(list(outages["targets"]), ["a:1"] * 4)
+
+        outages = update_outages(self.filename)
+        self.assertEqual(list(outages["targets"]), ["a:1"] * 4)
+
+    def test_segments(self):
+        """
+        Test that outages continue from one rotated segment to the next
+        """
+
+        def status(number):
+            return "ERROR" if 10 <= number < 90 else "OK"
+
+        write_log(RotatingWriter("aggregate", self.filename, max_size=1024),
+                  100, status=status)
+
+        outages = read_outages(self.filename)
+
+        self.assertEqual(list(outages["starts"] - START), [300])
+        self.assertEqual(list(outages["ends"] - START), [2700])
+
+    def test_query(self):
+        """
+        Test selecting the outages overlapping a time range
+        """
+
+        self._write_log(AggregateWriter(self.filename), 0, 20)
+        outages = update_outages(self.filename)
+
+        selected = query_outages(outages, START + 130, START + 400)
+        self.assertEqual(list(selected["starts"] - START), [120, 210, 360])
+
+        self.assertEqual(
+            len(read_outages(self.filename, START + 160, START + 200)
+                ["starts"]),
+            0
+        )
+
+    def test_range(self):
+        """
+        Test that a time range is found by reading only the range, without
+        an outage index
+        """
+
+        self._write_log(AggregateWriter(self.filename), 0, 20)
+
+        with patch("connquality.outages.update_outages") as update_mock:
+            outages = read_outages(self.filename, START + 130, START + 400)
+
+        self.assertEqual(list(outages["starts"] - START), [210, 360])
+        self.assertFalse(update_mock.called)
+        self.assertIsNone(load_outages_index(self.filename))
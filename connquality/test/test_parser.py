@@ -0,0 +1,248 @@
+"""
+Tests for connquality.parser module
+"""
+
+import io
+import os
+import time
+import numpy
+import datetime
+import unittest2
+from mock import patch
+from connquality.parser import STATUSES, iter_chunks, local_to_epoch, \
+    parse_text, parse_file, iter_columns, get_time_span, split_ranges, \
+    parse_parallel
+from connquality.logformat import AggregateWriter, BinaryWriter
+from connquality.test.helpers import TempDirTestCase
+
+
+LOG = b"""2015-01-10T21:55:36.959123\t0.1\tOK
+2015-01-10T21:56:06\t0.2\tDEGRADED
+2015-03-29T03:30:00.5\t3.0\tERROR
+2015-01-10T21:55:36.959123\ta:1\t0.1\tOK
+2015-01-10T21:55:46.959123\tb:2\tnan\tTIMEOUT
+2015-01-10T21:55:56.959123\t0.1\tOK\tlateness=0.001
+"""
+
+
+class TestParser(unittest2.TestCase):
+    """
+    Tests for the text log parser
+    """
+
+    def test_iter_chunks(self):
+        """
+        Test that chunks always end at a line boundary
+        """
+
+        data = b"aaa\nbb\ncccc\nd"
+
+        chunks = list(iter_chunks(io.BytesIO(data), 5))
+
+        self.assertEqual(b"".join(chunks), data)
+        for chunk in chunks[:-1]:
+            self.assertTrue(chunk.endswith(b"\n"))
+
+    def test_local_to_epoch(self):
+        """
+        Test that local_to_epoch agrees with time.mktime
+        """
+
+        values = [
+            datetime.datetime(2015, 1, 10, 21, 55, 36, 959123),
+            datetime.datetime(2015, 3, 29, 4, 30, 0, 500000),
+            datetime.datetime(2015, 7, 1, 12, 0, 0),
+            datetime.datetime(2015, 10, 25, 5, 0, 0, 1),
+        ]
+
+        result = local_to_epoch(numpy.array(values, dtype="datetime64[us]"))
+
+        for value, epoch in zip(values, result):
+            expected = time.mktime(value.timetuple()) + value.microsecond / 1E6
+            self.assertAlmostEqual(epoch, expected, places=6)
+
+    def test_parse_text(self):
+        """
+        Test parsing mixed aggregate and per-target lines
+        """
+
+        columns = parse_text(LOG)
+
+        self.assertEqual(
+            [str(value) for value in columns["datetimes"][:3]],
+            ["2015-01-10T21:55:36.959123", "2015-01-10T21:56:06.000000",
+             "2015-03-29T03:30:00.500000"]
+        )
+        self.assertEqual(list(columns["latencies"][:4]),
+                         [0.1, 0.2, 3.0, 0.1])
+        self.assertTrue(numpy.isnan(columns["latencies"][4]))
+        self.assertEqual(list(columns["statuses"]),
+                         [0, 0.5, 1, 0, 1, 0])
+        self.assertEqual(list(columns["targets"]),
+                         ["", "", "", "a:1", "b:2", ""])
+
+    def test_parse_aggregate(self):
+        """
+        Test that aggregate only logs have no targets
+        """
+
+        columns = parse_text(LOG.split(b"\n", 1)[0])
+
+        self.assertEqual(columns["targets"], None)
+        self.assertEqual(list(columns["statuses"]), [STATUSES["OK"]])
+
+    def test_parse_file(self):
+        """
+        Test that parsing in small chunks gives the same result
+        """
+
+        expected = parse_text(LOG)
+        result = parse_file(io.BytesIO(LOG), 50)
+
+        for name in ["timestamps", "datetimes", "statuses", "targets"]:
+            self.assertEqual(list(result[name]), list(expected[name]))
+
+        self.assertTrue(numpy.allclose(result["latencies"],
+                                       expected["latencies"],
+                                       equal_nan=True))
+
+    def test_malformed(self):
+        """
+        Test that lines without enough fields are refused
+        """
+
+        with self.assertRaises(ValueError):
+            parse_text(b"2015-01-10T21:55:36.959123\t0.1\n")
+
+
+class TestIterColumns(TempDirTestCase):
+    """
+    Tests for reading logs in chunks
+    """
+
+    def _write(self, writer_class, name):
+        filename = os.path.join(self.tmpdir, name)
+        writer = writer_class(filename)
+        for number in range(100):
+            writer.write_summary(1420919736.5 + number, 0.1, "OK")
+        writer.close()
+        return filename
+
+    def test_iter_columns(self):
+        """
+        Test that both formats are read in chunks within the range
+        """
+
+        for writer_class in (AggregateWriter, BinaryWriter):
+            filename = self._write(writer_class, writer_class.__name__)
+
+            chunks = list(iter_columns(filename, 1420919746.5, 1420919755.5,
+                                       chunk_size=64))
+            timestamps = numpy.concatenate([
+                chunk["timestamps"] for chunk in chunks
+            ])
+
+            self.assertGreater(len(chunks), 1)
+            self.assertEqual(len(timestamps), 10)
+            self.assertAlmostEqual(timestamps[0], 1420919746.5)
+            self.assertAlmostEqual(timestamps[-1], 1420919755.5)
+
+    def test_torn_last_line(self):
+        """
+        Test that a partially written last line is left for later
+        """
+
+        filename = self._write(AggregateWriter, "connection.log")
+        with open(filename, "ab") as f:
+            f.write(b"2015-01-10T22:00:00\t0.")
+
+        for start in (None, 1420919746.5):
+            chunks = list(iter_columns(filename, start, chunk_size=64))
+            timestamps = numpy.concatenate([
+                chunk["timestamps"] for chunk in chunks
+            ])
+            self.assertAlmostEqual(timestamps[-1], 1420919835.5)
+
+        columns = parse_parallel(filename, jobs=2)
+        self.assertEqual(len(columns["timestamps"]), 100)
+
+    def test_get_time_span(self):
+        """
+        Test finding the first and last timestamps
+        """
+
+        for writer_class in (AggregateWriter, BinaryWriter):
+            filename = self._write(writer_class, writer_class.__name__)
+
+            # Partially written last entries are ignored
+            with open(filename, "ab") as f:
+                f.write(b"2015")
+
+            first, last = get_time_span(filename)
+            self.assertAlmostEqual(first, 1420919736.5)
+            self.assertAlmostEqual(last, 1420919835.5)
+
+        filename = os.path.join(self.tmpdir, "empty.log")
+        open(filename, "w").close()
+        self.assertEqual(get_time_span(filename), (None, None))
+
+
+class TestParseParallel(TempDirTestCase):
+    """
+    Tests for parsing with several processes
+    """
+
+    def setUp(self):
+        super(TestParseParallel, self).setUp()
+
+        with open(self.filename, "wb") as f:
+            f.write(LOG * 1000)
+
+    def test_split_ranges(self):
+        """
+        Test that ranges cover everything and end at line boundaries
+        """
+
+        size = os.path.getsize(self.filename)
+
+        with open(self.filename, "rb") as f:
+            ranges = split_ranges(f, 0, size, 7)
+
+            self.assertEqual(len(ranges), 7)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], size)
+
+            for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, start)
+                f.seek(start - 1)
+                self.assertEqual(f.read(1), b"\n")
+
+    def test_parse_parallel(self):
+        """
+        Test that parsing in parts gives the same result
+        """
+
+        with open(self.filename, "rb") as f:
+            expected = parse_file(f)
+
+        with patch("connquality.parser.PARALLEL_MIN_SIZE", 1024):
+            result = parse_parallel(self.filename, jobs=4)
+
+        for name in ["timestamps", "datetimes", "statuses", "targets"]:
+            self.assertEqual(list(result[name]), list(expected[name]))
+
+        self.assertTrue(numpy.allclose(result["latencies"],
+                                       expected["latencies"],
+                                       equal_nan=True))
+
+    def test_parse_parallel_malformed(self):
+        """
+        Test that errors in the workers are raised
+        """
+
+        with open(self.filename, "ab") as f:
+            f.write(b"2015-01-10T21:55:36.959123\t0.1\n")
+
+        with patch("connquality.parser.PARALLEL_MIN_SIZE", 1024):
+            with self.assertRaises(ValueError):
+                parse_parallel(self.filename, jobs=4)
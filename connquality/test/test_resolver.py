@@ -0,0 +1,110 @@
+"""
+Tests for connquality.resolver module
+"""
+
+import socket
+import threading
+import time
+import unittest2
+from mock import Mock, patch
+from connquality.resolver import Resolver, get_address
+
+
+class TestResolver(unittest2.TestCase):
+    """
+    Tests for Resolver
+    """
+
+    def setUp(self):
+        self.resolver = Resolver(ttl=60, negative_ttl=10)
+        self.now = 1000.0
+        self.resolver.clock = lambda: self.now
+
+    def test_get_address(self):
+        """
+        Test looking up an IP address
+        """
+
+        self.assertEqual(get_address("127.0.0.1", 80), ("127.0.0.1", 80))
+
+    def test_cache(self):
+        """
+        Test that addresses are only looked up once while fresh
+        """
+
+        with patch("connquality.resolver.get_address",
+                   return_value=("192.0.2.1", 80)) as lookup:
+            self.assertFalse(self.resolver.is_cached("a", 80))
+            self.assertEqual(self.resolver.resolve("a", 80),
+                             ("192.0.2.1", 80))
+            self.assertTrue(self.resolver.is_cached("a", 80))
+
+            self.now += 59
+            self.assertEqual(self.resolver.resolve("a", 80),
+                             ("192.0.2.1", 80))
+
+        self.assertEqual(lookup.call_count, 1)
+
+    def test_negative_cache(self):
+        """
+        Test that failed lookups are cached for the negative TTL
+        """
+
+        error = socket.gaierror(-2, "Name or service not known")
+
+        with patch("connquality.resolver.get_address",
+                   side_effect=error) as lookup:
+            for _ in range(2):
+                with self.assertRaises(socket.gaierror):
+                    self.resolver.resolve("a", 80)
+
+        self.assertEqual(lookup.call_count, 1)
+        self.assertEqual(self.resolver.entries[("a", 80)][0], 1010.0)
+
+    def test_refresh(self):
+        """
+        Test that expired addresses are returned while looked up again in the
+        background
+        """
+
+        with patch("connquality.resolver.get_address",
+                   return_value=("192.0.2.1", 80)):
+            self.resolver.resolve("a", 80)
+
+        self.now += 61
+        release = threading.Event()
+
+        def slow_lookup(host, port):
+            release.wait(5)
+            return "192.0.2.2", port
+
+        with patch("connquality.resolver.get_address",
+                   side_effect=slow_lookup) as lookup:
+            self.assertEqual(self.resolver.resolve("a", 80),
+                             ("192.0.2.1", 80))
+            self.assertEqual(self.resolver.resolve("a", 80),
+                             ("192.0.2.1", 80))
+
+            release.set()
+            deadline = time.time() + 5
+            while self.resolver.refreshing and time.time() < deadline:
+                time.sleep(0.01)
+
+        self.assertEqual(lookup.call_count, 1)
+        self.assertEqual(self.resolver.resolve("a", 80), ("192.0.2.2", 80))
+
+    def test_no_cache(self):
+        """
+        Test that a TTL of 0 looks the address up every time
+        """
+
+        resolver = Resolver(ttl=0)
+        resolver._refresh = Mock()
+
+        with patch("connquality.resolver.get_address",
+                   return_value=("192.0.2.1", 80)) as lookup:
+            resolver.resolve("a", 80)
+            resolver.resolve("a", 80)
+
+        self.assertEqual(lookup.call_count, 2)
+        self.assertFalse(resolver.is_cached("a", 80))
@@ -0,0 +1,96 @@
+"""
+Tests for connquality.rollup module
+"""
+
+import os
+import shutil
+import tempfile
+import unittest2
+from connquality.parser import map_rollups, rollup_columns
+from connquality.rollup import RollupWriter, get_rollup_filename, \
+    read_rollup_header
+
+# Midnight UTC
+START = 1420848000.0
+
+
+class TestRollupWriter(unittest2.TestCase):
+    """
+    Tests for RollupWriter
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "connection.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _read(self, resolution):
+        return map_rollups(get_rollup_filename(self.filename, resolution))
+
+    def test_write(self):
+        """
+        Test that a rollup is written as its bucket ends
+        """
+
+        writer = RollupWriter(self.filename)
+        for number in range(250):
+            status = ["OK", "DEGRADED", "ERROR", "OK"][number % 4]
+            writer.add(START + number * 30, 0.01 * (number % 10 + 1), status)
+
+        minutes = self._read("minute")
+        self.assertEqual(len(minutes), 124)
+        self.assertEqual(list(minutes["start"][:2]), [START, START + 60])
+        self.assertEqual(list(minutes["count"][:2]), [2, 2])
+        self.assertEqual(list(minutes["degraded"][:2]), [1, 0])
+        self.assertEqual(list(minutes["errors"][:2]), [0, 1])
+        self.assertAlmostEqual(minutes["sum"][0], 0.03)
+        self.assertEqual((minutes["min"][0], minutes["max"][0]),
+                         (0.01, 0.02))
+
+        hours = self._read("hour")
+        self.assertEqual(list(hours["count"]), [120, 120])
+        self.assertEqual(list(hours["errors"]), [30, 30])
+
+        self.assertFalse(
+            os.path.exists(get_rollup_filename(self.filename, "day"))
+        )
+
+        writer.close()
+        self.assertEqual(list(self._read("day")["count"]), [250])
+
+        # The rest of the bucket after restarting
+        writer = RollupWriter(self.filename)
+        writer.add(START + 250 * 30, 0.5, "OK")
+        writer.close()
+        self.assertEqual(list(self._read("day")["count"]), [250, 1])
+
+    def test_columns(self):
+        """
+        Test the columns and worst status of rollups
+        """
+
+        writer = RollupWriter(self.filename)
+        for number, status in enumerate(["OK", "OK", "DEGRADED", "OK",
+                                         "ERROR", "DEGRADED"]):
+            writer.add(START + number * 30, 0.1, status)
+        writer.close()
+
+        columns = rollup_columns(self._read("minute"), 60)
+
+        self.assertEqual(list(columns["timestamps"] - START),
+                         [30, 90, 150])
+        self.assertEqual(list(columns["statuses"]), [0, 0.5, 1])
+        self.assertEqual(list(columns["counts"]), [2, 2, 2])
+
+    def test_header(self):
+        """
+        Test that other files are not read as rollups
+        """
+
+        with self.assertRaises(ValueError):
+            read_rollup_header(b"CQLOG\x00" + b"\x00" * 10)
+
+        with self.assertRaises(ValueError):
+            read_rollup_header(b"CQROLL")
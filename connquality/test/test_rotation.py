@@ -0,0 +1,146 @@
+"""
+Tests for connquality.rotation module
+"""
+
+import os
+import numpy
+from mock import patch
+from connquality.graph import Reader
+from connquality.parser import iter_columns
+from connquality.logformat import format_timestamp
+from connquality.rotation import RotatingWriter, parse_size, \
+    find_segments, get_segment_filename, compress_segment, PERIOD_DAILY
+from connquality.test.helpers import START, TempDirTestCase, write_log
+
+
+class TestRotation(TempDirTestCase):
+    """
+    Tests for log rotation
+    """
+
+    def _write_log(self, log_format, count, **kwargs):
+        write_log(RotatingWriter(log_format, self.filename, **kwargs), count,
+                  latency=lambda number: 0.1 + number)
+
+    def test_parse_size(self):
+        """
+        Test parsing rotation sizes
+        """
+
+        self.assertEqual(parse_size("1000"), 1000)
+        self.assertEqual(parse_size("10k"), 10240)
+        self.assertEqual(parse_size("1.5M"), 1572864)
+
+        for size in ("", "M", "0", "10X"):
+            with self.assertRaises(ValueError):
+                parse_size(size)
+
+    def test_segment_filename(self):
+        """
+        Test that segments are named after the rotation time in UTC and
+        never overwrite each other
+        """
+
+        segment = get_segment_filename(self.filename, START)
+        self.assertEqual(segment, self.filename + ".20150110T195536Z")
+
+        with open(segment + ".gz", "w"):
+            pass
+
+        self.assertEqual(get_segment_filename(self.filename, START),
+                         segment + "-2")
+
+    def test_rotate_size(self):
+        """
+        Test that rotating by size keeps every entry in order
+        """
+
+        self._write_log("aggregate", 1000, max_size=4096)
+
+        segments = find_segments(self.filename)
+        self.assertGreater(len(segments), 5)
+        self.assertEqual(segments[-1], self.filename)
+
+        for segment in segments[:-1]:
+            self.assertTrue(segment.endswith(".gz"))
+            self.assertFalse(os.path.exists(segment[:-3]))
+
+        reader = Reader()
+        reader.read(self.filename)
+
+        self.assertEqual(reader.entries, 1000)
+        self.assertTrue(numpy.allclose(reader.latencies,
+                                       numpy.arange(1000) + 0.1))
+
+    def test_rotate_binary(self):
+        """
+        Test that every binary segment gets its own header
+        """
+
+        self._write_log("binary", 1000, max_size=4096)
+
+        reader = Reader()
+        reader.read(self.filename)
+
+        self.assertEqual(reader.entries, 1000)
+        self.assertTrue(numpy.allclose(reader.latencies,
+                                       numpy.arange(1000) + 0.1))
+
+        reader = Reader()
+        reader.read(self.filename, data_points=10, streaming=True)
+        self.assertEqual(reader.entries, 1000)
+
+    def test_rotate_period(self):
+        """
+        Test rotating when a new day starts
+        """
+
+        self._write_log("aggregate", 2 * 24 * 120, period=PERIOD_DAILY,
+                        compress=False)
+
+        segments = find_segments(self.filename)
+        self.assertEqual(len(segments), 3)
+
+        for segment in segments[:-1]:
+            reader = Reader()
+            reader.read(segment)
+            days = set(str(value)[:10] for value in reader.timestamp_dts)
+            self.assertEqual(len(days), 1)
+
+    def test_read_overlapping(self):
+        """
+        Test that only the segments overlapping the range are opened
+        """
+
+        self._write_log("aggregate", 1000, max_size=4096)
+
+        start = format_timestamp(START + 500 * 30)
+        end = format_timestamp(START + 520 * 30)
+
+        with patch("connquality.parser.iter_columns",
+                   wraps=iter_columns) as iter_mock:
+            reader = Reader()
+            reader.read(self.filename, start, end)
+
+        self.assertLessEqual(iter_mock.call_count, 2)
+        self.assertEqual(reader.entries, 21)
+        self.assertAlmostEqual(reader.latencies[0], 500.1, places=5)
+
+    def test_compress_leftovers(self):
+        """
+        Test that segments left uncompressed are compressed on start
+        """
+
+        self._write_log("aggregate", 1000, max_size=4096, compress=False)
+
+        segments = find_segments(self.filename)
+        compress_segment(segments[0])
+
+        RotatingWriter("aggregate", self.filename, max_size=4096).close()
+
+        for segment in find_segments(self.filename)[:-1]:
+            self.assertTrue(segment.endswith(".gz"))
+
+        reader = Reader()
+        reader.read(self.filename)
+        self.assertEqual(reader.entries, 1000)
@@ -0,0 +1,150 @@
+"""
+Tests for connquality.scheduler module
+"""
+
+import unittest2
+from connquality.scheduler import Scheduler, parse_schedule
+
+
+class FakeClock(object):
+    """
+    Clock that only moves when slept on or told to
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestParseSchedule(unittest2.TestCase):
+    """
+    Tests for parse_schedule
+    """
+
+    def test_parse_schedule(self):
+        """
+        Test that schedules are split from destinations
+        """
+
+        self.assertEqual(parse_schedule("google.com:80", 30.0),
+                         ("google.com:80", 30.0, None))
+
+        self.assertEqual(parse_schedule("google.com:80@10", 30.0),
+                         ("google.com:80", 10.0, None))
+
+        self.assertEqual(parse_schedule("google.com:80@10+2.5", 30.0),
+                         ("google.com:80", 10.0, 2.5))
+
+    def test_invalid_schedule(self):
+        """
+        Test that invalid schedules will not be accepted
+        """
+
+        with self.assertRaises(ValueError):
+            parse_schedule("google.com:80@", 30.0)
+
+        with self.assertRaises(ValueError):
+            parse_schedule("google.com:80@a", 30.0)
+
+        with self.assertRaises(ValueError):
+            parse_schedule("google.com:80@0", 30.0)
+
+        with self.assertRaises(ValueError):
+            parse_schedule("google.com:80@10+b", 30.0)
+
+
+class TestScheduler(unittest2.TestCase):
+    """
+    Tests for Scheduler
+    """
+
+    def setUp(self):
+        self.fake = FakeClock()
+
+    def _get_scheduler(self, **kwargs):
+        return Scheduler(clock=self.fake.clock, sleep=self.fake.sleep,
+                         **kwargs)
+
+    def test_spread(self):
+        """
+        Test that items sharing an interval are spread across it
+        """
+
+        scheduler = self._get_scheduler()
+        scheduler.add("a", 30.0)
+        scheduler.add("b", 30.0)
+        scheduler.add("c", 30.0)
+        scheduler.start()
+
+        self.assertEqual(scheduler.wait(), (["a"], 0.0))
+        self.assertEqual(scheduler.wait(), (["b"], 0.0))
+        self.assertEqual(self.fake.now, 1010.0)
+        self.assertEqual(scheduler.wait(), (["c"], 0.0))
+        self.assertEqual(self.fake.now, 1020.0)
+        self.assertEqual(scheduler.wait(), (["a"], 0.0))
+        self.assertEqual(self.fake.now, 1030.0)
+
+    def test_no_spread(self):
+        """
+        Test that without spreading everything is due at once
+        """
+
+        scheduler = self._get_scheduler(spread=False)
+        scheduler.add("a", 30.0)
+        scheduler.add("b", 30.0)
+        scheduler.start()
+
+        self.assertEqual(scheduler.wait(), (["a", "b"], 0.0))
+        self.assertEqual(scheduler.wait(), (["a", "b"], 0.0))
+        self.assertEqual(self.fake.now, 1030.0)
+
+    def test_intervals(self):
+        """
+        Test independent intervals and offsets
+        """
+
+        scheduler = self._get_scheduler()
+        scheduler.add("fast", 10.0, 0.0)
+        scheduler.add("slow", 25.0, 5.0)
+        scheduler.start()
+
+        due = []
+        for _ in range(6):
+            items, _ = scheduler.wait()
+            due.append((self.fake.now - 1000.0, sorted(items)))
+
+        self.assertEqual(due, [
+            (0.0, ["fast"]),
+            (5.0, ["slow"]),
+            (10.0, ["fast"]),
+            (20.0, ["fast"]),
+            (30.0, ["fast", "slow"]),
+            (40.0, ["fast"]),
+        ])
+
+    def test_no_drift(self):
+        """
+        Test that slow runs don't push the schedule back, and that lateness
+        is reported
+        """
+
+        scheduler = self._get_scheduler(spread=False)
+        scheduler.add("a", 10.0)
+        scheduler.start()
+
+        scheduler.wait()
+        self.fake.now += 3.0
+        scheduler.wait()
+        self.assertEqual(self.fake.now, 1010.0)
+
+        self.fake.now += 25.0
+        self.assertEqual(scheduler.wait(), (["a"], 15.0))
+
+        # Missed runs are skipped, not bunched up
+        scheduler.wait()
+        self.assertEqual(self.fake.now, 1040.0)
@@ -0,0 +1,183 @@
+"""
+Tests for connquality.sketch module
+"""
+
+import os
+import numpy
+import unittest2
+from connquality.buckets import get_bucket, get_bucket_latency
+from connquality.sketch import QuantileSketch, SketchWriter, \
+    read_sketches, query_sketches, get_bands, get_sketch_filename, \
+    ALL_TARGETS, MINUTE, HOUR, DAY
+from connquality.test.helpers import TempDirTestCase
+
+# Midnight UTC
+START = 1420848000.0
+
+
+class TestQuantileSketch(unittest2.TestCase):
+    """
+    Tests for QuantileSketch
+    """
+
+    def test_buckets(self):
+        """
+        Test that the middle of a bucket is within 1% of its latencies
+        """
+
+        for latency in (0.0005, 0.01234, 0.1, 2.5):
+            middle = get_bucket_latency(get_bucket(latency))
+            self.assertLess(abs(middle - latency) / latency, 0.01)
+
+    def test_quantiles(self):
+        """
+        Test that the quantiles are within 1% of numpy's
+        """
+
+        latencies = numpy.random.RandomState(0).lognormal(-3, 0.5, 10000)
+
+        sketch = QuantileSketch()
+        for latency in latencies:
+            sketch.add(latency)
+        sketch.add(None)
+
+        self.assertEqual(sketch.count, 10000)
+        self.assertEqual(sketch.failures, 1)
+
+        for percentile, value in zip(
+                [1, 50, 95, 99], sketch.get_quantiles([1, 50, 95, 99])):
+            expected = numpy.percentile(latencies, percentile)
+            self.assertLess(abs(value - expected) / expected, 0.011)
+
+        self.assertEqual(sketch.get_quantiles([0, 100]),
+                         [latencies.min(), latencies.max()])
+        self.assertEqual(QuantileSketch().get_quantiles([50]), [None])
+
+    def test_merge(self):
+        """
+        Test that merged sketches are the same as a sketch of everything
+        """
+
+        everything = QuantileSketch()
+        parts = [QuantileSketch(), QuantileSketch()]
+
+        for number in range(100):
+            latency = 0.001 * (number + 1)
+            everything.add(latency)
+            parts[number % 2].add(latency)
+
+        merged = QuantileSketch()
+        for part in parts:
+            merged.merge(part)
+
+        self.assertEqual(merged.buckets, everything.buckets)
+        self.assertEqual(merged.count, 100)
+        self.assertEqual((merged.min, merged.max), (0.001, 0.1))
+        self.assertAlmostEqual(merged.sum, everything.sum)
+
+        copy = QuantileSketch.from_dict(merged.to_dict())
+        self.assertEqual(copy.to_dict(), merged.to_dict())
+
+
+class TestSketchFiles(TempDirTestCase):
+    """
+    Tests for writing and querying the sketch files
+    """
+
+    def _write(self, start, count, interval=30, latency=None):
+        writer = SketchWriter(self.filename)
+        for number in range(count):
+            value = latency if latency is not None else \
+                0.01 * (1 + number % 10)
+            writer.add(start + number * interval, [
+                ("a:1", value, None), ("b:2", None, "TIMEOUT")
+            ])
+
+        return writer
+
+    def test_write(self):
+        """
+        Test that the sketches are written as the buckets end
+        """
+
+        writer = self._write(START, 2 * 120 + 1)
+
+        minutes = list(read_sketches(self.filename, MINUTE))
+        self.assertEqual(len(minutes), 120 * 3)
+        self.assertEqual(minutes[0][:2], (START, ALL_TARGETS))
+        self.assertEqual(minutes[1][2].count, 2)
+        self.assertEqual(minutes[2][2].failures, 2)
+
+        self.assertEqual(len(list(read_sketches(self.filename, HOUR))), 6)
+        self.assertFalse(
+            os.path.exists(get_sketch_filename(self.filename, DAY))
+        )
+
+        writer.close()
+        days = list(read_sketches(self.filename, DAY))
+        self.assertEqual(days[1][2].count, 241)
+
+    def test_seek(self):
+        """
+        Test reading the buckets of a time range
+        """
+
+        self._write(START, 600).close()
+
+        for first, last in ((0, 10), (7, 8), (295, 300), (100, 100)):
+            sketches = list(read_sketches(
+                self.filename, MINUTE, START + first * 60 - 1,
+                START + last * 60
+            ))
+
+            self.assertEqual(len(sketches), (last - first) * 3)
+            if sketches:
+                self.assertEqual(sketches[0][0], START + first * 60)
+
+    def test_query(self):
+        """
+        Test that queries use the coarsest sketches they can and finer ones
+        for the rest of the range
+        """
+
+        # Two days, the second one still going on so only its minutes and
+        # hours are written
+        writer = self._write(START, 2 * 2880 - 60, latency=0.1)
+        writer.add(START + 86400 * 2 - 60, [("a:1", 0.5, None)])
+
+        merged = query_sketches(self.filename)
+        self.assertEqual(merged["a:1"].count, 2 * 2880 - 60)
+        self.assertEqual(merged[ALL_TARGETS].count, 2 * 2880 - 60)
+        self.assertEqual(merged["b:2"].failures, 2 * 2880 - 60)
+
+        # From the middle of an hour to the middle of the second day
+        merged = query_sketches(self.filename, START + 1800,
+                                START + 86400 + 5400)
+        self.assertEqual(merged["a:1"].count, 2880 + 180 - 60)
+
+        # Lines being written are skipped
+        with open(get_sketch_filename(self.filename, MINUTE), "ab") as f:
+            f.write(b"1420848000.0\t{")
+
+        self.assertEqual(query_sketches(self.filename)["a:1"].count,
+                         2 * 2880 - 60)
+
+    def test_bands(self):
+        """
+        Test percentiles over time
+        """
+
+        self._write(START, 240).close()
+
+        times, values = get_bands(self.filename, START, START + 7200, 4,
+                                  [50, 100], "a:1")
+
+        self.assertEqual(times, [START + 900, START + 2700, START + 4500,
+                                 START + 6300])
+        self.assertEqual(len(values), 4)
+        self.assertEqual(values[0][1], 0.1)
+        self.assertAlmostEqual(values[0][0], 0.05, delta=0.001)
+
+        times, values = get_bands(self.filename, START + 7200,
+                                  START + 9000, 2, [50])
+        self.assertEqual(values, [[None], [None]])
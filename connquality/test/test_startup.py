@@ -0,0 +1,86 @@
+"""
+Tests for the startup time of the commandline tools
+"""
+
+import os
+import sys
+import unittest2
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)
+)))
+
+# Import time budgets in seconds for --help, numpy or matplotlib alone takes
+# longer than either budget
+MONITOR_BUDGET = 0.2
+GRAPH_BUDGET = 0.2
+
+
+def get_imports(script, *args):
+    """
+    Run a commandline tool with -X importtime
+
+    :param script: Name of the script in the repository root
+    :return: Dict of top level module names to cumulative import times in
+             seconds, and all the imported module names
+    """
+
+    process = subprocess.Popen(
+        [sys.executable, "-X", "importtime", script] + list(args),
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    _, stderr = process.communicate()
+
+    if process.returncode:
+        raise AssertionError("{0} failed:\n{1}".format(
+            script, stderr.decode()
+        ))
+
+    top_level = {}
+    modules = set()
+
+    for line in stderr.decode().splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        _, cumulative, name = line.split("|")
+        modules.add(name.strip())
+
+        # Nested imports are indented
+        if not name.startswith("  "):
+            top_level[name.strip()] = int(cumulative) / 1E6
+
+    return top_level, modules
+
+
+class TestStartup(unittest2.TestCase):
+    """
+    Tests for keeping --help quick
+    """
+
+    def test_monitor_help(self):
+        """
+        Test that the monitor doesn't import the log reading libraries
+        """
+
+        top_level, modules = get_imports("monitor.py", "--help")
+
+        self.assertNotIn("numpy", modules)
+        self.assertNotIn("connquality.parser", modules)
+        self.assertLess(sum(top_level.values()), MONITOR_BUDGET)
+
+    def test_graph_help(self):
+        """
+        Test that the grapher only loads plotting and log reading libraries
+        for drawing
+        """
+
+        top_level, modules = get_imports("graph.py", "--help")
+
+        self.assertNotIn("numpy", modules)
+        self.assertNotIn("connquality.parser", modules)
+        self.assertNotIn("matplotlib", modules)
+        self.assertNotIn("dateutil", modules)
+        self.assertNotIn("connquality.monitor", modules)
+        self.assertLess(sum(top_level.values()), GRAPH_BUDGET)
@@ -0,0 +1,209 @@
+"""
+Tests for connquality.stats module
+"""
+
+import os
+import sys
+import json
+import numpy
+import unittest2
+import subprocess
+from connquality.logformat import AggregateWriter, TargetWriter
+from connquality.sketch import SketchWriter
+from connquality.stats import SeriesStats, get_stats, format_text, \
+    get_sketch_stats, format_sketch_text, OK, DEGRADED, ERROR
+from connquality.test.helpers import START, TempDirTestCase
+
+
+class TestSeriesStats(unittest2.TestCase):
+    """
+    Tests for SeriesStats
+    """
+
+    def _get_series(self):
+        timestamps = numpy.arange(100) * 30.0
+        latencies = numpy.linspace(0.01, 0.1, 100)
+        statuses = numpy.zeros(100)
+        statuses[10:13] = ERROR
+        statuses[50] = DEGRADED
+        statuses[90:] = ERROR
+
+        # Monitor not running for a while
+        timestamps[60:] += 3600
+
+        return timestamps, latencies, statuses
+
+    def test_add(self):
+        """
+        Test the time spent in every status and the longest outage
+        """
+
+        stats = SeriesStats(max_gap=300)
+        stats.add(*self._get_series())
+        result = stats.get_results()
+
+        self.assertEqual(result["entries"], 100)
+        self.assertEqual(result["error_seconds"], 12 * 30.0)
+        self.assertEqual(result["degraded_seconds"], 30.0)
+        self.assertEqual(result["ok_seconds"], 98 * 30.0 - 30 - 12 * 30)
+        self.assertEqual(result["unmonitored_seconds"], 3630.0)
+        self.assertAlmostEqual(result["uptime"], 100.0 * 85 / 98)
+
+        # The outage at the end of the log is still going on
+        self.assertEqual(result["longest_outage"]["seconds"], 9 * 30.0)
+
+    def test_chunks(self):
+        """
+        Test that adding in chunks gives the same results
+        """
+
+        timestamps, latencies, statuses = self._get_series()
+
+        expected = SeriesStats()
+        expected.add(timestamps, latencies, statuses)
+
+        stats = SeriesStats()
+        for start in range(0, 100, 11):
+            stats.add(timestamps[start:start + 11],
+                      latencies[start:start + 11],
+                      statuses[start:start + 11])
+
+        self.assertEqual(stats.get_results(), expected.get_results())
+
+    def test_percentiles(self):
+        """
+        Test that the percentiles are within 2% of the real ones
+        """
+
+        latencies = numpy.random.RandomState(1).lognormal(-3, 1, 10000)
+
+        stats = SeriesStats()
+        stats.add(numpy.arange(10000.0), latencies, numpy.zeros(10000))
+
+        for percentile in (50, 95, 99):
+            expected = numpy.percentile(latencies, percentile)
+            self.assertLess(
+                abs(stats.get_percentile(percentile) - expected) / expected,
+                0.02
+            )
+
+    def test_failed_latencies(self):
+        """
+        Test that failed checks don't affect the latencies
+        """
+
+        stats = SeriesStats()
+        stats.add(numpy.arange(3.0), numpy.array([0.1, numpy.nan, 3.0]),
+                  numpy.array([OK, OK, ERROR]))
+
+        latency = stats.get_results()["latency"]
+        self.assertEqual(latency["max"], 0.1)
+        self.assertEqual(latency["p99"], 0.1)
+
+
+class TestStats(TempDirTestCase):
+    """
+    Tests for computing the statistics of logs
+    """
+
+    def test_targets(self):
+        """
+        Test that every target gets its own statistics
+        """
+
+        writer = TargetWriter(self.filename)
+        for number in range(10):
+            writer.write_results(START + number * 30, [
+                ("a:1", 0.1, None),
+                ("b:2", None, "TIMEOUT")
+            ])
+        writer.close()
+
+        results = get_stats(self.filename)
+
+        self.assertEqual([result["target"] for result in results],
+                         ["a:1", "b:2"])
+        self.assertEqual(results[0]["uptime"], 100.0)
+        self.assertEqual(results[1]["uptime"], 0.0)
+        self.assertEqual(results[1]["latency"], None)
+        self.assertEqual(results[1]["longest_outage"]["seconds"], 270.0)
+
+        self.assertIn("Target b:2", format_text(self.filename, results))
+
+    def test_torn_last_line(self):
+        """
+        Test that a partially written last line is left for later
+        """
+
+        writer = AggregateWriter(self.filename)
+        for number in range(10):
+            writer.write_summary(START + number * 30, 0.1, "OK")
+        writer.close()
+
+        # The monitor is halfway through writing the next line
+        with open(self.filename, "a") as f:
+            f.write("2015-01-10T22:00:36.959123\t0.")
+
+        for start in (None, START + 60):
+            results = get_stats(self.filename, start)
+            self.assertEqual(results[0]["entries"], 10 - 2 * bool(start))
+
+    def test_sketches(self):
+        """
+        Test the latency statistics from the sketches
+        """
+
+        writer = SketchWriter(self.filename)
+        for number in range(100):
+            writer.add(START + number * 30, [
+                ("a:1", 0.001 * (number + 1), None),
+                ("b:2", None, "TIMEOUT")
+            ])
+        writer.close()
+
+        results = get_sketch_stats(self.filename)
+
+        self.assertEqual([result["target"] for result in results],
+                         [None, "a:1", "b:2"])
+        self.assertEqual(results[0]["checks"], 200)
+        self.assertEqual(results[0]["failures"], 100)
+        self.assertEqual(results[2]["latency"], None)
+
+        latency = results[1]["latency"]
+        self.assertEqual(latency["max"], 0.1)
+        self.assertAlmostEqual(latency["mean"], 0.0505)
+        self.assertAlmostEqual(latency["p50"], 0.05, delta=0.0005)
+
+        self.assertIn("Checks:          100 (100 failed)",
+                      format_sketch_text(self.filename, results))
+
+    def test_cli(self):
+        """
+        Test that the statistics are printed without importing plotting
+        libraries
+        """
+
+        writer = AggregateWriter(self.filename)
+        for number in range(10):
+            writer.write_summary(START + number * 30, 0.1, "OK")
+        writer.close()
+
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__)
+        )))
+        code = (
+            "import sys\n"
+            "sys.argv = ['stats', '--logfile', sys.argv[1], "
+            "'--output', 'json']\n"
+            "from connquality.stats import start_stats\n"
+            "start_stats()\n"
+            "assert 'matplotlib' not in sys.modules\n"
+        )
+
+        output = subprocess.check_output(
+            [sys.executable, "-c", code, self.filename], cwd=root
+        )
+
+        result = json.loads(output.decode())
+        self.assertEqual(result["series"][0]["entries"], 10)
+        self.assertEqual(result["series"][0]["uptime"], 100.0)
@@ -0,0 +1,78 @@
+"""
+Tests for connquality.timing module
+"""
+
+import unittest2
+from mock import Mock
+from connquality.timing import CheckResult, get_nanosecond_clock, \
+    format_phases, RESOLVE, SOCKET, CONNECT, FIRST_BYTE, CLOSE
+
+
+class TestCheckResult(unittest2.TestCase):
+    """
+    Tests for CheckResult
+    """
+
+    def test_nanosecond_clock(self):
+        """
+        Test that the clock gives increasing integer nanoseconds
+        """
+
+        clock = get_nanosecond_clock()
+
+        first = clock()
+        second = clock()
+
+        self.assertIsInstance(first, int)
+        self.assertGreaterEqual(second, first)
+        self.assertLess(second - first, 1000000)
+
+    def test_phases(self):
+        """
+        Test that every phase is timed from the end of the previous phase
+        reached
+        """
+
+        result = CheckResult(Mock(side_effect=[1000000, 2500000, 2700000,
+                                               14700000, 15000000]))
+
+        result.begin()
+        for phase in (RESOLVE, SOCKET, CONNECT, CLOSE):
+            result.mark(phase)
+
+        self.assertEqual(result.get_nanoseconds(RESOLVE), 1500000)
+        self.assertEqual(result.get_nanoseconds(SOCKET), 200000)
+        self.assertEqual(result.get_nanoseconds(CONNECT), 12000000)
+        self.assertEqual(result.get_nanoseconds(FIRST_BYTE), None)
+        self.assertEqual(result.get_nanoseconds(CLOSE), 300000)
+
+        self.assertEqual(result.latency, 0.012)
+        self.assertEqual(result.get_phases(), [
+            (RESOLVE, 0.0015), (SOCKET, 0.0002), (CONNECT, 0.012),
+            (CLOSE, 0.0003)
+        ])
+        self.assertEqual(format_phases(result),
+                         "resolve 1.500ms, socket 0.200ms, connect 12.000ms, "
+                         "close 0.300ms")
+
+    def test_failure(self):
+        """
+        Test that a failed check has no latency and a new run forgets the
+        previous one
+        """
+
+        result = CheckResult(Mock(side_effect=[0, 10, 20, 30]))
+
+        result.begin()
+        result.mark(RESOLVE)
+        result.error = "REFUSED"
+
+        self.assertEqual(result.latency, None)
+        self.assertEqual(result.get_phases(), [(RESOLVE, 0.00000001)])
+
+        result.begin()
+        self.assertEqual(result.error, None)
+        self.assertEqual(result.get_phases(), [])
+
+        result.mark(CONNECT)
+        self.assertEqual(result.get_nanoseconds(CONNECT), 10)
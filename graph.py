@@ -1,6 +1,14 @@
+from multiprocessing import freeze_support
 from connquality.graph import start_grapher
-import FileDialog
+
+try:
+    # Needed by the Tk backend in the frozen Windows build on Python 2
+    import FileDialog
+except ImportError:
+    pass
 
 
 if __name__ == "__main__":
+    # For the --batch worker processes of the frozen Windows build
+    freeze_support()
     start_grapher()
@@ -21,6 +21,7 @@ config = {
 
 packages = [
     'matplotlib.backends.backend_tkagg',
+    'matplotlib.backends.backend_agg',
 ]
 
 setup(name=config["description"],
@@ -33,6 +34,7 @@ setup(name=config["description"],
       },
       executables=[
           Executable("monitor.py", base=None),
-          Executable("graph.py", base=None)
+          Executable("graph.py", base=None),
+          Executable("stats.py", base=None)
       ]
 )
\ No newline at end of file
@@ -0,0 +1,5 @@
+from connquality.stats import start_stats
+
+
+if __name__ == "__main__":
+    start_stats()